@@ -1,14 +1,16 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import datetime
 import traceback
 
 from django.db import transaction
+from django.db.models import Q
 from django.conf import settings
 
 from poleno.cron import cron_job, cron_logger
 from poleno.workdays import workdays
 from poleno.utils.translation import translation
-from poleno.utils.date import local_date, local_today
+from poleno.utils.date import local_date, local_today, utc_now
 from poleno.utils.misc import nop
 
 from .models import Inforequest, Branch, Action
@@ -19,6 +21,153 @@ from .models import Inforequest, Branch, Action
 REMINDER_TIMES = [u'09:00', u'10:00', u'11:00', u'12:00', u'13:00', u'14:00']
 MAINTENANCE_TIMES = [u'02:00', u'03:00', u'04:00', u'05:00']
 
+class DeadlineSweep(object):
+    u"""
+    Snapshot of all open inforequests with their branches and last actions shared by deadline cron
+    jobs. The snapshot is loaded just once and deadlines of all last actions are computed in bulk.
+    Then the branches are classified into buckets, one bucket for every deadline job. The jobs run
+    together by the same ``runcrons`` call share the snapshot. Every bucket may be taken only once,
+    a job asking for an already taken bucket, or for a bucket of a snapshot older than
+    ``MAX_AGE``, gets a fresh snapshot. The jobs must refetch the objects they are going to modify,
+    because the snapshot objects may be modified by previous jobs sharing the snapshot.
+    """
+    MAX_AGE = datetime.timedelta(minutes=1)
+    BUCKETS = (
+            u'obligee_reminder',
+            u'applicant_reminder',
+            u'close',
+            u'expiration',
+            )
+    _current = None
+
+    @classmethod
+    def take(cls, bucket):
+        u"""
+        Takes ``bucket`` from the current sweep, loading a new sweep if necessary.
+        """
+        assert bucket in cls.BUCKETS
+        sweep = cls._current
+        if sweep is None or bucket in sweep.taken or utc_now() - sweep.created > cls.MAX_AGE:
+            sweep = cls._current = cls()
+        sweep.taken.add(bucket)
+        return getattr(sweep, u'_%s_bucket' % bucket)()
+
+    @classmethod
+    def clear(cls):
+        cls._current = None
+
+    def __init__(self):
+        self.created = utc_now()
+        self.taken = set()
+        # Only inforequests with a due branch, or with no branch with a pending event, may be
+        # affected by any deadline job. ``Branch.next_event_date`` is never later than the date a
+        # job acts on the branch. Inforequests with all branches without deadlines are loaded as
+        # well, as they may be closed.
+        today = local_today()
+        due = Branch.objects.with_event_due(today).values(u'inforequest')
+        pending = Branch.objects.with_event_pending(today).values(u'inforequest')
+        self.inforequests = list(Inforequest.objects
+                .not_closed()
+                .filter(Q(pk__in=due) | ~Q(pk__in=pending))
+                .select_undecided_emails_count()
+                .prefetch_related(Inforequest.prefetch_branches())
+                .prefetch_related(Branch.prefetch_last_action(u'branches'))
+                )
+        Action.compute_deadline_status(b.last_action for i in self.inforequests for b in i.branches if b.last_action)
+        self._refresh_next_event_dates()
+
+    def _refresh_next_event_dates(self):
+        # Fixes dates of branches marked as due by the migration adding the column, so they are not
+        # loaded again until their events are due.
+        for inforequest in self.inforequests:
+            for branch in inforequest.branches:
+                next_event_date = Branch.next_event_date_after(branch.last_action)
+                if next_event_date != branch.next_event_date:
+                    branch.next_event_date = next_event_date
+                    Branch.objects.filter(pk=branch.pk).update(next_event_date=next_event_date)
+
+    def _branches_without_undecided_email(self):
+        for inforequest in self.inforequests:
+            if inforequest.has_undecided_emails:
+                continue
+            for branch in inforequest.branches:
+                yield branch
+
+    def _obligee_reminder_bucket(self):
+        filtered = []
+        for branch in self._branches_without_undecided_email():
+            try:
+                if not branch.last_action.has_obligee_deadline:
+                    continue
+                if not branch.last_action.deadline_missed:
+                    continue
+                # The last reminder was sent after the deadline was extended for the last time iff
+                # the extended deadline was missed before the reminder was sent. We don't want to
+                # send any more reminders if the last reminder was sent after the deadline was
+                # extended for the last time.
+                last = branch.last_action.last_deadline_reminder
+                last_date = local_date(last) if last else None
+                if last and branch.last_action.deadline_missed_at(last_date):
+                    continue
+                nop() # To let tests raise testing exception here.
+                filtered.append(branch)
+            except Exception:
+                cron_logger.error(u'Checking if obligee deadline reminder should be sent failed: %s\n%s' % (repr(branch.last_action), traceback.format_exc()))
+        return filtered
+
+    def _applicant_reminder_bucket(self):
+        filtered = []
+        for branch in self._branches_without_undecided_email():
+            try:
+                if not branch.last_action.has_applicant_deadline:
+                    continue
+                # Although Advancement has an applicant deadline, we don't send reminders for it.
+                if branch.last_action.type == Action.TYPES.ADVANCEMENT:
+                    continue
+                # The reminder is sent 2 WDs before the deadline is missed.
+                if branch.last_action.deadline_remaining > 2:
+                    continue
+                # Applicant deadlines may not be extended, so we send at most one applicant
+                # deadline reminder for the action.
+                if branch.last_action.last_deadline_reminder:
+                    continue
+                nop() # To let tests raise testing exception here.
+                filtered.append(branch)
+            except Exception:
+                cron_logger.error(u'Checking if applicant deadline reminder should be sent failed: %s\n%s' % (repr(branch.last_action), traceback.format_exc()))
+        return filtered
+
+    def _close_bucket(self):
+        filtered = []
+        for inforequest in self.inforequests:
+            try:
+                for branch in inforequest.branches:
+                    if branch.last_action.has_deadline and branch.last_action.deadline_remaining > -100:
+                        break
+                else:
+                    nop() # To let tests raise testing exception here.
+                    filtered.append(inforequest) # Every branch that has a deadline have been missed for at least 100 WD.
+            except Exception:
+                cron_logger.error(u'Checking if inforequest should be closed failed: %s\n%s' % (repr(inforequest), traceback.format_exc()))
+        return filtered
+
+    def _expiration_bucket(self):
+        filtered = []
+        for branch in self._branches_without_undecided_email():
+            try:
+                if not branch.last_action.has_obligee_deadline:
+                    continue
+                if not branch.last_action.deadline_missed:
+                    continue
+                if workdays.between(branch.last_action.deadline_date, local_today()) < 30:
+                    continue
+                # Last action obligee deadline was missed at least 30 workdays ago. 30 workdays is
+                # half of EXPIRATION deadline.
+                filtered.append(branch)
+            except Exception:
+                cron_logger.error(u'Checking if expiration action should be added failed: %s\n%s' % (repr(branch), traceback.format_exc()))
+        return filtered
+
 @cron_job(run_at_times=REMINDER_TIMES)
 @transaction.atomic
 def undecided_email_reminder():
@@ -67,34 +216,7 @@ def undecided_email_reminder():
 @transaction.atomic
 def obligee_deadline_reminder():
     with translation(settings.LANGUAGE_CODE):
-        inforequests = (Inforequest.objects
-                .not_closed()
-                .without_undecided_email()
-                .prefetch_related(Inforequest.prefetch_branches())
-                .prefetch_related(Branch.prefetch_last_action(u'branches'))
-                )
-
-        filtered = []
-        for inforequest in inforequests:
-            for branch in inforequest.branches:
-                try:
-                    if not branch.last_action.has_obligee_deadline:
-                        continue
-                    if not branch.last_action.deadline_missed:
-                        continue
-                    # The last reminder was sent after the deadline was extended for the last time iff
-                    # the extended deadline was missed before the reminder was sent. We don't want to
-                    # send any more reminders if the last reminder was sent after the deadline was
-                    # extended for the last time.
-                    last = branch.last_action.last_deadline_reminder
-                    last_date = local_date(last) if last else None
-                    if last and branch.last_action.deadline_missed_at(last_date):
-                        continue
-                    nop() # To let tests raise testing exception here.
-                    filtered.append(branch)
-                except Exception:
-                    cron_logger.error(u'Checking if obligee deadline reminder should be sent failed: %s\n%s' % (repr(branch.last_action), traceback.format_exc()))
-
+        filtered = DeadlineSweep.take(u'obligee_reminder')
         if not filtered:
             return
 
@@ -117,34 +239,7 @@ def obligee_deadline_reminder():
 @transaction.atomic
 def applicant_deadline_reminder():
     with translation(settings.LANGUAGE_CODE):
-        inforequests = (Inforequest.objects
-                .not_closed()
-                .without_undecided_email()
-                .prefetch_related(Inforequest.prefetch_branches())
-                .prefetch_related(Branch.prefetch_last_action(u'branches'))
-                )
-
-        filtered = []
-        for inforequest in inforequests:
-            for branch in inforequest.branches:
-                try:
-                    if not branch.last_action.has_applicant_deadline:
-                        continue
-                    # Although Advancement has an applicant deadline, we don't send reminders for it.
-                    if branch.last_action.type == Action.TYPES.ADVANCEMENT:
-                        continue
-                    # The reminder is sent 2 WDs before the deadline is missed.
-                    if branch.last_action.deadline_remaining > 2:
-                        continue
-                    # Applicant deadlines may not be extended, so we send at most one applicant
-                    # deadline reminder for the action.
-                    if branch.last_action.last_deadline_reminder:
-                        continue
-                    nop() # To let tests raise testing exception here.
-                    filtered.append(branch)
-                except Exception:
-                    cron_logger.error(u'Checking if applicant deadline reminder should be sent failed: %s\n%s' % (repr(branch.last_action), traceback.format_exc()))
-
+        filtered = DeadlineSweep.take(u'applicant_reminder')
         if not filtered:
             return
 
@@ -165,24 +260,16 @@ def applicant_deadline_reminder():
 @cron_job(run_at_times=MAINTENANCE_TIMES)
 @transaction.atomic
 def close_inforequests():
-    inforequests = (Inforequest.objects
+    filtered = DeadlineSweep.take(u'close')
+    if not filtered:
+        return
+
+    filtered = (Inforequest.objects
             .not_closed()
             .prefetch_related(Inforequest.prefetch_branches())
             .prefetch_related(Branch.prefetch_last_action(u'branches'))
+            .filter(pk__in=(o.pk for o in filtered))
             )
-
-    filtered = []
-    for inforequest in inforequests:
-        try:
-            for branch in inforequest.branches:
-                if branch.last_action.has_deadline and branch.last_action.deadline_remaining > -100:
-                    break
-            else:
-                nop() # To let tests raise testing exception here.
-                filtered.append(inforequest) # Every branch that has a deadline have been missed for at least 100 WD.
-        except Exception:
-            cron_logger.error(u'Checking if inforequest should be closed failed: %s\n%s' % (repr(inforequest), traceback.format_exc()))
-
     for inforequest in filtered:
         try:
             with transaction.atomic():
@@ -198,29 +285,15 @@ def close_inforequests():
 @cron_job(run_at_times=MAINTENANCE_TIMES)
 @transaction.atomic
 def add_expirations():
-    inforequests = (Inforequest.objects
-            .not_closed()
-            .without_undecided_email()
-            .prefetch_related(Inforequest.prefetch_branches())
-            .prefetch_related(Branch.prefetch_last_action(u'branches'))
-            )
-
-    filtered = []
-    for inforequest in inforequests:
-        for branch in inforequest.branches:
-            try:
-                if not branch.last_action.has_obligee_deadline:
-                    continue
-                if not branch.last_action.deadline_missed:
-                    continue
-                if workdays.between(branch.last_action.deadline_date, local_today()) < 30:
-                    continue
-                # Last action obligee deadline was missed at least 30 workdays ago. 30 workdays is
-                # half of EXPIRATION deadline.
-                filtered.append(branch)
-            except Exception:
-                cron_logger.error(u'Checking if expiration action should be added failed: %s\n%s' % (repr(branch), traceback.format_exc()))
+    filtered = DeadlineSweep.take(u'expiration')
+    if not filtered:
+        return
 
+    filtered = (Branch.objects
+            .filter(inforequest__closed=False)
+            .prefetch_related(Branch.prefetch_last_action())
+            .filter(pk__in=(o.pk for o in filtered))
+            )
     for branch in filtered:
         try:
             with transaction.atomic():
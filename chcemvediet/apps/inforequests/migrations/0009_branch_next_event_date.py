@@ -0,0 +1,33 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db import models, migrations
+
+
+def forward(apps, schema_editor):
+    # We can't compute the dates here, so we mark all existing branches as due. Deadline cron jobs
+    # recompute the dates of all due branches they check.
+    Branch = apps.get_model(u'inforequests', u'Branch')
+    Branch.objects.update(next_event_date=datetime.date(1970, 1, 1))
+
+def backward(apps, schema_editor):
+    pass
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inforequests', '0008_auto_20150819_1949'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='branch',
+            name='next_event_date',
+            field=models.DateField(help_text='The earliest date at which a deadline cron job may need to act on the branch, NULL if the branch last action has no deadline. Updated automatically whenever a branch action is saved or deleted.', null=True, db_index=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(forward, backward),
+    ]
@@ -0,0 +1,37 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def forward(apps, schema_editor):
+    Inforequest = apps.get_model(u'inforequests', u'Inforequest')
+    for inforequest in Inforequest.objects.all():
+        inforequest.unique_email_key = inforequest.unique_email.lower()
+        inforequest.save(update_fields=[u'unique_email_key'])
+
+def backward(apps, schema_editor):
+    pass
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inforequests', '0009_branch_next_event_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inforequest',
+            name='unique_email_key',
+            field=models.CharField(max_length=255, null=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(forward, backward),
+        migrations.AlterField(
+            model_name='inforequest',
+            name='unique_email_key',
+            field=models.CharField(help_text='Lowercased ``unique_email`` used to match received emails to inforequests. Email addresses are matched case insensitively and unlike ``iexact`` lookups, exact lookups on this field may use its index.', unique=True, max_length=255, db_index=True),
+            preserve_default=True,
+        ),
+    ]
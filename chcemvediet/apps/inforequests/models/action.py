@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 from email.utils import formataddr
 
-from django.core.mail import EmailMessage
+from django.core.mail import EmailMessage, get_connection
 from django.db import models
 from django.db.models import Prefetch, Q, F
 from django.utils.translation import ugettext_lazy as _
@@ -72,6 +72,12 @@ class ActionQuerySet(QuerySet):
         return self.order_by(u'pk')
     def order_by_effective_date(self):
         return self.order_by(u'effective_date', u'pk')
+    def with_deadline_status(self, at=None):
+        u"""
+        Evaluates the queryset and returns a list of its actions with their deadline status
+        computed in bulk. See ``Action.compute_deadline_status()``.
+        """
+        return Action.compute_deadline_status(self, at)
 
 class Action(models.Model):
     # May NOT be NULL
@@ -311,6 +317,46 @@ class Action(models.Model):
         """
         return list(self.attachment_set.order_by_pk())
 
+    @staticmethod
+    def compute_deadline_status(actions, at=None):
+        u"""
+        Computes deadline status of all given actions at date ``at`` in a single pass. Working days
+        for all actions are computed together, using the holiday set index directly, so it's much
+        cheaper than computing the properties action by action. Every action gets attribute
+        ``deadline_status`` with ``at``, ``days_passed``, ``deadline_remaining``,
+        ``deadline_missed`` and ``deadline_date`` values. Cached property ``deadline_date`` is set
+        as well, and if ``at`` is today, also cached properties ``days_passed``,
+        ``deadline_remaining`` and ``deadline_missed``. Returns the list of the given actions.
+        """
+        actions = list(actions)
+        today = local_today()
+        if at is None:
+            at = today
+
+        with_deadline = [a for a in actions if a.deadline is not None]
+        days_passed = workdays.between_many((a.effective_date, at) for a in actions)
+        deadline_dates = workdays.advance_many((a.effective_date, a.deadline + (a.extension or 0)) for a in with_deadline)
+        deadline_dates = dict(zip((id(a) for a in with_deadline), deadline_dates))
+
+        for action, passed in zip(actions, days_passed):
+            if action.deadline is None:
+                remaining = None
+            else:
+                remaining = action.deadline + (action.extension or 0) - passed
+            action.deadline_status = Bunch(
+                    at=at,
+                    days_passed=passed,
+                    deadline_remaining=remaining,
+                    deadline_missed=(remaining is not None and remaining < 0),
+                    deadline_date=deadline_dates.get(id(action)),
+                    )
+            action.__dict__[u'deadline_date'] = action.deadline_status.deadline_date
+            if at == today:
+                action.__dict__[u'days_passed'] = action.deadline_status.days_passed
+                action.__dict__[u'deadline_remaining'] = action.deadline_status.deadline_remaining
+                action.__dict__[u'deadline_missed'] = action.deadline_status.deadline_missed
+        return actions
+
     @cached_property
     def is_applicant_action(self):
         return self.type in self.APPLICANT_ACTION_TYPES
@@ -400,9 +446,12 @@ class Action(models.Model):
         # must be sanitized and the content type white listed for known content types. Any unknown
         # content type should be replaced with 'application/octet-stream'.
 
-        msg = EmailMessage(self.subject, self.content, sender_formatted, recipients)
-        for attachment in self.attachments:
-            msg.attach(attachment.name, attachment.content, attachment.content_type)
+        # Our email backend accepts ``Attachment`` instances as message attachments and clones
+        # them, so we don't need to load their content. Other backends accept only tuples or MIME
+        # parts and do not set ``msg.instance``, so we must not send the message with them.
+        connection = get_connection(u'poleno.mail.backend.EmailBackend')
+        msg = EmailMessage(self.subject, self.content, sender_formatted, recipients, connection=connection)
+        msg.attachments.extend(self.attachments)
         msg.send()
 
         inforequestemail = InforequestEmail(
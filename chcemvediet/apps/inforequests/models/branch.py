@@ -1,11 +1,14 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import datetime
+
 from django.db import models, connection
 from django.db.models import Q, F, Prefetch
 from django.utils.functional import cached_property
 
 from poleno import datacheck
 from poleno.utils.models import QuerySet, join_lookup
+from poleno.utils.date import local_date
 from poleno.utils.misc import squeeze, decorate
 
 from .action import Action
@@ -15,6 +18,10 @@ class BranchQuerySet(QuerySet):
         return self.filter(advanced_by__isnull=True)
     def advanced(self):
         return self.filter(advanced_by__isnull=False)
+    def with_event_due(self, at):
+        return self.filter(next_event_date__lte=at)
+    def with_event_pending(self, at):
+        return self.filter(next_event_date__gt=at)
     def order_by_pk(self):
         return self.order_by(u'pk')
 
@@ -39,6 +46,15 @@ class Branch(models.Model):
                 advanced branches. Every Inforequest must contain exactly one main branch.
                 """))
 
+    # May be NULL; Automaticly updated whenever any branch action is saved or deleted. Used by
+    # ``cron.DeadlineSweep``.
+    next_event_date = models.DateField(blank=True, null=True, db_index=True,
+            help_text=squeeze(u"""
+                The earliest date at which a deadline cron job may need to act on the branch, NULL
+                if the branch last action has no deadline. Updated automatically whenever a branch
+                action is saved or deleted.
+                """))
+
     # Backward relations:
     #
     #  -- action_set: by Action.branch
@@ -290,6 +306,46 @@ class Branch(models.Model):
 
         super(Branch, self).save(*args, **kwargs)
 
+    @staticmethod
+    def next_event_date_after(action):
+        u"""
+        Returns the earliest date at which a deadline cron job may need to act on a branch with the
+        given last action, or None if the action has no deadline. Deadline cron jobs send obligee
+        and applicant deadline reminders, add expirations and close inforequests. The returned
+        date is computed in calendar days instead of working days. As every working day is a
+        calendar day, the date never comes later than the date the jobs compute in working days.
+        So it's safe for the jobs to skip all branches with their events in future.
+        """
+        if action is None or action.deadline is None:
+            return None
+        deadline = action.deadline + (action.extension or 0)
+        close_date = action.effective_date + datetime.timedelta(days=deadline+100)
+
+        if action.has_obligee_deadline:
+            last = action.last_deadline_reminder
+            if last and action.deadline_missed_at(local_date(last)):
+                # The reminder was sent already, the next event is the expiration.
+                return action.deadline_date + datetime.timedelta(days=30)
+            return action.effective_date + datetime.timedelta(days=deadline+1)
+
+        if action.has_applicant_deadline:
+            if action.type != Action.TYPES.ADVANCEMENT and not action.last_deadline_reminder:
+                return action.effective_date + datetime.timedelta(days=deadline-2)
+            return close_date
+
+        return close_date
+
+    def update_next_event_date(self):
+        u"""
+        Recomputes ``next_event_date`` from the branch last action fetched from the database and
+        updates it in the database if it changed.
+        """
+        last_action = self.action_set.order_by_effective_date().last()
+        next_event_date = self.next_event_date_after(last_action)
+        if next_event_date != self.next_event_date:
+            self.next_event_date = next_event_date
+            Branch.objects.filter(pk=self.pk).update(next_event_date=next_event_date)
+
     def add_expiration_if_expired(self):
         if self.last_action.has_obligee_deadline and self.last_action.deadline_missed:
             expiration = Action(
@@ -27,6 +27,8 @@ class InforequestQuerySet(QuerySet):
         return self.filter(closed=True)
     def not_closed(self):
         return self.filter(closed=False)
+    def with_unique_email_in(self, addresses):
+        return self.filter(unique_email_key__in=set(a.lower() for a in addresses))
     def with_undecided_email(self):
         return self.filter(inforequestemail__type=InforequestEmail.TYPES.UNDECIDED).distinct()
     def without_undecided_email(self):
@@ -88,6 +90,14 @@ class Inforequest(models.Model):
                 tell them to send their response to a different email address.
                 """))
 
+    # May NOT be empty; Unique; Read-only; Automaticly computed in save() from ``unique_email``.
+    unique_email_key = models.CharField(max_length=255, unique=True, db_index=True,
+            help_text=squeeze(u"""
+                Lowercased ``unique_email`` used to match received emails to inforequests. Email
+                addresses are matched case insensitively and unlike ``iexact`` lookups, exact
+                lookups on this field may use its index.
+                """))
+
     # Should NOT be empty
     subject = models.CharField(blank=True, max_length=255,
             help_text=squeeze(u"""
@@ -436,6 +446,7 @@ class Inforequest(models.Model):
             while True:
                 token = random_readable_string(length)
                 self.unique_email = settings.INFOREQUEST_UNIQUE_EMAIL.format(token=token)
+                self.unique_email_key = self.unique_email.lower()
                 try:
                     with transaction.atomic():
                         super(Inforequest, self).save(*args, **kwargs)
@@ -444,6 +455,7 @@ class Inforequest(models.Model):
                     if length <= 10:
                         continue
                     self.unique_email = None
+                    self.unique_email_key = None
                     raise # Give up
                 return # object is already saved
 
@@ -1,44 +1,66 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
-import operator
-
 from django.dispatch import receiver
-from django.db.models import Q
-from django.db.models.signals import post_delete
+from django.db.models.signals import post_save, post_delete
 from django.conf import settings
 from django.contrib.sessions.models import Session
+from django.contrib.contenttypes.models import ContentType
 
 from poleno.attachments.models import Attachment
-from poleno.mail.signals import message_received
+from poleno.mail.models import Message, Recipient
+from poleno.mail.signals import messages_received, messages_changed
 from poleno.utils.translation import translation
 
-from .models import Inforequest, InforequestEmail
+from .models import Inforequest, InforequestEmail, Branch, Action
+from . import timeline
 
-@receiver(message_received)
-def assign_email_on_message_received(sender, message, **kwargs):
+def _message_addresses(message):
     if message.received_for:
-        q = Q(unique_email__iexact=message.received_for)
-    elif message.recipients:
-        q = (Q(unique_email__iexact=r.mail) for r in message.recipients)
-        q = reduce(operator.or_, q)
-    else:
+        return [message.received_for.lower()]
+    return [r.mail.lower() for r in message.recipients]
+
+@receiver(messages_received)
+def assign_emails_on_messages_received(sender, messages, **kwargs):
+    u"""
+    Assigns received messages to inforequests their addresses belong to. If a message has
+    ``received_for`` address, only this address is used. Otherwise, all message recipients are
+    used. Messages matching no inforequest or more than one inforequest are not assigned. All
+    messages in the batch are matched with a single query.
+    """
+    addresses = [(m, _message_addresses(m)) for m in messages]
+    keys = set(a for m, aa in addresses for a in aa)
+    if not keys:
         return
 
-    try:
-        inforequest = Inforequest.objects.get(q)
-    except (Inforequest.DoesNotExist, Inforequest.MultipleObjectsReturned):
+    inforequests = Inforequest.objects.with_unique_email_in(keys)
+    inforequests = {i.unique_email_key: i for i in inforequests}
+
+    assigned = []
+    for message, aa in addresses:
+        matched = set(inforequests[a] for a in aa if a in inforequests)
+        if len(matched) == 1:
+            assigned.append((message, matched.pop()))
+    if not assigned:
         return
 
-    inforequestemail = InforequestEmail(
+    InforequestEmail.objects.bulk_create(InforequestEmail(
             inforequest=inforequest,
             email=message,
             type=InforequestEmail.TYPES.UNDECIDED,
-            )
-    inforequestemail.save()
+            ) for message, inforequest in assigned)
+    # Bulk create does not send ``post_save`` signals.
+    timeline.invalidate(*set(i.pk for m, i in assigned))
+
+    with translation(settings.LANGUAGE_CODE):
+        for message, inforequest in assigned:
+            if not inforequest.closed:
+                inforequest.send_received_email_notification(message)
 
-    if not inforequest.closed:
-        with translation(settings.LANGUAGE_CODE):
-            inforequest.send_received_email_notification(message)
+def assign_email_on_message_received(sender, message, **kwargs):
+    u"""
+    Assigns a single received message. See ``assign_emails_on_messages_received()``.
+    """
+    assign_emails_on_messages_received(sender=sender, messages=[message], **kwargs)
 
 @receiver(post_delete, sender=Session)
 def delete_attachments_on_session_post_delete(sender, instance, **kwargs):
@@ -48,3 +70,85 @@ def delete_attachments_on_session_post_delete(sender, instance, **kwargs):
     manually.
     """
     Attachment.objects.attached_to(instance).delete()
+
+@receiver(post_save, sender=Action)
+@receiver(post_delete, sender=Action)
+def update_next_event_date_on_action_post_save_or_post_delete(sender, instance, **kwargs):
+    u"""
+    Keeps ``Branch.next_event_date`` up to date whenever an action is added, extended, reminded or
+    deleted. The branch may be already deleted if the action is being deleted with it.
+    """
+    if kwargs.get(u'raw', False):
+        return
+    branch = Branch.objects.get_or_none(pk=instance.branch_id)
+    if branch is not None:
+        branch.update_next_event_date()
+
+def _inforequests_with_emails(*message_pks):
+    return InforequestEmail.objects.filter(email__in=message_pks).values_list(u'inforequest', flat=True)
+
+def _inforequests_with_branches(*branch_pks):
+    return Branch.objects.filter(pk__in=branch_pks).values_list(u'inforequest', flat=True)
+
+def _inforequests_with_actions(*action_pks):
+    return Branch.objects.filter(action__in=action_pks).values_list(u'inforequest', flat=True)
+
+@receiver(post_save, sender=Inforequest)
+@receiver(post_delete, sender=Inforequest)
+def invalidate_timeline_on_inforequest_post_save_or_post_delete(sender, instance, **kwargs):
+    timeline.invalidate(instance.pk)
+
+@receiver(post_save, sender=Branch)
+@receiver(post_delete, sender=Branch)
+@receiver(post_save, sender=InforequestEmail)
+@receiver(post_delete, sender=InforequestEmail)
+def invalidate_timeline_on_branch_or_inforequestemail_post_save_or_post_delete(sender, instance, **kwargs):
+    timeline.invalidate(instance.inforequest_id)
+
+@receiver(post_save, sender=Action)
+@receiver(post_delete, sender=Action)
+def invalidate_timeline_on_action_post_save_or_post_delete(sender, instance, **kwargs):
+    u"""
+    The branch may be already deleted if the action is being deleted with it. Then the timeline
+    was invalidated when the branch was deleted.
+    """
+    timeline.invalidate(*_inforequests_with_branches(instance.branch_id))
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def invalidate_timeline_on_message_post_save_or_post_delete(sender, instance, **kwargs):
+    u"""
+    Newly created messages are not assigned to any inforequest yet.
+    """
+    if kwargs.get(u'created', False):
+        return
+    timeline.invalidate(*_inforequests_with_emails(instance.pk))
+
+@receiver(post_save, sender=Recipient)
+@receiver(post_delete, sender=Recipient)
+def invalidate_timeline_on_recipient_post_save_or_post_delete(sender, instance, **kwargs):
+    u"""
+    The detail view shows delivery status of every action email recipient, so the timeline must be
+    invalidated whenever the status changes.
+    """
+    timeline.invalidate(*_inforequests_with_emails(instance.message_id))
+
+@receiver(messages_changed)
+def invalidate_timeline_on_messages_changed(sender, message_pks, **kwargs):
+    u"""
+    Messages and their recipients are changed by bulk queries when received emails are processed
+    or delivery statuses are updated. Such queries do not send ``post_save`` signals.
+    """
+    timeline.invalidate(*_inforequests_with_emails(*message_pks))
+
+@receiver(post_save, sender=Attachment)
+@receiver(post_delete, sender=Attachment)
+def invalidate_timeline_on_attachment_post_save_or_post_delete(sender, instance, **kwargs):
+    u"""
+    Attachments may be attached to actions and to emails. Attachments attached to anything else
+    do not affect any timeline.
+    """
+    if instance.generic_type_id == ContentType.objects.get_for_model(Action).pk:
+        timeline.invalidate(*_inforequests_with_actions(instance.generic_id))
+    elif instance.generic_type_id == ContentType.objects.get_for_model(Message).pk:
+        timeline.invalidate(*_inforequests_with_emails(instance.generic_id))
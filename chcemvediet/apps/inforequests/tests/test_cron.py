@@ -9,15 +9,20 @@ from django.test import TestCase
 from poleno.mail.models import Message, Recipient
 from poleno.timewarp import timewarp
 from poleno.cron.test import mock_cron_jobs
-from poleno.utils.date import local_datetime_from_local, utc_datetime_from_local
+from poleno.utils.date import naive_date, local_datetime_from_local, utc_datetime_from_local
 from poleno.utils.test import created_instances
 
 from . import InforequestsTestCaseMixin
-from ..cron import undecided_email_reminder, obligee_deadline_reminder, applicant_deadline_reminder, close_inforequests
-from ..models import Inforequest, Action
+from ..cron import undecided_email_reminder, obligee_deadline_reminder, applicant_deadline_reminder, close_inforequests, DeadlineSweep
+from ..models import Inforequest, Branch, Action
 
 class CronTestCaseMixin(TestCase):
 
+    def setUp(self):
+        super(CronTestCaseMixin, self).setUp()
+        # Make sure no deadline sweep is shared with previous tests
+        DeadlineSweep.clear()
+
     def _call_runcrons(self):
         # ``runcrons`` command runs ``logging.debug()`` that somehow spoils stderr.
         with mock.patch(u'django_cron.logging'):
@@ -221,8 +226,9 @@ class ObligeeDeadlineReminderCronJobTest(CronTestCaseMixin, InforequestsTestCase
 
     def _call_cron_job(self):
         with mock.patch(u'chcemvediet.apps.inforequests.cron.workdays.between', side_effect=lambda a,b: (b-a).days):
-            with created_instances(Message.objects) as message_set:
-                obligee_deadline_reminder().do()
+            with mock.patch(u'chcemvediet.apps.inforequests.cron.workdays.between_many', side_effect=lambda p: [(b-a).days for a,b in p]):
+                with created_instances(Message.objects) as message_set:
+                    obligee_deadline_reminder().do()
         return message_set
 
 
@@ -415,8 +421,9 @@ class ApplicantDeadlineReminderCronJobTest(CronTestCaseMixin, InforequestsTestCa
 
     def _call_cron_job(self):
         with mock.patch(u'chcemvediet.apps.inforequests.cron.workdays.between', side_effect=lambda a,b: (b-a).days):
-            with created_instances(Message.objects) as message_set:
-                applicant_deadline_reminder().do()
+            with mock.patch(u'chcemvediet.apps.inforequests.cron.workdays.between_many', side_effect=lambda p: [(b-a).days for a,b in p]):
+                with created_instances(Message.objects) as message_set:
+                    applicant_deadline_reminder().do()
         return message_set
 
 
@@ -601,7 +608,8 @@ class CloseInforequestsCronJobTest(CronTestCaseMixin, InforequestsTestCaseMixin,
 
     def _call_cron_job(self):
         with mock.patch(u'chcemvediet.apps.inforequests.cron.workdays.between', side_effect=lambda a,b: (b-a).days):
-            close_inforequests().do()
+            with mock.patch(u'chcemvediet.apps.inforequests.cron.workdays.between_many', side_effect=lambda p: [(b-a).days for a,b in p]):
+                close_inforequests().do()
 
 
     def test_times_job_is_run_at(self):
@@ -761,3 +769,64 @@ class CloseInforequestsCronJobTest(CronTestCaseMixin, InforequestsTestCaseMixin,
         self.assertRegexpMatches(logger.mock_calls[0][1][0], u'Closed inforequest: <Inforequest: %s>' % scenarios[0][0].pk)
         self.assertRegexpMatches(logger.mock_calls[1][1][0], u'Closing inforequest failed: <Inforequest: %s>' % scenarios[1][0].pk)
         self.assertRegexpMatches(logger.mock_calls[2][1][0], u'Closed inforequest: <Inforequest: %s>' % scenarios[2][0].pk)
+
+class DeadlineSweepTest(CronTestCaseMixin, InforequestsTestCaseMixin, TestCase):
+    u"""
+    Tests ``DeadlineSweep`` shared by deadline cron jobs.
+    """
+
+    def test_sweep_is_shared_by_jobs_taking_different_buckets(self):
+        timewarp.jump(local_datetime_from_local(u'2010-10-05 10:33:00'))
+        self._create_inforequest_scenario()
+
+        with mock.patch.object(DeadlineSweep, u'__init__', side_effect=DeadlineSweep.__init__, autospec=True) as init:
+            obligee_deadline_reminder().do()
+            applicant_deadline_reminder().do()
+        self.assertEqual(init.call_count, 1)
+
+    def test_sweep_is_reloaded_if_bucket_is_already_taken(self):
+        timewarp.jump(local_datetime_from_local(u'2010-10-05 10:33:00'))
+        self._create_inforequest_scenario()
+
+        with mock.patch.object(DeadlineSweep, u'__init__', side_effect=DeadlineSweep.__init__, autospec=True) as init:
+            obligee_deadline_reminder().do()
+            obligee_deadline_reminder().do()
+        self.assertEqual(init.call_count, 2)
+
+    def test_sweep_is_reloaded_if_too_old(self):
+        timewarp.jump(local_datetime_from_local(u'2010-10-05 10:33:00'))
+        self._create_inforequest_scenario()
+
+        with mock.patch.object(DeadlineSweep, u'__init__', side_effect=DeadlineSweep.__init__, autospec=True) as init:
+            obligee_deadline_reminder().do()
+            timewarp.jump(local_datetime_from_local(u'2010-10-05 10:35:00'))
+            applicant_deadline_reminder().do()
+        self.assertEqual(init.call_count, 2)
+
+    def test_sweep_snapshot_contains_only_open_inforequests(self):
+        timewarp.jump(local_datetime_from_local(u'2010-10-05 10:33:00'))
+        inforequest1, _, _ = self._create_inforequest_scenario()
+        inforequest2, _, _ = self._create_inforequest_scenario(dict(closed=True))
+
+        timewarp.jump(local_datetime_from_local(u'2010-11-20 10:33:00'))
+        sweep = DeadlineSweep()
+        self.assertEqual([i.pk for i in sweep.inforequests], [inforequest1.pk])
+
+    def test_sweep_snapshot_skips_inforequests_with_pending_events(self):
+        timewarp.jump(local_datetime_from_local(u'2010-10-05 10:33:00'))
+        inforequest1, _, _ = self._create_inforequest_scenario()
+        timewarp.jump(local_datetime_from_local(u'2010-11-20 10:33:00'))
+        inforequest2, _, _ = self._create_inforequest_scenario()
+
+        sweep = DeadlineSweep()
+        self.assertEqual([i.pk for i in sweep.inforequests], [inforequest1.pk])
+
+    def test_sweep_snapshot_contains_inforequests_with_stale_events(self):
+        timewarp.jump(local_datetime_from_local(u'2010-10-05 10:33:00'))
+        inforequest, branch, _ = self._create_inforequest_scenario()
+        Branch.objects.filter(pk=branch.pk).update(next_event_date=naive_date(u'1970-01-01'))
+
+        sweep = DeadlineSweep()
+        self.assertEqual([i.pk for i in sweep.inforequests], [inforequest.pk])
+        branch = Branch.objects.get(pk=branch.pk)
+        self.assertEqual(branch.next_event_date, naive_date(u'2010-10-14'))
@@ -441,6 +441,49 @@ class ActionTest(InforequestsTestCaseMixin, TestCase):
             self.assertFalse(action.deadline_missed)
             self.assertFalse(action.deadline_missed_at(local_today()))
 
+    def test_compute_deadline_status_method(self):
+        inforequest = self._create_inforequest()
+        branch = self._create_branch(inforequest=inforequest)
+        actions = [
+                self._create_action(branch=branch, effective_date=naive_date(u'2010-09-01'), deadline=15),
+                self._create_action(branch=branch, effective_date=naive_date(u'2010-09-20'), deadline=15, extension=4),
+                self._create_action(branch=branch, effective_date=naive_date(u'2010-10-05'), deadline=15),
+                self._create_action(branch=branch, effective_date=naive_date(u'2010-10-08'), type=Action.TYPES.REVERSION),
+                ]
+        timewarp.jump(local_datetime_from_local(u'2010-10-10 10:33:00'))
+        expected = [Action.objects.get(pk=a.pk) for a in actions]
+
+        result = Action.objects.filter(pk__in=[a.pk for a in actions]).order_by_pk().with_deadline_status()
+        self.assertEqual([a.pk for a in result], [a.pk for a in actions])
+        for action, other in zip(result, expected):
+            self.assertEqual(action.deadline_status.at, local_today())
+            self.assertEqual(action.deadline_status.days_passed, other.days_passed)
+            self.assertEqual(action.deadline_status.deadline_remaining, other.deadline_remaining)
+            self.assertEqual(action.deadline_status.deadline_missed, other.deadline_missed)
+            self.assertEqual(action.deadline_status.deadline_date, other.deadline_date)
+            with mock.patch(u'chcemvediet.apps.inforequests.models.action.workdays') as mocked:
+                self.assertEqual(action.days_passed, other.days_passed)
+                self.assertEqual(action.deadline_remaining, other.deadline_remaining)
+                self.assertEqual(action.deadline_missed, other.deadline_missed)
+                self.assertEqual(action.deadline_date, other.deadline_date)
+            self.assertEqual(mocked.mock_calls, [])
+
+    def test_compute_deadline_status_method_at_other_date(self):
+        inforequest = self._create_inforequest()
+        branch = self._create_branch(inforequest=inforequest)
+        action = self._create_action(branch=branch, effective_date=naive_date(u'2010-10-05'), deadline=2)
+        timewarp.jump(local_datetime_from_local(u'2010-10-10 10:33:00'))
+
+        result = Action.compute_deadline_status([action], naive_date(u'2010-10-06'))
+        self.assertEqual(result, [action])
+        self.assertEqual(action.deadline_status.days_passed, 1)
+        self.assertEqual(action.deadline_status.deadline_remaining, 1)
+        self.assertFalse(action.deadline_status.deadline_missed)
+        self.assertEqual(action.deadline_status.deadline_date, naive_date(u'2010-10-07'))
+        # Cached properties are computed for today, not for the given date
+        self.assertNotIn(u'deadline_missed', action.__dict__)
+        self.assertTrue(action.deadline_missed)
+
     def test_has_deadline_has_applicant_deadline_and_has_obligee_deadline_methods(self):
         tests = (                     # has deadline: any,   applicant, obligee
                 (Action.TYPES.REQUEST,                True,  False,     True,  dict()),
@@ -608,6 +651,21 @@ class ActionTest(InforequestsTestCaseMixin, TestCase):
             (u'filename.html', u'<p>Content</p>', u'text/html'),
             ])
 
+    def test_send_by_email_attachments_share_files(self):
+        inforequest = self._create_inforequest()
+        branch = self._create_branch(inforequest=inforequest)
+        action = self._create_action(branch=branch)
+        attachment = self._create_attachment(generic_object=action, name=u'filename.txt', content=u'Content', content_type=u'text/plain')
+
+        # The message is queued with our backend even if another one is configured.
+        with self.settings(EMAIL_BACKEND=u'django.core.mail.backends.locmem.EmailBackend'):
+            with created_instances(Message.objects) as message_set:
+                action.send_by_email()
+        email = message_set.get()
+
+        self.assertEqual(action.email, email)
+        self.assertEqual([a.file.name for a in email.attachment_set.all()], [attachment.file.name])
+
     def test_repr(self):
         inforequest = self._create_inforequest()
         branch = self._create_branch(inforequest=inforequest)
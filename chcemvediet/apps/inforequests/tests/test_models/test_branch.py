@@ -1,6 +1,7 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 import random
+import datetime
 
 from django.db import IntegrityError
 from django.test import TestCase
@@ -601,6 +602,37 @@ class BranchTest(InforequestsTestCaseMixin, TestCase):
                 self.assertEqual(added_action.type, expected_action_type)
                 self.assertEqual(added_action.effective_date, naive_date(u'2010-10-05'))
 
+    def test_next_event_date_field_is_updated_when_action_is_saved_or_deleted(self):
+        timewarp.jump(local_datetime_from_local(u'2010-10-05 10:33:00'))
+        _, branch, (request,) = self._create_inforequest_scenario()
+        branch = Branch.objects.get(pk=branch.pk)
+        self.assertEqual(branch.next_event_date, naive_date(u'2010-10-14'))
+
+        request.extension = 3
+        request.save(update_fields=[u'extension'])
+        branch = Branch.objects.get(pk=branch.pk)
+        self.assertEqual(branch.next_event_date, naive_date(u'2010-10-17'))
+
+        timewarp.jump(local_datetime_from_local(u'2010-10-25 10:33:00'))
+        request.last_deadline_reminder = local_datetime_from_local(u'2010-10-25 10:33:00')
+        request.save(update_fields=[u'last_deadline_reminder'])
+        branch = Branch.objects.get(pk=branch.pk)
+        self.assertEqual(branch.next_event_date, request.deadline_date + datetime.timedelta(days=30))
+
+        refusal = self._create_action(branch=branch, type=Action.TYPES.REFUSAL)
+        branch = Branch.objects.get(pk=branch.pk)
+        self.assertEqual(branch.next_event_date, naive_date(u'2010-11-07'))
+
+        refusal.delete()
+        branch = Branch.objects.get(pk=branch.pk)
+        self.assertEqual(branch.next_event_date, request.deadline_date + datetime.timedelta(days=30))
+
+    def test_next_event_date_field_is_null_if_last_action_has_no_deadline(self):
+        _, branch, _ = self._create_inforequest_scenario(
+                (u'disclosure', dict(disclosure_level=Action.DISCLOSURE_LEVELS.FULL)))
+        branch = Branch.objects.get(pk=branch.pk)
+        self.assertIsNone(branch.next_event_date)
+
     def test_collect_obligee_emails_method(self):
         obligee = self._create_obligee(emails=u'Obligee1 <oblige1@a.com>, oblige2@a.com')
         _, branch, _ = self._create_inforequest_scenario(obligee,
@@ -701,6 +733,18 @@ class BranchTest(InforequestsTestCaseMixin, TestCase):
         result = Branch.objects.advanced()
         self.assertItemsEqual(result, [branch2, branch3])
 
+    def test_with_event_due_and_with_event_pending_query_methods(self):
+        timewarp.jump(local_datetime_from_local(u'2010-10-05 10:33:00'))
+        _, branch1, _ = self._create_inforequest_scenario()
+        timewarp.jump(local_datetime_from_local(u'2010-10-10 10:33:00'))
+        _, branch2, _ = self._create_inforequest_scenario()
+        _, branch3, _ = self._create_inforequest_scenario(
+                (u'disclosure', dict(disclosure_level=Action.DISCLOSURE_LEVELS.FULL)))
+        result = Branch.objects.with_event_due(naive_date(u'2010-10-15'))
+        self.assertItemsEqual(result, [branch1])
+        result = Branch.objects.with_event_pending(naive_date(u'2010-10-15'))
+        self.assertItemsEqual(result, [branch2])
+
     def test_order_by_pk_query_method(self):
         inforequest = self._create_inforequest()
         branches = [self._create_branch(inforequest=inforequest) for i in range(20)]
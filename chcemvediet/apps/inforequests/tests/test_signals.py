@@ -5,20 +5,28 @@ import mock
 from django.test import TestCase
 
 from poleno.mail.models import Message, Recipient
-from poleno.mail.signals import message_received
+from poleno.mail.signals import messages_received
 from poleno.utils.test import created_instances
 
 from . import InforequestsTestCaseMixin
-from ..signals import assign_email_on_message_received
+from ..signals import assign_email_on_message_received, assign_emails_on_messages_received
 from ..models import InforequestEmail
 
 class AssignEmailOnMessageReceivedTest(InforequestsTestCaseMixin, TestCase):
     u"""
-    Tests ``assign_email_on_message_received()`` event receiver.
+    Tests ``assign_emails_on_messages_received()`` event receiver and its single message wrapper
+    ``assign_email_on_message_received()``.
     """
 
     def test_event_receiver_is_registered(self):
-        self.assertIn(assign_email_on_message_received, message_received._live_receivers(sender=None))
+        self.assertIn(assign_emails_on_messages_received, messages_received._live_receivers(sender=None))
+
+    def test_unique_email_key_is_lowercased_unique_email(self):
+        with self.settings(INFOREQUEST_UNIQUE_EMAIL=u'{token}@eXAMplE.coM'):
+            with mock.patch(u'chcemvediet.apps.inforequests.models.inforequest.random_readable_string', return_value=u'aAAa'):
+                inforequest = self._create_inforequest()
+        self.assertEqual(inforequest.unique_email, u'aAAa@eXAMplE.coM')
+        self.assertEqual(inforequest.unique_email_key, u'aaaa@example.com')
 
     def test_received_message_is_assigned_and_marked_undecided(self):
         inforequest = self._create_inforequest()
@@ -167,3 +175,23 @@ class AssignEmailOnMessageReceivedTest(InforequestsTestCaseMixin, TestCase):
         with created_instances(Message.objects) as message_set:
             assign_email_on_message_received(sender=None, message=msg)
         self.assertFalse(message_set.exists())
+
+    def test_messages_in_batch_are_assigned_with_single_query(self):
+        inforequest1 = self._create_inforequest(closed=True)
+        inforequest2 = self._create_inforequest(closed=True)
+        msg1 = self._create_message(received_for=inforequest1.unique_email.upper())
+        msg2 = self._create_message(received_for=u'invalid@mail.com')
+        msg3 = self._create_message(omit=[u'received_for'])
+        self._create_recipient(message=msg3, mail=inforequest2.unique_email)
+        self._create_recipient(message=msg3, mail=u'other@example.com')
+        msgs = list(Message.objects.filter(pk__in=[msg1.pk, msg2.pk, msg3.pk])
+                .order_by_pk().prefetch_related(Message.prefetch_recipients()))
+
+        # One query to get inforequests, one to create the assignments.
+        with self.assertNumQueries(2):
+            assign_emails_on_messages_received(sender=None, messages=msgs)
+
+        self.assertItemsEqual(msg1.inforequest_set.all(), [inforequest1])
+        self.assertItemsEqual(msg2.inforequest_set.all(), [])
+        self.assertItemsEqual(msg3.inforequest_set.all(), [inforequest2])
+        self.assertEqual(InforequestEmail.objects.undecided().count(), 2)
@@ -0,0 +1,146 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import mock
+
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from poleno.timewarp import timewarp
+from poleno.mail.models import Message, Recipient
+from poleno.mail.cron import mail as mail_cron_job
+from poleno.mail.transports.mandrill.signals import message_status_webhook_events
+from poleno.utils.date import local_datetime_from_local, naive_date
+
+from . import InforequestsTestCaseMixin
+from ..models import Inforequest
+from ..timeline import get_version, get_timeline
+
+class TimelineTest(InforequestsTestCaseMixin, TestCase):
+    u"""
+    Tests ``get_timeline()`` cached inforequest timeline and its invalidation by model signals.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def _get_detail(self, inforequest):
+        response = self.client.get(reverse(u'inforequests:detail', args=(inforequest.pk,)))
+        self.assertEqual(response.status_code, 200)
+        return response.context[u'inforequest']
+
+
+    def test_timeline_is_prefetched_and_precomputed(self):
+        inforequest, branch, actions = self._create_inforequest_scenario(u'confirmation')
+        timeline = get_timeline(inforequest.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(timeline.main_branch.pk, branch.pk)
+            self.assertFalse(timeline.has_undecided_emails)
+            self.assertEqual([a.pk for a in timeline.main_branch.actions], [a.pk for a in actions])
+            for action in timeline.main_branch.actions:
+                self.assertIn(u'deadline_remaining', action.__dict__)
+                self.assertIn(u'deadline_date', action.__dict__)
+                action.attachments
+                [r.status for r in action.email.recipients]
+            timeline.main_branch.can_add_appeal
+
+    def test_warm_timeline_is_read_without_queries(self):
+        inforequest, _, _ = self._create_inforequest_scenario(u'confirmation')
+        get_timeline(inforequest.pk)
+        with self.assertNumQueries(0):
+            timeline = get_timeline(inforequest.pk)
+        self.assertEqual(timeline.pk, inforequest.pk)
+
+    def test_missing_inforequest_raises_exception(self):
+        with self.assertRaises(Inforequest.DoesNotExist):
+            get_timeline(47)
+
+    def test_inforequest_save_invalidates_timeline(self):
+        inforequest, _, _ = self._create_inforequest_scenario()
+        self.assertFalse(get_timeline(inforequest.pk).closed)
+        inforequest.closed = True
+        inforequest.save()
+        self.assertTrue(get_timeline(inforequest.pk).closed)
+
+    def test_action_save_invalidates_timeline(self):
+        inforequest, _, (request,) = self._create_inforequest_scenario()
+        version = get_version(inforequest.pk)
+        get_timeline(inforequest.pk)
+        request.extension = 3
+        request.save()
+        self.assertNotEqual(get_version(inforequest.pk), version)
+        self.assertEqual(get_timeline(inforequest.pk).main_branch.actions[0].extension, 3)
+
+    def test_new_branch_invalidates_timeline(self):
+        inforequest, _, _ = self._create_inforequest_scenario((u'advancement', [self.obligee2]))
+        get_timeline(inforequest.pk)
+        self._create_branch(inforequest=inforequest, obligee=self.obligee3, advanced_by=inforequest.main_branch.last_action)
+        self.assertEqual(len(get_timeline(inforequest.pk).branches), 3)
+
+    def test_undecided_email_invalidates_timeline(self):
+        inforequest, _, _ = self._create_inforequest_scenario()
+        self.assertFalse(get_timeline(inforequest.pk).has_undecided_emails)
+        self._create_inforequest_email(inforequest=inforequest)
+        self.assertTrue(get_timeline(inforequest.pk).has_undecided_emails)
+
+    def test_recipient_status_change_invalidates_timeline(self):
+        inforequest, _, (request,) = self._create_inforequest_scenario()
+        get_timeline(inforequest.pk)
+        recipient = request.email.recipient_set.get()
+        recipient.status = Recipient.STATUSES.DELIVERED
+        recipient.save()
+        timeline = get_timeline(inforequest.pk)
+        self.assertEqual(timeline.main_branch.actions[0].email.recipients[0].status, Recipient.STATUSES.DELIVERED)
+
+    def test_action_attachment_invalidates_timeline(self):
+        inforequest, _, (request,) = self._create_inforequest_scenario()
+        get_timeline(inforequest.pk)
+        attachment = self._create_attachment(generic_object=request)
+        timeline = get_timeline(inforequest.pk)
+        self.assertEqual([a.pk for a in timeline.main_branch.actions[0].attachments], [attachment.pk])
+        attachment.delete()
+        timeline = get_timeline(inforequest.pk)
+        self.assertEqual(timeline.main_branch.actions[0].attachments, [])
+
+    def test_other_inforequests_are_not_invalidated(self):
+        inforequest1, _, _ = self._create_inforequest_scenario()
+        inforequest2, _, (request2,) = self._create_inforequest_scenario()
+        version = get_version(inforequest1.pk)
+        request2.extension = 3
+        request2.save()
+        self.assertEqual(get_version(inforequest1.pk), version)
+
+    def test_timeline_is_rebuilt_next_day(self):
+        timewarp.jump(local_datetime_from_local(u'2014-10-05 23:50:00'))
+        inforequest, _, _ = self._create_inforequest_scenario()
+        timeline = get_timeline(inforequest.pk)
+        self.assertEqual(timeline.main_branch.actions[0].deadline_status.at, naive_date(u'2014-10-05'))
+
+        timewarp.jump(local_datetime_from_local(u'2014-10-06 00:10:00'))
+        timeline = get_timeline(inforequest.pk)
+        self.assertEqual(timeline.main_branch.actions[0].deadline_status.at, naive_date(u'2014-10-06'))
+
+    def test_received_email_invalidates_detail(self):
+        inforequest, _, _ = self._create_inforequest_scenario()
+        self._login_user()
+        self.assertFalse(self._get_detail(inforequest).has_undecided_emails)
+
+        self._create_message(type=Message.TYPES.INBOUND, processed=None, received_for=inforequest.unique_email)
+        with self.settings(EMAIL_OUTBOUND_TRANSPORT=None):
+            with mock.patch(u'poleno.mail.cron.cron_logger'):
+                mail_cron_job().do()
+
+        self.assertEqual(inforequest.undecided_emails_count, 1)
+        self.assertTrue(self._get_detail(inforequest).has_undecided_emails)
+
+    def test_message_status_webhook_invalidates_detail(self):
+        inforequest, _, (request,) = self._create_inforequest_scenario()
+        request.email.recipient_set.update(remote_id=u'remote-1')
+        self._login_user()
+        detail = self._get_detail(inforequest)
+        self.assertEqual(detail.main_branch.actions[0].email.recipients[0].status, Recipient.STATUSES.SENT)
+
+        message_status_webhook_events(sender=None, events=[{u'event': u'open', u'_id': u'remote-1'}])
+
+        detail = self._get_detail(inforequest)
+        self.assertEqual(detail.main_branch.actions[0].email.recipients[0].status, Recipient.STATUSES.OPENED)
@@ -0,0 +1,84 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from django.core.cache import cache
+
+from poleno.utils.date import local_today
+from poleno.utils.misc import random_string
+
+from .models import Inforequest, Action
+
+VERSION_CACHE_KEY = u'inforequests:timeline:%s:version'
+TIMELINE_CACHE_KEY = u'inforequests:timeline:%s'
+
+def get_version(inforequest_pk):
+    u"""
+    Returns an opaque token identifying the current state of the inforequest timeline. The token
+    is kept in the shared cache, so all processes see a new token as soon as any of them calls
+    ``invalidate()``.
+    """
+    key = VERSION_CACHE_KEY % inforequest_pk
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, random_string(20), None)
+        version = cache.get(key)
+    return version
+
+def invalidate(*inforequest_pks):
+    u"""
+    Invalidates cached timelines of the given inforequests. Called whenever an inforequest, its
+    branch, action, email, email recipient or attachment is saved or deleted. Code changing any of
+    them with bulk queries, which do not send ``post_save`` signals, must call it explicitly or
+    send ``poleno.mail.signals.messages_changed`` signal.
+
+    Note that the version is changed before the transaction is committed, so a concurrent request
+    may still cache the old state under the new version. Therefore the timelines are cached only
+    for a limited time, see ``INFOREQUESTS_TIMELINE_CACHE_TIMEOUT`` setting.
+    """
+    inforequest_pks = [pk for pk in inforequest_pks if pk is not None]
+    if not inforequest_pks:
+        return
+    cache.set_many({VERSION_CACHE_KEY % pk: random_string(20) for pk in inforequest_pks}, None)
+
+def build_timeline(inforequest_pk):
+    u"""
+    Fetches the inforequest with all relations used by the detail view and precomputes everything
+    the view would otherwise compute on every render: the main branch, undecided emails flag,
+    deadlines of all actions and actions available in every branch. Raises
+    ``Inforequest.DoesNotExist`` if there is no such inforequest.
+    """
+    inforequest = Inforequest.objects.prefetch_detail().get(pk=inforequest_pk)
+    inforequest.main_branch
+    inforequest.has_undecided_emails
+    for branch in inforequest.branches:
+        Action.compute_deadline_status(branch.actions)
+        if branch.last_action is not None:
+            branch.can_add_clarification_response
+            branch.can_add_appeal
+    return inforequest
+
+def get_timeline(inforequest_pk):
+    u"""
+    Returns the inforequest prefetched for the detail view as returned by ``build_timeline()``.
+    The inforequest is kept in the shared cache together with its version and the date its
+    deadlines were computed for. If both are still current, the inforequest is restored with a
+    single cache read and no database queries. Otherwise the timeline is rebuilt and stored. The
+    returned inforequest is a snapshot and should not be modified.
+    """
+    version_key = VERSION_CACHE_KEY % inforequest_pk
+    timeline_key = TIMELINE_CACHE_KEY % inforequest_pk
+    today = local_today()
+
+    cached = cache.get_many([version_key, timeline_key])
+    version = cached.get(version_key)
+    if version is not None and timeline_key in cached:
+        cached_version, cached_today, inforequest = cached[timeline_key]
+        if cached_version == version and cached_today == today:
+            return inforequest
+
+    if version is None:
+        version = get_version(inforequest_pk)
+    inforequest = build_timeline(inforequest_pk)
+    timeout = getattr(settings, u'INFOREQUESTS_TIMELINE_CACHE_TIMEOUT', 60*60)
+    cache.set(timeline_key, (version, today, inforequest), timeout)
+    return inforequest
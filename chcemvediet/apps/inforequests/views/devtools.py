@@ -12,6 +12,7 @@ from django.contrib import messages
 from poleno.mail.models import Message, Recipient
 from poleno.utils.views import login_required
 from chcemvediet.apps.inforequests.models import Inforequest, Action
+from chcemvediet.apps.inforequests import timeline
 
 
 @require_http_methods([u'POST'])
@@ -92,6 +93,9 @@ def devtools_push_history(request, inforequest_pk):
                 effective_date=F(u'effective_date') - delta,
                 last_deadline_reminder=F(u'last_deadline_reminder') - delta,
                 )
+        for branch in inforequest.branch_set.all():
+            branch.update_next_event_date()
+        timeline.invalidate(inforequest.pk)
         messages.success(request, u'The inforequest was pushed in history by %s days.' % days)
     else:
         messages.error(request, u'Invalid number of days.')
@@ -3,7 +3,7 @@
 from django.core.urlresolvers import reverse
 from django.db import transaction
 from django.views.decorators.http import require_http_methods
-from django.http import HttpResponseRedirect, HttpResponseBadRequest
+from django.http import HttpResponseRedirect, HttpResponseBadRequest, Http404
 from django.contrib.sessions.models import Session
 from django.shortcuts import render
 from allauth.account.decorators import verified_email_required
@@ -12,6 +12,7 @@ from poleno.utils.views import login_required
 from poleno.utils.forms import clean_button
 from chcemvediet.apps.inforequests.forms import InforequestForm
 from chcemvediet.apps.inforequests.models import InforequestDraft, Inforequest, Branch
+from chcemvediet.apps.inforequests.timeline import get_timeline
 
 @require_http_methods([u'HEAD', u'GET'])
 @login_required
@@ -87,7 +88,12 @@ def inforequest_create(request, draft_pk=None):
 @require_http_methods([u'HEAD', u'GET'])
 @login_required
 def inforequest_detail(request, inforequest_pk):
-    inforequest = Inforequest.objects.owned_by(request.user).prefetch_detail().get_or_404(pk=inforequest_pk)
+    try:
+        inforequest = get_timeline(inforequest_pk)
+    except Inforequest.DoesNotExist:
+        raise Http404
+    if inforequest.applicant_id != request.user.pk:
+        raise Http404
     return render(request, u'inforequests/detail/detail.html', {
             u'inforequest': inforequest,
             u'devtools': u'inforequests/detail/devtools.html',
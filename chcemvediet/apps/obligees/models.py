@@ -63,13 +63,9 @@ class Obligee(models.Model):
     objects = ObligeeQuerySet.as_manager()
 
     class Meta:
-        # FIXME: Ordinary indexes do not work for LIKE '%word%'. So we don't declare any indexes
-        # for ``slug`` yet. Eventually, we need to define a fulltext index for "slug" or "name" and
-        # use ``__search`` instead of ``__contains`` in autocomplete view. However, SQLite does not
-        # support ``__contains`` and MySQL supports fulltext indexes for InnoDB tables only since
-        # version 5.6.4, but our server has only MySQL 5.5.x so far. We need to upgrate our
-        # production MySQL server and find a workaround for SQLite we use in development mode.
-        # Alternatively, we can use some complex fulltext search engine like ElasticSearch.
+        # Ordinary indexes do not work for LIKE '%word%', so we don't declare any indexes for
+        # ``slug``. Autocomplete searches obligee name words using in-process prefix index defined
+        # in ``chcemvediet.apps.obligees.search`` instead.
         index_together = [
                 [u'name', u'id'],
                 ]
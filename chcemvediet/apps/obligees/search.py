@@ -0,0 +1,188 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import re
+import heapq
+import bisect
+import logging
+import threading
+from collections import OrderedDict
+from unidecode import unidecode
+
+from django.conf import settings
+from django.core.cache import cache
+
+from poleno.utils.misc import random_string
+
+from .models import Obligee
+
+GENERATION_CACHE_KEY = u'obligees:search:generation'
+
+def split_words(value):
+    u"""
+    Transliterates ``value`` to lowercase ascii and splits it to alphanumeric words the same way
+    ``Obligee.save()`` does when computing obligee slugs.
+    """
+    value = unidecode(value).lower()
+    return [w for w in re.split(r'[^a-z0-9]+', value) if w]
+
+def _generation_timeout():
+    return getattr(settings, u'OBLIGEES_SEARCH_GENERATION_TIMEOUT', 10*60)
+
+def get_generation():
+    u"""
+    Returns an opaque token identifying the current state of obligees. The token is kept in the
+    shared cache, so all processes see a new token as soon as any of them calls ``invalidate()``.
+    """
+    generation = cache.get(GENERATION_CACHE_KEY)
+    if generation is None:
+        cache.add(GENERATION_CACHE_KEY, random_string(20), _generation_timeout())
+        generation = cache.get(GENERATION_CACHE_KEY)
+    return generation
+
+def invalidate():
+    u"""
+    Invalidates search indexes in all processes. Called whenever an obligee is saved or deleted.
+
+    Note that the generation is changed before the transaction is committed, so a concurrent
+    request may still build the index from the old obligees under the new generation. Therefore the
+    generation expires after a limited time and all indexes are rebuilt then, see
+    ``OBLIGEES_SEARCH_GENERATION_TIMEOUT`` setting.
+    """
+    cache.set(GENERATION_CACHE_KEY, random_string(20), _generation_timeout())
+
+class ObligeeIndex(object):
+    u"""
+    In-process prefix index over the words of pending obligee names. Obligees are ranked by their
+    position in ``order_by_name()`` ordering and every word is stored in a sorted array together
+    with the rank of its obligee. Ranks of all obligees with a word starting with a given prefix
+    form a continuous slice of the array, so they are found by bisection. Multi-word queries are
+    resolved by intersecting such rank sets.
+
+    Example:
+        index = ObligeeIndex.build()
+        pks = index.search([u'minister', u'spravodl'], limit=10)
+    """
+
+    def __init__(self, rows, generation=None):
+        # ``rows`` are ``(pk, slug)`` pairs in the order the obligees should be returned.
+        self.generation = generation
+        self.pks = []
+        entries = []
+        seen = {}
+        for rank, (pk, slug) in enumerate(rows):
+            self.pks.append(pk)
+            for word in set(w for w in slug.split(u'-') if w):
+                entries.append((seen.setdefault(word, word), rank))
+        entries.sort()
+        self.words = [w for w, r in entries]
+        self.ranks = [r for w, r in entries]
+
+    @classmethod
+    def build(cls, generation=None):
+        rows = Obligee.objects.pending().order_by_name().values_list(u'pk', u'slug')
+        return cls(rows, generation)
+
+    def _prefix_ranks(self, prefix):
+        # Words contain only ascii letters and digits and u'{' sorts after all of them.
+        lo = bisect.bisect_left(self.words, prefix)
+        hi = bisect.bisect_left(self.words, prefix + u'{', lo)
+        return self.ranks[lo:hi]
+
+    def search(self, words, limit=None):
+        u"""
+        Returns pks of obligees having, for every given word, a name word starting with it. The
+        pks are ordered by obligee names. If no words are given, all indexed obligees match.
+        """
+        if not words:
+            return self.pks[:limit]
+        candidates = sorted((self._prefix_ranks(w) for w in set(words)), key=len)
+        result = set(candidates[0])
+        for ranks in candidates[1:]:
+            if not result:
+                break
+            result.intersection_update(ranks)
+        ranks = sorted(result) if limit is None else heapq.nsmallest(limit, result)
+        return [self.pks[r] for r in ranks]
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index(generation=None):
+    u"""
+    Returns the process-wide ``ObligeeIndex``. The index is rebuilt lazily whenever obligees have
+    changed since it was built.
+    """
+    global _index
+    if generation is None:
+        generation = get_generation()
+    with _index_lock:
+        if _index is None or generation is None or _index.generation != generation:
+            _index = ObligeeIndex.build(generation)
+        return _index
+
+class ResponseCache(object):
+    u"""
+    Thread-safe LRU cache of autocomplete responses keyed by normalized search terms. Entries are
+    bound to a generation returned by ``get_generation()``. Whenever the cache is accessed with a
+    different generation, all its entries are dropped. Hit and miss counters are kept for
+    monitoring and may be read with ``stats()``. If ``log_every`` is given, the stats are logged to
+    "chcemvediet.obligees" logger after every ``log_every`` lookups, so we can see how the cache
+    performs in running processes.
+    """
+
+    def __init__(self, size, log_every=None):
+        self.size = size
+        self.log_every = log_every
+        self.hits = 0
+        self.misses = 0
+        self._generation = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_generation(self, generation):
+        if generation is None or generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+    def get(self, key, generation):
+        with self._lock:
+            self._check_generation(generation)
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                value = None
+                self.misses += 1
+            else:
+                self._entries[key] = value
+                self.hits += 1
+            lookups = self.hits + self.misses
+        if self.log_every and lookups % self.log_every == 0:
+            self.log_stats()
+        return value
+
+    def set(self, key, generation, value):
+        with self._lock:
+            self._check_generation(generation)
+            if generation is None:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                    u'hits': self.hits,
+                    u'misses': self.misses,
+                    u'entries': len(self._entries),
+                    u'size': self.size,
+                    }
+
+    def log_stats(self):
+        logging.getLogger(u'chcemvediet.obligees').info(
+                u'Autocomplete cache has %(hits)d hits and %(misses)d misses, it holds %(entries)d of %(size)d entries.',
+                self.stats())
+
+response_cache = ResponseCache(getattr(settings, u'OBLIGEES_AUTOCOMPLETE_CACHE_SIZE', 1000),
+        log_every=getattr(settings, u'OBLIGEES_AUTOCOMPLETE_CACHE_LOG_EVERY', 10000))
@@ -0,0 +1,12 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Obligee
+from . import search
+
+@receiver(post_save, sender=Obligee)
+@receiver(post_delete, sender=Obligee)
+def invalidate_search_on_obligee_change(sender, **kwargs):
+    search.invalidate()
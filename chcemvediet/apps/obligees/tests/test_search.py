@@ -0,0 +1,141 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import mock
+import time
+
+from django.db import transaction
+from django.test import TestCase
+
+from . import ObligeesTestCaseMixin
+from ..models import Obligee
+from ..search import split_words, get_generation, get_index, ObligeeIndex, ResponseCache
+
+class ObligeeSearchTest(ObligeesTestCaseMixin, TestCase):
+    u"""
+    Tests ``ObligeeIndex`` prefix index and its invalidation.
+    """
+
+    def test_split_words(self):
+        self.assertEqual(split_words(u'  Ministerstvo  ŠKOLSTVA,vedy-a-3.kolo '),
+                [u'ministerstvo', u'skolstva', u'vedy', u'a', u'3', u'kolo'])
+
+    def test_split_words_with_empty_value(self):
+        self.assertEqual(split_words(u' ,, - '), [])
+
+    def test_index_contains_only_pending_obligees(self):
+        oblg1 = self._create_obligee(name=u'aaa 1', status=Obligee.STATUSES.PENDING)
+        oblg2 = self._create_obligee(name=u'aaa 2', status=Obligee.STATUSES.DISSOLVED)
+        index = ObligeeIndex.build()
+        self.assertEqual(index.search([u'aaa']), [oblg1.pk])
+
+    def test_search_returns_pks_ordered_by_name(self):
+        oblg1 = self._create_obligee(name=u'ccc')
+        oblg2 = self._create_obligee(name=u'aaa ccc')
+        oblg3 = self._create_obligee(name=u'bbb ccc')
+        index = ObligeeIndex.build()
+        self.assertEqual(index.search([u'cc']), [oblg2.pk, oblg3.pk, oblg1.pk])
+
+    def test_search_intersects_words(self):
+        oblg1 = self._create_obligee(name=u'aaa bbb ccc')
+        oblg2 = self._create_obligee(name=u'aaa bbb')
+        oblg3 = self._create_obligee(name=u'bbb ccc')
+        index = ObligeeIndex.build()
+        self.assertEqual(index.search([u'c', u'aa', u'b']), [oblg1.pk])
+        self.assertEqual(index.search([u'aaa', u'ddd']), [])
+
+    def test_search_with_limit(self):
+        oblgs = [self._create_obligee(name=u'aaa %02d' % i) for i in range(20)]
+        index = ObligeeIndex.build()
+        self.assertEqual(index.search([u'aaa'], limit=5), [o.pk for o in oblgs[:5]])
+        self.assertEqual(index.search([], limit=3), [o.pk for o in oblgs[:3]])
+
+    def test_obligee_save_and_delete_invalidate_index(self):
+        oblg = self._create_obligee(name=u'aaa')
+        generation = get_generation()
+        self.assertEqual(get_index().search([u'aaa']), [oblg.pk])
+        self.assertIs(get_index(), get_index())
+
+        oblg.name = u'bbb'
+        oblg.save()
+        self.assertNotEqual(get_generation(), generation)
+        self.assertEqual(get_index().search([u'aaa']), [])
+        self.assertEqual(get_index().search([u'bbb']), [oblg.pk])
+
+        oblg.delete()
+        self.assertEqual(get_index().search([u'bbb']), [])
+
+    def test_index_built_before_commit_is_refreshed_when_generation_expires(self):
+        oblg = self._create_obligee(name=u'aaa')
+        stale_rows = list(Obligee.objects.pending().order_by_name().values_list(u'pk', u'slug'))
+        with self.settings(OBLIGEES_SEARCH_GENERATION_TIMEOUT=60):
+            with transaction.atomic():
+                oblg.name = u'bbb'
+                oblg.save()
+                # Another process builds its index from the obligees it sees before the commit.
+                with mock.patch.object(ObligeeIndex, u'build', side_effect=lambda g=None: ObligeeIndex(stale_rows, g)):
+                    self.assertEqual(get_index().search([u'aaa']), [oblg.pk])
+            self.assertEqual(get_index().search([u'bbb']), [])
+
+            with mock.patch(u'time.time', return_value=time.time() + 61):
+                self.assertEqual(get_index().search([u'aaa']), [])
+                self.assertEqual(get_index().search([u'bbb']), [oblg.pk])
+
+class ResponseCacheTest(TestCase):
+    u"""
+    Tests ``ResponseCache`` LRU cache.
+    """
+
+    def test_get_and_set(self):
+        cache = ResponseCache(size=10)
+        self.assertIsNone(cache.get(u'aaa', u'gen'))
+        cache.set(u'aaa', u'gen', [1, 2])
+        self.assertEqual(cache.get(u'aaa', u'gen'), [1, 2])
+        self.assertEqual(cache.stats(), {u'hits': 1, u'misses': 1, u'entries': 1, u'size': 10})
+
+    def test_stats_are_logged_every_given_number_of_lookups(self):
+        cache = ResponseCache(size=10, log_every=3)
+        cache.set(u'aaa', u'gen', 1)
+        with mock.patch(u'chcemvediet.apps.obligees.search.logging') as logging:
+            cache.get(u'aaa', u'gen')
+            cache.get(u'bbb', u'gen')
+            self.assertEqual(logging.getLogger.return_value.info.call_count, 0)
+            cache.get(u'aaa', u'gen')
+            self.assertEqual(logging.getLogger.return_value.info.call_count, 1)
+            for i in range(3):
+                cache.get(u'aaa', u'gen')
+        logger = logging.getLogger.return_value
+        self.assertEqual(logging.getLogger.call_args[0][0], u'chcemvediet.obligees')
+        self.assertEqual(logger.info.call_count, 2)
+        self.assertEqual(logger.info.call_args_list[0][0][0] % logger.info.call_args_list[0][0][1],
+                u'Autocomplete cache has 2 hits and 1 misses, it holds 1 of 10 entries.')
+        self.assertEqual(logger.info.call_args[0][1], {u'hits': 5, u'misses': 1, u'entries': 1, u'size': 10})
+
+    def test_stats_are_not_logged_by_default(self):
+        cache = ResponseCache(size=10)
+        with mock.patch(u'chcemvediet.apps.obligees.search.logging') as logging:
+            for i in range(100):
+                cache.get(u'aaa', u'gen')
+        self.assertEqual(logging.getLogger.call_count, 0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = ResponseCache(size=2)
+        cache.set(u'aaa', u'gen', 1)
+        cache.set(u'bbb', u'gen', 2)
+        cache.get(u'aaa', u'gen')
+        cache.set(u'ccc', u'gen', 3)
+        self.assertEqual(cache.get(u'aaa', u'gen'), 1)
+        self.assertIsNone(cache.get(u'bbb', u'gen'))
+        self.assertEqual(cache.get(u'ccc', u'gen'), 3)
+
+    def test_new_generation_drops_all_entries(self):
+        cache = ResponseCache(size=10)
+        cache.set(u'aaa', u'gen1', 1)
+        self.assertIsNone(cache.get(u'aaa', u'gen2'))
+        cache.set(u'bbb', u'gen2', 2)
+        self.assertIsNone(cache.get(u'bbb', u'gen1'))
+        self.assertEqual(cache.stats()[u'entries'], 0)
+
+    def test_nothing_is_cached_without_generation(self):
+        cache = ResponseCache(size=10)
+        cache.set(u'aaa', None, 1)
+        self.assertIsNone(cache.get(u'aaa', None))
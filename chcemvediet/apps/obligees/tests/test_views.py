@@ -10,6 +10,7 @@ from django.test import TestCase
 from poleno.utils.test import ViewTestCaseMixin
 
 from . import ObligeesTestCaseMixin
+from .. import search
 from ..models import Obligee
 
 class IndexViewTest(ObligeesTestCaseMixin, ViewTestCaseMixin, TestCase):
@@ -65,6 +66,11 @@ class AutocompleteViewTest(ObligeesTestCaseMixin, ViewTestCaseMixin, TestCase):
     Tests ``autocomplete()`` view registered as "obligees:autocomplete".
     """
 
+    def setUp(self):
+        super(AutocompleteViewTest, self).setUp()
+        # Obligees created by previous tests were rolled back without any signals.
+        search.invalidate()
+
     def test_allowed_http_methods(self):
         allowed = [u'HEAD', u'GET']
         self.assert_allowed_http_methods(allowed, reverse(u'obligees:autocomplete'))
@@ -161,6 +167,29 @@ class AutocompleteViewTest(ObligeesTestCaseMixin, ViewTestCaseMixin, TestCase):
         found = [d[u'obligee'][u'name'] for d in data]
         self.assertItemsEqual(found, [u'aaa 1', u'aaa 2'])
 
+    def test_autocomplete_serves_repeated_term_from_cache(self):
+        oblg1 = self._create_obligee(name=u'aaa bbb')
+        oblg2 = self._create_obligee(name=u'bbb')
+        response = self.client.get(reverse(u'obligees:autocomplete') + u'?term=bbb+AAA')
+        with self.assertNumQueries(0):
+            response2 = self.client.get(reverse(u'obligees:autocomplete') + u'?term=aaa,bbb')
+        self.assertEqual(response2.content, response.content)
+        self.assertEqual([d[u'label'] for d in json.loads(response2.content)], [u'aaa bbb'])
+
+    def test_autocomplete_cache_is_invalidated_when_obligee_changes(self):
+        oblg1 = self._create_obligee(name=u'aaa 1')
+        response = self.client.get(reverse(u'obligees:autocomplete') + u'?term=aaa')
+        self.assertEqual([d[u'label'] for d in json.loads(response.content)], [u'aaa 1'])
+
+        oblg2 = self._create_obligee(name=u'aaa 2')
+        response = self.client.get(reverse(u'obligees:autocomplete') + u'?term=aaa')
+        self.assertEqual([d[u'label'] for d in json.loads(response.content)], [u'aaa 1', u'aaa 2'])
+
+        oblg1.status = Obligee.STATUSES.DISSOLVED
+        oblg1.save()
+        response = self.client.get(reverse(u'obligees:autocomplete') + u'?term=aaa')
+        self.assertEqual([d[u'label'] for d in json.loads(response.content)], [u'aaa 2'])
+
     def test_autocomplete_returns_at_most_10_obligees(self):
         oblgs = [self._create_obligee(name=u'aaa %02d' % i) for i in range(25)]
         response = self.client.get(reverse(u'obligees:autocomplete') + u'?term=aaa')
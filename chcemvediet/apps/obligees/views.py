@@ -1,17 +1,13 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
-import re
-import operator
-from unidecode import unidecode
-
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.shortcuts import render
 from django.forms.models import model_to_dict
 from django.views.decorators.http import require_http_methods
-from django.db.models import Q
 from django.http import JsonResponse
 
 from .models import Obligee
+from .search import split_words, get_generation, get_index, response_cache
 
 @require_http_methods([u'HEAD', u'GET'])
 def index(request):
@@ -33,16 +29,21 @@ def index(request):
 @require_http_methods([u'HEAD', u'GET'])
 def autocomplete(request):
     term = request.GET.get(u'term', u'')
-    term = unidecode(term).lower() # transliterate unicode to ascii
-    words = (w for w in re.split(r'[^a-z0-9]+', term) if w)
-
-    query = reduce(operator.and_, (Q(slug__contains=u'-'+w) for w in words), Q())
-    obligees = Obligee.objects.pending().filter(query).order_by_name()[:10]
-
-    data = [{
-        u'label': obligee.name,
-        u'obligee': model_to_dict(obligee),
-    } for obligee in obligees]
+    words = sorted(set(split_words(term)))
+
+    key = u' '.join(words)
+    generation = get_generation()
+    data = response_cache.get(key, generation)
+    if data is None:
+        pks = get_index(generation).search(words, limit=10)
+        obligees = Obligee.objects.pending().filter(pk__in=pks)
+        obligees = sorted(obligees, key=lambda o: pks.index(o.pk))
+
+        data = [{
+            u'label': obligee.name,
+            u'obligee': model_to_dict(obligee),
+        } for obligee in obligees]
+        response_cache.set(key, generation, data)
 
     # Note: Jquery-ui autocomplete expects JSON with Array, despite possible problems with
     # poisoning the JavaScript Array constructor.
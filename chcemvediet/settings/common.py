@@ -112,6 +112,7 @@ TEMPLATE_CONTEXT_PROCESSORS = (
 CRON_CLASSES = (
     u'poleno.cron.cron.clear_old_cronlogs',
     u'poleno.datacheck.cron.datacheck',
+    u'poleno.attachments.cron.remove_orphan_files',
     u'poleno.mail.cron.mail',
     u'chcemvediet.apps.inforequests.cron.undecided_email_reminder',
     u'chcemvediet.apps.inforequests.cron.obligee_deadline_reminder',
@@ -127,11 +128,15 @@ LOCALE_PATHS = (
     os.path.join(PROJECT_PATH, u'chcemvediet/locale/3part/allauth'),
     )
 
-# FIXME: We should probably not use filebased cache on production environment
+# Cache shared by all processes on the host. Use ``manage.py benchmarkcache`` to compare it with
+# ``FileBasedCache``.
 CACHES = {
     u'default': {
-        u'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        u'LOCATION': os.path.join(PROJECT_PATH, u'cache'),
+        u'BACKEND': 'poleno.utils.cache.SqliteCache',
+        u'LOCATION': os.path.join(PROJECT_PATH, u'cache', u'cache.sqlite'),
+        u'OPTIONS': {
+            u'MAX_ENTRIES': 10000,
+        },
     },
 }
 
@@ -86,6 +86,13 @@ LOGGING = {
             u'when': u'w0', # Monday
             u'formatter': u'verbose',
             },
+        u'file_stats': {
+            u'level': u'INFO',
+            u'class': u'logging.handlers.TimedRotatingFileHandler',
+            u'filename': os.path.join(PROJECT_PATH, u'logs/stats.log'),
+            u'when': u'w0', # Monday
+            u'formatter': u'verbose',
+            },
         u'file_general': {
             u'level': u'WARNING',
             u'class': u'logging.handlers.TimedRotatingFileHandler',
@@ -110,6 +117,16 @@ LOGGING = {
             u'level': u'INFO',
             u'propagate': False,
             },
+        u'poleno.mail': {
+            u'handlers': [u'mail_admins', u'file_cron'],
+            u'level': u'INFO',
+            u'propagate': False,
+            },
+        u'chcemvediet.obligees': {
+            u'handlers': [u'mail_admins', u'file_stats'],
+            u'level': u'INFO',
+            u'propagate': False,
+            },
         },
     u'root': {
         u'handlers': [u'mail_admins', u'file_general'],
@@ -0,0 +1,15 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import datetime
+
+from django.conf import settings
+
+from poleno.cron import cron_job, cron_logger
+
+from . import models
+
+@cron_job(run_at_times=[u'04:30'])
+def remove_orphan_files():
+    age = getattr(settings, u'ATTACHMENTS_ORPHAN_FILE_AGE', datetime.timedelta(days=5))
+    for name in models.remove_orphan_files(age):
+        cron_logger.info(u'Removed attachment file with no references: %s' % name)
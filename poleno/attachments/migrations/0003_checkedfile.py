@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attachments', '0002_attachment_file_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckedFile',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(help_text='Name of the attachment file verified by the attachments data check.', unique=True, max_length=255)),
+                ('size', models.BigIntegerField(help_text='File size in bytes when its content was last verified.')),
+                ('mtime', models.FloatField(help_text='File modification timestamp when its content was last verified.')),
+                ('checked', models.DateTimeField(help_text='Date and time the file was last checked. Its content is verified again only if its size or modification time has changed since.', db_index=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
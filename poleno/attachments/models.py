@@ -1,11 +1,15 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import os
+import re
+import base64
 import datetime
+import hashlib
 import logging
 
-from django.core.files.base import ContentFile
+from django.conf import settings
 from django.db import models
-from django.db.models import Q
+from django.db.models import Q, Count, Max
 from django.utils.functional import cached_property
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
@@ -13,7 +17,7 @@ from django.contrib.contenttypes import generic
 from poleno import datacheck
 from poleno.utils.models import QuerySet
 from poleno.utils.date import utc_now, utc_datetime_from_local
-from poleno.utils.misc import random_string, squeeze, decorate
+from poleno.utils.misc import squeeze, decorate
 
 class AttachmentQuerySet(QuerySet):
     def attached_to(self, *args):
@@ -38,8 +42,21 @@ class AttachmentQuerySet(QuerySet):
                 raise TypeError(u'Expecting QuerySet, Model instance, or Model class.')
         q = reduce((lambda a, b: a | b), q, Q())
         return self.filter(q)
+    def sharing_file(self, name):
+        return self.filter(file=name)
     def order_by_pk(self):
         return self.order_by(u'pk')
+    def bulk_create_with_files(self, attachments):
+        u"""
+        Creates new attachments with their files with a single query. Plain ``bulk_create`` is
+        forbidden as it does not call ``Attachment.save()`` which stores the attachment files and
+        computes their sizes. This method does the same for every attachment before inserting
+        them. Note that ``pk`` of the created attachments remains undefined.
+        """
+        for attachment in attachments:
+            attachment.prepare_new()
+        # Skip ``QuerySet.bulk_create`` guard, we have done what ``save()`` does.
+        super(QuerySet, self).bulk_create(attachments)
 
 class Attachment(models.Model):
     # May NOT be NULL; Generic relation; Index is prefix of [generic_type, generic_id] index, see index_together
@@ -47,8 +64,10 @@ class Attachment(models.Model):
     generic_id = models.CharField(max_length=255)
     generic_object = generic.GenericForeignKey(u'generic_type', u'generic_id')
 
-    # May NOT be NULL; Random local filename is generated in save() when creating a new object.
-    file = models.FileField(upload_to=u'attachments', max_length=255)
+    # May NOT be NULL; Content addressed; Local filename is computed in save() from the file
+    # content hash when creating a new object. Attachments with the same content share the same
+    # file, the number of attachments referencing the file is its reference count.
+    file = models.FileField(upload_to=u'attachments', max_length=255, db_index=True)
 
     # May be empty; May NOT be trusted, set by client.
     name = models.CharField(max_length=255,
@@ -82,32 +101,101 @@ class Attachment(models.Model):
                 [u'generic_type', u'generic_id'],
                 ]
 
+    # Multiple of 57, so every chunk encodes to whole lines of base64 encoded MIME content.
+    CHUNK_SIZE = 57 * 1024
+
     @cached_property
     def content(self):
+        u"""
+        Cached whole attachment content. Use ``chunks()`` or ``base64_chunks()`` to process large
+        attachments without loading them into memory.
+        """
+        return b''.join(self.chunks())
+
+    def chunks(self, chunk_size=None):
+        u"""
+        Reads the attachment file in chunks ``chunk_size`` bytes long. The file is open only while
+        the chunks are being read.
+        """
         try:
             self.file.open(u'rb')
-            return self.file.read()
         except IOError:
             logging.getLogger(u'poleno.attachments').error(u"%r is missing its file: '%s'.", self, self.file.name)
             raise
+        try:
+            for chunk in self.file.chunks(chunk_size or self.CHUNK_SIZE):
+                yield chunk
         finally:
             self.file.close()
 
+    def base64_chunks(self, chunk_size=None, mime=False):
+        u"""
+        Reads the attachment file in chunks and encodes them with base64. Concatenated chunks form
+        valid base64 encoding of the whole file. If ``mime`` is True, the encoded content is split
+        to lines 76 characters long as required by MIME.
+        """
+        encode = base64.encodestring if mime else base64.b64encode
+        rest = b''
+        for chunk in self.chunks(chunk_size):
+            chunk = rest + chunk
+            cut = len(chunk) - len(chunk) % 57
+            rest = chunk[cut:]
+            if cut:
+                yield encode(chunk[:cut])
+        if rest:
+            yield encode(rest)
+
+    @staticmethod
+    def content_hash(file):
+        u"""
+        Computes hex digest of SHA-256 hash of the given file content reading it in chunks.
+        """
+        digest = hashlib.sha256()
+        for chunk in file.chunks():
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def prepare_new(self):
+        u"""
+        Names the file of a new object by its content hash and computes the file size. If a file
+        with the same content is already stored, the object references it instead of storing
+        another copy. Already stored files, e.g. files of cloned attachments, are kept as they are.
+        The modification time of a reused file is refreshed, so ``remove_orphan_files()`` does not
+        remove it as an old file with no references.
+        """
+        if not self.file._committed:
+            # ``FieldFile`` refuses to read a file with no name, so we name it temporarily.
+            self.file.name = self.file.name or u'attachment'
+            field = self._meta.get_field(u'file')
+            digest = self.content_hash(self.file)
+            name = field.generate_filename(self, digest)
+            if field.storage.exists(name):
+                self.file = name
+                try:
+                    os.utime(field.storage.path(name), None)
+                except (NotImplementedError, OSError):
+                    pass
+            else:
+                self.file.name = digest
+        if self.created is None:
+            self.created = utc_now()
+        self.size = self.file.size
+
     @decorate(prevent_bulk_create=True)
     def save(self, *args, **kwargs):
         if self.pk is None: # Creating a new object
-            self.file.name = random_string(10)
-            if self.created is None:
-                self.created = utc_now()
-            self.size = self.file.size
+            self.prepare_new()
 
         super(Attachment, self).save(*args, **kwargs)
 
     def clone(self, generic_object):
-        u""" The returned copy is not saved. """
+        u"""
+        The returned copy is not saved. The copy references the same file as the original, so no
+        file content is copied.
+        """
         return Attachment(
                 generic_object=generic_object,
-                file=ContentFile(self.content),
+                file=self.file.name,
                 name=self.name,
                 content_type=self.content_type,
                 created=self.created,
@@ -116,34 +204,133 @@ class Attachment(models.Model):
     def __unicode__(self):
         return u'%s' % self.pk
 
+class CheckedFileQuerySet(QuerySet):
+    def order_by_checked(self):
+        return self.order_by(u'checked', u'pk')
+
+class CheckedFile(models.Model):
+    # May NOT be NULL; Unique; Attachment file name as stored in ``Attachment.file``.
+    name = models.CharField(max_length=255, unique=True,
+            help_text=squeeze(u"""
+                Name of the attachment file verified by the attachments data check.
+                """))
+
+    # May NOT be NULL
+    size = models.BigIntegerField(
+            help_text=squeeze(u"""
+                File size in bytes when its content was last verified.
+                """))
+
+    # May NOT be NULL
+    mtime = models.FloatField(
+            help_text=squeeze(u"""
+                File modification timestamp when its content was last verified.
+                """))
+
+    # May NOT be NULL; Index for ``order_by_checked()``
+    checked = models.DateTimeField(db_index=True,
+            help_text=squeeze(u"""
+                Date and time the file was last checked. Its content is verified again only if its
+                size or modification time has changed since.
+                """))
+
+    objects = CheckedFileQuerySet.as_manager()
+
+    def __unicode__(self):
+        return u'%s' % self.pk
+
+content_hash_regex = re.compile(r'^[0-9a-f]{64}$')
+
+def remove_orphan_files(age):
+    u"""
+    Removes attachment files with no references which were not modified for at least ``age``.
+    Files are not removed when their attachments are deleted, because the deletion can not be
+    rolled back with the transaction and because a concurrently created attachment with the same
+    content may reuse the file. The references and the modification time of every file are checked
+    again right before it is removed. Returns names of the removed files.
+    """
+    field = Attachment._meta.get_field(u'file')
+    if not field.storage.exists(field.upload_to):
+        return []
+    names = set(Attachment.objects.values_list(u'file', flat=True))
+    removed = []
+    for file_name in field.storage.listdir(field.upload_to)[1]:
+        name = u'%s/%s' % (field.upload_to, file_name)
+        if name in names:
+            continue
+        if utc_now() - utc_datetime_from_local(field.storage.modified_time(name)) < age:
+            continue
+        if Attachment.objects.sharing_file(name).exists():
+            continue
+        field.storage.delete(name)
+        removed.append(name)
+    return removed
+
 @datacheck.register
 def datachecks(superficial, autofix):
     u"""
-    Checks that every ``Attachment`` instance has its file working, and there are not any orphaned
-    attachment files.
+    Checks that every attachment file referenced by ``Attachment`` instances exists, has the size
+    of its attachments and, if it is named by its content hash, that its content matches the hash.
+    The content is hashed again only if the file size or modification time has changed since it was
+    last verified. Superficial runs check just a slice of the files, files never checked before
+    first, so every file is checked once in ``ATTACHMENTS_DATACHECK_DAYS`` daily runs. Full runs
+    check all files and look for attachment files with no references as well.
     """
-    # This check is a bit slow. We skip it if running from cron or the user asked for
-    # superficial tests only.
+    field = Attachment._meta.get_field(u'file')
+    now = utc_now()
+
+    CheckedFile.objects.exclude(name__in=Attachment.objects.values(u'file')).delete()
+    references = Attachment.objects.values_list(u'file').annotate(Count(u'pk'), Max(u'size')).order_by()
     if superficial:
-        return
+        total = Attachment.objects.values(u'file').distinct().count()
+        limit = total // getattr(settings, u'ATTACHMENTS_DATACHECK_DAYS', 7) + 1
+        unchecked = list(references.exclude(file__in=CheckedFile.objects.values(u'name'))[:limit])
+        oldest = CheckedFile.objects.order_by_checked().values_list(u'name', flat=True)[:limit-len(unchecked)]
+        references = unchecked + list(references.filter(file__in=list(oldest)))
+        checked = {c.name: c for c in CheckedFile.objects.filter(name__in=[r[0] for r in references])}
+    else:
+        checked = {c.name: c for c in CheckedFile.objects.all()}
 
-    attachments = Attachment.objects.all()
-    attachment_names = {a.file.name for a in attachments}
+    for name, count, size in sorted(references):
+        # Report the file as examined and let the runner check our time budget.
+        yield 1
 
-    for attachment in attachments:
+        record = checked.get(name)
         try:
-            try:
-                attachment.file.open(u'rb')
-            finally:
-                attachment.file.close()
-        except IOError:
-            yield datacheck.Error(u'%r is missing its file: "%s".', attachment, attachment.file.name)
+            statobj = os.stat(field.storage.path(name))
+        except OSError:
+            yield datacheck.Error(u'Attachment file "%s" referenced by %d attachments is missing.', name, count)
+            if record is not None:
+                record.delete()
+            continue
+        if statobj.st_size != size:
+            yield datacheck.Error(u'Attachment file "%s" referenced by %d attachments has %d bytes, but its attachments have %d bytes.', name, count, statobj.st_size, size)
+            continue
 
-    field = Attachment._meta.get_field(u'file')
+        if record is None or record.size != statobj.st_size or record.mtime != statobj.st_mtime:
+            digest = os.path.basename(name)
+            if content_hash_regex.match(digest):
+                with field.storage.open(name) as f:
+                    if Attachment.content_hash(f) != digest:
+                        yield datacheck.Error(u'Attachment file "%s" referenced by %d attachments does not match its content hash.', name, count)
+                        continue
+            record = record or CheckedFile(name=name)
+            record.size = statobj.st_size
+            record.mtime = statobj.st_mtime
+        record.checked = now
+        record.save()
+
+    if superficial:
+        return
+
+    names = set(r[0] for r in references)
     if not field.storage.exists(field.upload_to):
         return
     for file_name in field.storage.listdir(field.upload_to)[1]:
         attachment_name = u'%s/%s' % (field.upload_to, file_name)
+        yield 1
+        if attachment_name in names:
+            continue
         timedelta = utc_now() - utc_datetime_from_local(field.storage.modified_time(attachment_name))
-        if timedelta > datetime.timedelta(days=5) and attachment_name not in attachment_names:
-            yield datacheck.Info(u'There is no Attachment instance for file: "%s". The file is %d days old, so you can probably remove it.', attachment_name, timedelta.days)
+        if timedelta > getattr(settings, u'ATTACHMENTS_ORPHAN_FILE_AGE', datetime.timedelta(days=5)):
+            yield datacheck.Info(u'Attachment file "%s" has no references. The file is %d days old, so it should have been removed by the remove_orphan_files cron job.', attachment_name, timedelta.days)
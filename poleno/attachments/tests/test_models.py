@@ -1,20 +1,23 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import os
 import random
+import base64
 import datetime
 from testfixtures import TempDirectory
 
 from django.core.files.base import ContentFile
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.test import TestCase
 from django.test.utils import override_settings
 
+from poleno import datacheck
 from poleno.timewarp import timewarp
 from poleno.utils.date import utc_now, utc_datetime_from_local, local_datetime_from_local
 
-from ..models import Attachment
+from ..models import Attachment, CheckedFile, datachecks, remove_orphan_files
 
 class AttachmentModelTest(TestCase):
     u"""
@@ -82,7 +85,7 @@ class AttachmentModelTest(TestCase):
             obj.file.close()
 
     def test_file_field_may_not_be_omitted(self):
-        with self.assertRaisesMessage(OSError, u'No such file or directory'):
+        with self.assertRaisesMessage(ValueError, u"The 'file' attribute has no file associated with it."):
             obj = self._create_instance(_omit=[u'file'])
 
     def test_file_field_name_overriden_when_creating_new_instance(self):
@@ -93,6 +96,65 @@ class AttachmentModelTest(TestCase):
         obj = self._create_instance(file=ContentFile(u'content', name=u'overriden'))
         self.assertNotIn(u'overriden', obj.file.name)
 
+    def test_file_field_name_is_content_hash(self):
+        obj = self._create_instance(file=ContentFile(u'content'))
+        self.assertEqual(obj.file.name, u'attachments/ed7002b439e9ac845f22357d822bac1444730fbdb6016d3ec9432297b9ec9f73')
+
+    def test_file_field_with_same_content_shares_file(self):
+        obj1 = self._create_instance(file=ContentFile(u'content'))
+        obj2 = self._create_instance(file=ContentFile(u'content'))
+        obj3 = self._create_instance(file=ContentFile(u'other content'))
+        self.assertEqual(obj1.file.name, obj2.file.name)
+        self.assertNotEqual(obj1.file.name, obj3.file.name)
+        self.assertEqual(len(obj1.file.storage.listdir(u'attachments')[1]), 2)
+        self.assertEqual(Attachment.objects.sharing_file(obj1.file.name).count(), 2)
+
+    def test_shared_file_is_kept_when_one_of_its_attachments_is_deleted(self):
+        obj1 = self._create_instance(file=ContentFile(u'content'))
+        obj2 = self._create_instance(file=ContentFile(u'content'))
+        obj1.delete()
+        obj2 = Attachment.objects.get(pk=obj2.pk)
+        self.assertEqual(obj2.content, u'content')
+
+    def test_file_is_kept_when_attachment_deletion_is_rolled_back(self):
+        obj = self._create_instance(file=ContentFile(u'content'))
+        with self.assertRaises(ZeroDivisionError):
+            with transaction.atomic():
+                obj.delete()
+                1/0
+        obj = Attachment.objects.get(file=obj.file.name)
+        self.assertEqual(obj.content, u'content')
+
+    def test_old_files_with_no_references_are_removed(self):
+        obj1 = self._create_instance(file=ContentFile(u'content'))
+        obj2 = self._create_instance(file=ContentFile(u'content'))
+        obj3 = self._create_instance(file=ContentFile(u'other content'))
+        storage = obj1.file.storage
+        for obj in [obj1, obj3]:
+            os.utime(storage.path(obj.file.name), (0, 0))
+        obj1.delete()
+        obj3.delete()
+        self.assertEqual(remove_orphan_files(datetime.timedelta(days=5)), [obj3.file.name])
+        self.assertTrue(storage.exists(obj2.file.name))
+        self.assertFalse(storage.exists(obj3.file.name))
+
+    def test_recent_files_with_no_references_are_not_removed(self):
+        obj = self._create_instance(file=ContentFile(u'content'))
+        obj.delete()
+        self.assertEqual(remove_orphan_files(datetime.timedelta(days=5)), [])
+        self.assertTrue(obj.file.storage.exists(obj.file.name))
+
+    def test_reused_file_is_not_removed(self):
+        obj1 = self._create_instance(file=ContentFile(u'content'))
+        path = obj1.file.storage.path(obj1.file.name)
+        os.utime(path, (0, 0))
+        obj1.delete()
+        obj2 = self._create_instance(file=ContentFile(u'content'))
+        self.assertEqual(obj2.file.name, obj1.file.name)
+        self.assertGreater(os.stat(path).st_mtime, 0)
+        obj2.delete()
+        self.assertEqual(remove_orphan_files(datetime.timedelta(days=5)), [])
+
     def test_file_field_name_unchanged_when_saving_existing_instance(self):
         u"""
         Checks that when saving an already existing instance its file name is kept as it was when
@@ -148,6 +210,22 @@ class AttachmentModelTest(TestCase):
         obj = self._create_instance(file=ContentFile(u'content'))
         self.assertEqual(obj.content, u'content')
 
+    def test_chunks_method(self):
+        obj = self._create_instance(file=ContentFile(u'0123456789'))
+        self.assertEqual(list(obj.chunks(chunk_size=4)), [u'0123', u'4567', u'89'])
+
+    def test_base64_chunks_method(self):
+        content = b''.join(chr(i % 256) for i in range(1000))
+        obj = self._create_instance(file=ContentFile(content))
+        chunks = list(obj.base64_chunks(chunk_size=100))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), base64.b64encode(content))
+
+    def test_base64_chunks_method_with_mime_lines(self):
+        content = b''.join(chr(i % 256) for i in range(1000))
+        obj = self._create_instance(file=ContentFile(content))
+        self.assertEqual(b''.join(obj.base64_chunks(chunk_size=100, mime=True)), base64.encodestring(content))
+
     def test_clone_method_clone_is_not_saved_automatically(self):
         obj = self._create_instance()
         new = obj.clone(obj.generic_object)
@@ -170,13 +248,13 @@ class AttachmentModelTest(TestCase):
         self.assertEqual(new.size, obj.size)
         self.assertEqual(new.content, obj.content)
 
-    def test_clone_method_clone_has_new_file_name(self):
+    def test_clone_method_clone_shares_file_with_original(self):
         obj = self._create_instance()
         new = obj.clone(obj.generic_object)
-        self.assertIsNone(new.file.name)
-        new.save()
-        self.assertNotEqual(new.file.name, obj.file.name)
-        self.assertRegexpMatches(new.file.name, u'^attachments/[\w\d]+$')
+        with self.assertNumQueries(1):
+            new.save()
+        self.assertEqual(new.file.name, obj.file.name)
+        self.assertEqual(len(obj.file.storage.listdir(u'attachments')[1]), 1)
 
     def test_clone_method_clone_has_old_created_value(self):
         timewarp.jump(local_datetime_from_local(u'2014-10-05 15:33:10'))
@@ -235,3 +313,121 @@ class AttachmentModelTest(TestCase):
         sample = random.sample(objs, 10)
         result = Attachment.objects.filter(pk__in=(d.pk for d in sample)).order_by_pk().reverse()
         self.assertEqual(list(result), sorted(sample, key=lambda d: -d.pk))
+
+    def test_bulk_create_is_forbidden(self):
+        with self.assertRaisesMessage(ValueError, u"Can't bulk create Attachment"):
+            Attachment.objects.bulk_create([Attachment(generic_object=self.user, file=ContentFile(u'content'))])
+
+    def test_bulk_create_with_files_query_method(self):
+        objs = [Attachment(generic_object=self.user, file=ContentFile(u'content %d' % i), name=u'file%d.txt' % i, content_type=u'text/plain') for i in range(3)]
+        with self.assertNumQueries(1):
+            Attachment.objects.bulk_create_with_files(objs)
+        result = Attachment.objects.attached_to(self.user).order_by_pk()
+        self.assertEqual([a.name for a in result], [u'file0.txt', u'file1.txt', u'file2.txt'])
+        self.assertEqual([a.size for a in result], [9, 9, 9])
+        self.assertEqual([a.content for a in result], [u'content 0', u'content 1', u'content 2'])
+        for obj in result:
+            self.assertRegexpMatches(obj.file.name, u'^attachments/[\w\d]+$')
+            self.assertAlmostEqual(obj.created, utc_now(), delta=datetime.timedelta(seconds=10))
+
+class AttachmentDatacheckTest(TestCase):
+    u"""
+    Tests incremental attachment files data check.
+    """
+
+    def setUp(self):
+        self.tempdir = TempDirectory()
+
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.tempdir.path,
+            PASSWORD_HASHERS=(u'django.contrib.auth.hashers.MD5PasswordHasher',),
+            )
+        self.settings_override.enable()
+
+        self.user = User.objects.create_user(u'john', u'lennon@thebeatles.com', u'johnpassword')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.tempdir.cleanup()
+
+
+    def _create_instance(self, content):
+        return Attachment.objects.create(generic_object=self.user, file=ContentFile(content), name=u'filename.txt')
+
+    def _run(self, superficial=False):
+        return [i for i in datachecks(superficial=superficial, autofix=False) if isinstance(i, datacheck.Issue)]
+
+    def _corrupt(self, obj, content):
+        path = obj.file.storage.path(obj.file.name)
+        statobj = os.stat(path)
+        with open(path, u'wb') as f:
+            f.write(content)
+        return path, statobj
+
+    def test_valid_files_are_recorded(self):
+        obj1 = self._create_instance(u'content')
+        obj2 = self._create_instance(u'content')
+        obj3 = self._create_instance(u'other content')
+        self.assertEqual(self._run(), [])
+        self.assertItemsEqual(CheckedFile.objects.values_list(u'name', u'size'),
+                [(obj1.file.name, 7), (obj3.file.name, 13)])
+
+    def test_missing_file(self):
+        obj = self._create_instance(u'content')
+        obj.file.storage.delete(obj.file.name)
+        issues = self._run()
+        self.assertEqual([i.msg for i in issues], [u'Attachment file "%s" referenced by 1 attachments is missing.' % obj.file.name])
+        self.assertFalse(CheckedFile.objects.exists())
+
+    def test_file_with_wrong_size(self):
+        obj = self._create_instance(u'content')
+        self._corrupt(obj, u'longer content')
+        issues = self._run()
+        self.assertEqual([i.msg for i in issues], [u'Attachment file "%s" referenced by 1 attachments has 14 bytes, but its attachments have 7 bytes.' % obj.file.name])
+
+    def test_modified_file_content_is_verified_again(self):
+        obj = self._create_instance(u'content')
+        self.assertEqual(self._run(), [])
+        path, statobj = self._corrupt(obj, u'CONTENT')
+        os.utime(path, (statobj.st_atime, statobj.st_mtime + 10))
+        issues = self._run()
+        self.assertEqual([i.msg for i in issues], [u'Attachment file "%s" referenced by 1 attachments does not match its content hash.' % obj.file.name])
+
+    def test_unmodified_file_content_is_not_verified_again(self):
+        obj = self._create_instance(u'content')
+        os.utime(obj.file.storage.path(obj.file.name), (1413500000, 1413500000))
+        self.assertEqual(self._run(), [])
+        path, statobj = self._corrupt(obj, u'CONTENT')
+        os.utime(path, (1413500000, 1413500000))
+        self.assertEqual(self._run(), [])
+
+    def test_records_of_unreferenced_files_are_removed(self):
+        obj1 = self._create_instance(u'content')
+        obj2 = self._create_instance(u'other content')
+        self._run()
+        obj1.delete()
+        self._run()
+        self.assertEqual(list(CheckedFile.objects.values_list(u'name', flat=True)), [obj2.file.name])
+
+    @override_settings(ATTACHMENTS_DATACHECK_DAYS=2)
+    def test_superficial_check_checks_unchecked_and_oldest_files_first(self):
+        objs = [self._create_instance(u'content %d' % i) for i in range(4)]
+        self._run(superficial=True)
+        first = set(CheckedFile.objects.values_list(u'name', flat=True))
+        self.assertEqual(len(first), 3)
+
+        CheckedFile.objects.update(checked=utc_now() - datetime.timedelta(days=1))
+        oldest = CheckedFile.objects.order_by_checked().first()
+        self._run(superficial=True)
+        self.assertEqual(CheckedFile.objects.count(), 4)
+        stale = CheckedFile.objects.filter(checked__lt=utc_now() - datetime.timedelta(hours=1))
+        self.assertEqual(stale.count(), 1)
+        self.assertNotEqual(stale.get(), oldest)
+
+    def test_superficial_check_skips_files_with_no_references(self):
+        obj = self._create_instance(u'content')
+        obj.file.storage.save(u'attachments/orphan', ContentFile(u'orphan'))
+        path = obj.file.storage.path(u'attachments/orphan')
+        os.utime(path, (0, 0))
+        self.assertEqual(self._run(superficial=True), [])
+        self.assertEqual(len(self._run()), 1)
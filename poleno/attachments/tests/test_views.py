@@ -89,6 +89,43 @@ class AttachmentViewsTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(u''.join(response.streaming_content), u'content')
 
+    def test_download_with_if_none_match(self):
+        obj = Attachment.objects.create(
+                generic_object=self.user,
+                file=ContentFile(u'content'),
+                name=u'filename',
+                content_type=u'text/plain',
+                )
+        response = self.client.get(u'/download/')
+        etag = response[u'ETag']
+        response = self.client.get(u'/download/', HTTP_IF_NONE_MATCH=etag)
+        self.assertIs(type(response), HttpResponseNotModified)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response[u'ETag'], etag)
+
+    def test_download_attachments_with_same_content_have_same_etag(self):
+        obj1 = Attachment.objects.create(generic_object=self.user, file=ContentFile(u'content'), name=u'aaa')
+        obj2 = Attachment.objects.create(generic_object=self.user2, file=ContentFile(u'content'), name=u'bbb')
+        obj3 = Attachment.objects.create(generic_object=self.user2, file=ContentFile(u'other'), name=u'bbb')
+        etags = []
+        for obj in [obj1, obj2, obj3]:
+            Attachment.objects.exclude(pk=obj.pk).filter(pk__lt=obj.pk).delete()
+            etags.append(self.client.get(u'/download/')[u'ETag'])
+        self.assertEqual(etags[0], etags[1])
+        self.assertNotEqual(etags[1], etags[2])
+
+    def test_download_with_range(self):
+        obj = Attachment.objects.create(
+                generic_object=self.user,
+                file=ContentFile(u'content'),
+                name=u'filename',
+                content_type=u'text/plain',
+                )
+        response = self.client.get(u'/download/', HTTP_RANGE=u'bytes=3-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response[u'Content-Range'], u'bytes 3-6/7')
+        self.assertEqual(u''.join(response.streaming_content), u'tent')
+
     def test_upload(self):
         response = self.client.post(u'/upload/', {u'files': ContentFile(u'uploaded', name=u'filename')})
         self.assertIs(type(response), JsonResponse)
@@ -1,6 +1,7 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 import os
+import hashlib
 
 from django.conf import settings
 from django.http import JsonResponse
@@ -30,4 +31,7 @@ def upload(request, generic_object, download_url_func):
 def download(request, attachment):
     # FIXME: If ``attachment.content_type`` is among whitelisted content types, we should use it.
     path = os.path.join(settings.MEDIA_ROOT, attachment.file.name)
-    return send_file_response(request, path, attachment.name, u'application/octet-stream')
+    # Attachment files are named by their content hash and are never modified, so the file name
+    # identifies the content.
+    etag = u'%s-%x' % (hashlib.sha1(attachment.file.name.encode(u'utf-8')).hexdigest(), attachment.size)
+    return send_file_response(request, path, attachment.name, u'application/octet-stream', etag=etag)
@@ -1,12 +1,20 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+from django.conf import settings
+
 from poleno.cron import cron_job, cron_logger
 
 from .datacheck import registry
 
 @cron_job(run_at_times=[u'04:00'])
 def datacheck():
-    issues = registry.run_checks(superficial=True)
+    results = registry.run(superficial=True,
+            jobs=getattr(settings, u'DATACHECK_JOBS', 1),
+            budget=getattr(settings, u'DATACHECK_BUDGET', None))
+    issues = [i for r in results for i in r.issues]
     for issue in issues:
         cron_logger.log(issue.level, u'%s', issue)
+    for result in results:
+        cron_logger.debug(u'Data check %s identified %d issues in %d rows in %.1f s%s.', result.check,
+                len(result.issues), result.rows, result.elapsed, u' (partial)' if result.partial else u'')
     cron_logger.info(u'Data check identified %s issues.', len(issues))
@@ -1,7 +1,11 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import time
 import functools
 from logging import DEBUG, INFO, WARNING, ERROR, CRITICAL
+from multiprocessing.pool import ThreadPool
+
+from django.db import connections
 
 class Issue(object):
 
@@ -76,6 +80,27 @@ class Check(object):
     def __repr__(self):
         return u'<%s: %s>' % (self.__class__.__name__, self.name)
 
+class CheckResult(object):
+    u"""
+    Issues reported by a single check together with its wall time and the number of rows it
+    examined. Checks report examined rows by yielding integers, so ``rows`` stays zero for checks
+    that examine their data with aggregate queries and do not count it. ``partial`` is True if the
+    check ran out of its time budget and was stopped before it finished.
+    """
+
+    def __init__(self, check):
+        self.check = check
+        self.issues = []
+        self.rows = 0
+        self.elapsed = None
+        self.partial = False
+
+    def __repr__(self):
+        return u'<%s: %s issues=%d rows=%d elapsed=%.3f%s>' % (
+                self.__class__.__name__, self.check.name, len(self.issues), self.rows,
+                self.elapsed or 0, u' partial' if self.partial else u'',
+                )
+
 class Registry(object):
 
     def __init__(self):
@@ -102,18 +127,71 @@ class Registry(object):
                 res.checks.add(check)
         return res
 
-    def run_checks(self, superficial=False, autofix=False):
+    def _run_check(self, check, superficial, autofix, budget):
+        result = CheckResult(check)
+        start = time.time()
+        issues = check(superficial=superficial, autofix=autofix)
+        try:
+            for issue in issues or []:
+                # Checks may yield the number of rows they examined or None to let us check the
+                # budget while they find no issues.
+                if isinstance(issue, (int, long)):
+                    result.rows += issue
+                elif issue is not None:
+                    issue.issuer = check
+                    issue.autofixed = autofix and issue.autofixable
+                    result.issues.append(issue)
+                if budget is not None and time.time() - start > budget:
+                    result.partial = True
+                    issue = Warning(u'Check ran out of its time budget of %s seconds. Its results are partial.', budget)
+                    issue.issuer = check
+                    result.issues.append(issue)
+                    break
+        finally:
+            if hasattr(issues, u'close'):
+                issues.close()
+            result.elapsed = time.time() - start
+        return result
+
+    def _run_check_in_thread(self, args):
+        try:
+            return self._run_check(*args)
+        finally:
+            for connection in connections.all():
+                connection.close()
+
+    def run(self, superficial=False, autofix=False, jobs=1, budget=None):
+        u"""
+        Run registered checks and return a list of ``CheckResult`` instances in the order of the
+        checks. Pass ``jobs`` greater than one to run the checks concurrently in a pool of threads
+        with their own database connections. If ``budget`` is given, every check is stopped as
+        soon as it yields after running for more than ``budget`` seconds and its results are marked
+        as partial.
+
+        Note that the budget is cooperative. A check is never interrupted, it is only stopped
+        between two yielded items. A check that runs a single slow query before yielding anything,
+        or that yields nothing at all, runs to its end regardless of the budget. Slow checks should
+        therefore yield the number of examined rows, or at least None, regularly while they find no
+        issues. See ``run_checks()`` for the other arguments.
+        """
+        args = [(check, superficial, autofix, budget) for check in self]
+        if jobs <= 1 or len(args) <= 1:
+            return [self._run_check(*a) for a in args]
+        pool = ThreadPool(min(jobs, len(args)))
+        try:
+            return pool.map(self._run_check_in_thread, args, chunksize=1)
+        finally:
+            pool.terminate()
+
+    def run_checks(self, superficial=False, autofix=False, jobs=1, budget=None):
         u"""
         Run registered checks and collect reported issues. Pass ``superficial=True`` to run only
         siplified checks and skip any checks that may be slow. Pass ``autofix=True`` to
-        automatically fix trivial issues.
+        automatically fix trivial issues. See ``run()`` for ``jobs`` and ``budget`` arguments.
         """
         issues = []
-        for check in self:
-            for issue in check(superficial=superficial, autofix=autofix):
-                issue.issuer = check
-                issue.autofixed = autofix and issue.autofixable
-                issues.append(issue)
+        for result in self.run(superficial=superficial, autofix=autofix, jobs=jobs, budget=budget):
+            issues.extend(result.issues)
         return issues
 
 registry = Registry()
@@ -16,6 +16,10 @@ class Command(BaseCommand):
             help=u'Run only siplified checks and skip any checks that may be slow.'),
         make_option(u'--autofix', action=u'store_true', dest=u'autofix', default=False,
             help=u'Automatically fix trivial issues.'),
+        make_option(u'--jobs', action=u'store', type=u'int', dest=u'jobs', default=1,
+            help=u'Number of checks to run concurrently.'),
+        make_option(u'--budget', action=u'store', type=u'float', dest=u'budget', default=None,
+            help=u'Stop every check running for longer than the given number of seconds and report its partial results. Only checks that yield regularly can be stopped.'),
         )
 
     def handle(self, *prefixes, **options):
@@ -44,7 +48,9 @@ class Command(BaseCommand):
             output.append(u'Running all registered data checks.')
             output.append(u'')
 
-        issues = registry.run_checks(superficial=options[u'superficial'], autofix=options[u'autofix'])
+        results = registry.run(superficial=options[u'superficial'], autofix=options[u'autofix'],
+                jobs=options[u'jobs'], budget=options[u'budget'])
+        issues = [i for r in results for i in r.issues]
         autofixable = len([s for s in issues if s.autofixable])
         if autofixable:
             if options[u'autofix']:
@@ -61,4 +67,10 @@ class Command(BaseCommand):
                 output.append(u'%s:' % group)
                 output.extend(style(u'%s' % a) for a in filtered)
 
+        if int(options[u'verbosity']) >= 2:
+            output.append(u'')
+            output.append(u'TIMING:')
+            output.extend(u'%8.1f s %5d issues %8d rows%s  %s' % (r.elapsed, len(r.issues), r.rows, u' (partial)' if r.partial else u'          ', r.check)
+                    for r in sorted(results, key=lambda r: -r.elapsed))
+
         self.stdout.write(u'\n'.join(output))
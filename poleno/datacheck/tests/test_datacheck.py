@@ -0,0 +1,234 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import itertools
+import threading
+import mock
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from .. import datacheck
+
+class DatacheckTest(TestCase):
+    u"""
+    Tests ``Registry.run()`` and ``Registry.run_checks()`` with time budgets and concurrent jobs.
+    """
+
+    def _run(self, registry, **kwargs):
+        # Every call to ``time.time()`` advances the clock by one second.
+        with mock.patch(u'poleno.datacheck.datacheck.time.time', side_effect=itertools.count()):
+            return registry.run(**kwargs)
+
+    def _registry(self, *funcs):
+        registry = datacheck.Registry()
+        for func in funcs:
+            registry.register(func)
+        return registry
+
+
+    def test_run_returns_result_for_every_check(self):
+        def check_a(superficial, autofix):
+            yield datacheck.Error(u'First')
+            yield 10
+            yield datacheck.Warning(u'Second')
+        def check_b(superficial, autofix):
+            return None
+        registry = self._registry(check_a, check_b)
+        results = self._run(registry)
+        self.assertEqual([r.check.name for r in results], [c.name for c in registry])
+        result_a, result_b = results
+        self.assertEqual([i.msg for i in result_a.issues], [u'First', u'Second'])
+        self.assertEqual([i.issuer for i in result_a.issues], [result_a.check, result_a.check])
+        self.assertEqual(result_a.rows, 10)
+        self.assertFalse(result_a.partial)
+        self.assertEqual(result_b.issues, [])
+        self.assertEqual(result_b.rows, 0)
+        self.assertFalse(result_b.partial)
+
+    def test_run_records_elapsed_time(self):
+        def check(superficial, autofix):
+            yield None
+            yield None
+        result, = self._run(self._registry(check))
+        self.assertEqual(result.elapsed, 1)
+
+    def test_rows_are_summed(self):
+        def check(superficial, autofix):
+            for i in range(7):
+                yield 3
+            yield None
+        result, = self._run(self._registry(check))
+        self.assertEqual(result.rows, 21)
+        self.assertEqual(result.issues, [])
+
+    def test_budget_stops_check_that_yields(self):
+        examined = []
+        def check(superficial, autofix):
+            for i in range(100):
+                examined.append(i)
+                yield 1
+        result, = self._run(self._registry(check), budget=3.0)
+        self.assertTrue(result.partial)
+        self.assertEqual(examined, [0, 1, 2, 3])
+        self.assertEqual(result.rows, 4)
+
+    def test_partial_result_keeps_issues_found_so_far(self):
+        def check(superficial, autofix):
+            yield datacheck.Error(u'First')
+            yield None
+            yield datacheck.Error(u'Second')
+            yield datacheck.Error(u'Third')
+        result, = self._run(self._registry(check), budget=2.5)
+        self.assertTrue(result.partial)
+        self.assertEqual([i.level for i in result.issues], [datacheck.ERROR, datacheck.ERROR, datacheck.WARNING])
+        self.assertEqual([i.msg for i in result.issues][:2], [u'First', u'Second'])
+        self.assertIn(u'ran out of its time budget of 2.5 seconds', result.issues[-1].msg)
+        self.assertEqual(result.issues[-1].issuer, result.check)
+
+    def test_stopped_check_is_closed(self):
+        closed = []
+        def check(superficial, autofix):
+            try:
+                while True:
+                    yield None
+            finally:
+                closed.append(True)
+        result, = self._run(self._registry(check), budget=5)
+        self.assertTrue(result.partial)
+        self.assertEqual(closed, [True])
+
+    def test_check_within_budget_is_not_partial(self):
+        def check(superficial, autofix):
+            yield datacheck.Error(u'First')
+            yield None
+        result, = self._run(self._registry(check), budget=10)
+        self.assertFalse(result.partial)
+        self.assertEqual([i.msg for i in result.issues], [u'First'])
+
+    def test_check_returning_list_finishes_its_work_before_budget_applies(self):
+        examined = []
+        def check(superficial, autofix):
+            examined.extend(range(100))
+            return [datacheck.Error(u'First'), datacheck.Error(u'Second')]
+        result, = self._run(self._registry(check), budget=0)
+        self.assertEqual(examined, range(100))
+        self.assertTrue(result.partial)
+        self.assertEqual([(i.level, i.msg) for i in result.issues], [
+                (datacheck.ERROR, u'First'),
+                (datacheck.WARNING, u'Check ran out of its time budget of 0 seconds. Its results are partial.'),
+                ])
+
+    def test_run_with_jobs_runs_checks_concurrently(self):
+        started = {u'a': threading.Event(), u'b': threading.Event()}
+        met = {}
+        threads = []
+        def check_a(superficial, autofix):
+            threads.append(threading.current_thread())
+            started[u'a'].set()
+            # Both checks wait for each other, so they meet only if they run concurrently.
+            met[u'a'] = started[u'b'].wait(5)
+            yield 1
+        def check_b(superficial, autofix):
+            threads.append(threading.current_thread())
+            started[u'b'].set()
+            met[u'b'] = started[u'a'].wait(5)
+            yield datacheck.Error(u'B')
+        registry = self._registry(check_b, check_a)
+        results = registry.run(jobs=2)
+        self.assertEqual([r.check.name for r in results], [c.name for c in registry])
+        self.assertEqual(met, {u'a': True, u'b': True})
+        self.assertEqual(len(set(threads)), 2)
+        self.assertNotIn(threading.current_thread(), threads)
+        self.assertEqual([r.rows for r in results], [1, 0])
+        self.assertEqual([[i.msg for i in r.issues] for r in results], [[], [u'B']])
+
+    def test_run_with_jobs_and_budget(self):
+        def check_infinite(superficial, autofix):
+            while True:
+                yield 1
+        def check_finite(superficial, autofix):
+            yield datacheck.Error(u'Finite')
+        registry = self._registry(check_infinite, check_finite)
+        results = registry.run(jobs=2, budget=0.01)
+        self.assertEqual([r.check.name for r in results], [c.name for c in registry])
+        result_finite, result_infinite = results
+        self.assertTrue(result_infinite.partial)
+        self.assertGreater(result_infinite.rows, 0)
+        self.assertFalse(result_finite.partial)
+        self.assertEqual([i.msg for i in result_finite.issues], [u'Finite'])
+
+    def test_run_with_jobs_closes_thread_connections(self):
+        def check(superficial, autofix):
+            yield None
+        registry = self._registry(check, lambda superficial, autofix: None)
+        with mock.patch(u'poleno.datacheck.datacheck.connections') as mock_connections:
+            mock_connection = mock.Mock()
+            mock_connections.all.return_value = [mock_connection]
+            registry.run(jobs=2)
+        self.assertEqual(mock_connection.close.call_count, 2)
+
+    def test_run_checks_flattens_issues(self):
+        def check_a(superficial, autofix):
+            yield datacheck.Error(u'A')
+        def check_b(superficial, autofix):
+            yield 5
+            yield datacheck.Info(u'B')
+        issues = self._registry(check_a, check_b).run_checks(jobs=2)
+        self.assertEqual([i.msg for i in issues], [u'A', u'B'])
+
+class DatacheckManagementTest(TestCase):
+    u"""
+    Tests ``datacheck`` management command.
+    """
+
+    def _call_datacheck(self, registry, *args, **kwargs):
+        stdout = StringIO()
+        with mock.patch(u'poleno.datacheck.datacheck.registry', registry):
+            with mock.patch(u'poleno.datacheck.datacheck.time.time', side_effect=itertools.count()):
+                call_command(u'datacheck', *args, stdout=stdout, **kwargs)
+        return stdout.getvalue()
+
+    def _registry(self):
+        def slow(superficial, autofix):
+            for i in range(100):
+                yield 1
+            yield datacheck.Error(u'Not reached')
+        def fast(superficial, autofix):
+            yield 2
+            yield datacheck.Error(u'Fast error')
+        registry = datacheck.Registry()
+        registry.register(slow)
+        registry.register(fast)
+        return registry
+
+
+    def test_default_runs_checks_to_completion(self):
+        output = self._call_datacheck(self._registry())
+        self.assertIn(u'Data checks identified 2 issues.', output)
+        self.assertIn(u'Fast error', output)
+        self.assertIn(u'Not reached', output)
+        self.assertNotIn(u'time budget', output)
+        self.assertNotIn(u'TIMING', output)
+
+    def test_budget_option(self):
+        output = self._call_datacheck(self._registry(), budget=3.0)
+        self.assertIn(u'Data checks identified 2 issues.', output)
+        self.assertIn(u'Fast error', output)
+        self.assertNotIn(u'Not reached', output)
+        self.assertIn(u'Check ran out of its time budget of 3.0 seconds.', output)
+
+    def test_jobs_option(self):
+        registry = self._registry()
+        with mock.patch.object(datacheck.Registry, u'run', autospec=True, side_effect=datacheck.Registry.run) as mock_run:
+            output = self._call_datacheck(registry, jobs=2, budget=3.0)
+        self.assertEqual(mock_run.mock_calls, [mock.call(registry, superficial=False, autofix=False, jobs=2, budget=3.0)])
+        self.assertIn(u'Data checks identified 2 issues.', output)
+
+    def test_timing_is_printed_with_verbosity(self):
+        output = self._call_datacheck(self._registry(), budget=3.0, verbosity=2)
+        lines = output.splitlines()
+        timing = lines[lines.index(u'TIMING:')+1:]
+        self.assertEqual(len(timing), 2)
+        self.assertRegexpMatches(timing[0], r'^\s+\d+\.\d s\s+1 issues\s+4 rows \(partial\)  .*\.slow$')
+        self.assertRegexpMatches(timing[1], r'^\s+\d+\.\d s\s+1 issues\s+2 rows\s+.*\.fast$')
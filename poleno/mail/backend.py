@@ -58,6 +58,15 @@ class EmailBackend(BaseEmailBackend):
 
         attachments = []
         for attachment in message.attachments + remnant_alternatives:
+            if isinstance(attachment, Attachment):
+                # Stored attachments share their file, so their content is neither loaded nor
+                # copied.
+                attachments.append(Attachment(
+                        file=attachment.file.name,
+                        name=attachment.name,
+                        content_type=attachment.content_type,
+                        ))
+                continue
             if isinstance(attachment, MIMEBase):
                 name = attachment.get_filename()
                 content = attachment.get_payload(decode=True)
@@ -83,13 +92,5 @@ class EmailBackend(BaseEmailBackend):
                 html=html or u'',
                 headers=headers,
                 )
-        msg.save()
+        msg.save_with_recipients_and_attachments(recipients, attachments)
         message.instance = msg
-
-        for recipient in recipients:
-            recipient.message = msg
-            recipient.save()
-
-        for attachment in attachments:
-            attachment.generic_object = msg
-            attachment.save()
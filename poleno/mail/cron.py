@@ -1,8 +1,12 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import time
+import datetime
+import threading
 import traceback
+import Queue
 
-from django.db import transaction
+from django.db import connection, transaction
 from django.conf import settings
 from django.utils.module_loading import import_by_path
 
@@ -11,7 +15,7 @@ from poleno.utils.date import utc_now
 from poleno.utils.misc import nop
 
 from .models import Message
-from .signals import message_sent, message_received
+from .signals import message_sent, message_received, messages_received, messages_changed
 
 @cron_job(run_every_mins=1)
 def mail():
@@ -33,45 +37,212 @@ def mail():
                     cron_logger.error(u'Receiving emails failed:\n%s' % traceback.format_exc())
                     break
 
-    # Process inbound mail; At most 10 messages in one batch
-    messages = (Message.objects
-            .inbound()
-            .not_processed()
-            .order_by_pk()
-            .prefetch_related(Message.prefetch_recipients())
-            )[:10]
+    # Process inbound mail
+    batch = getattr(settings, u'EMAIL_INBOUND_BATCH', 10)
+    budget = getattr(settings, u'EMAIL_INBOUND_BUDGET', datetime.timedelta(seconds=30))
+    limit = getattr(settings, u'EMAIL_INBOUND_LIMIT', 1000)
+    _process_inbound_backlog(batch, budget, limit)
+
+    # Send outbound mail
+    path = getattr(settings, u'EMAIL_OUTBOUND_TRANSPORT', None)
+    if path:
+        klass = import_by_path(path)
+        batch = getattr(settings, u'EMAIL_OUTBOUND_BATCH', 10)
+        workers = getattr(settings, u'EMAIL_OUTBOUND_WORKERS', 1)
+        lease = getattr(settings, u'EMAIL_OUTBOUND_LEASE', datetime.timedelta(minutes=10))
+        budget = getattr(settings, u'EMAIL_OUTBOUND_BUDGET', datetime.timedelta(seconds=30))
+        limit = getattr(settings, u'EMAIL_OUTBOUND_LIMIT', 1000)
+        _send_outbound_backlog(klass, batch, workers, lease, budget, limit)
+
+def _log_backlog(action, messages, remaining):
+    processed = [m for m in messages if m.processed is not None]
+    latencies = [(m.processed - m.created).total_seconds() for m in processed if m.created is not None]
+    cron_logger.info(u'%s %d of %d emails; %d emails remaining in backlog; latency avg %.1f s, max %.1f s.' %
+            (action, len(processed), len(messages), remaining,
+                sum(latencies) / len(latencies) if latencies else 0.0, max(latencies or [0.0])))
+
+def _process_inbound_group(messages):
+    with transaction.atomic():
+        processed = utc_now()
+        Message.objects.filter(pk__in=[m.pk for m in messages]).update(processed=processed)
+        messages_changed.send(sender=None, message_pks=[m.pk for m in messages])
+        for message in messages:
+            message.processed = processed
+            message_received.send(sender=None, message=message)
+        messages_received.send(sender=None, messages=messages)
+        nop() # To let tests raise testing exception here.
+    for message in messages:
+        cron_logger.info(u'Processed received email: %s' % repr(message))
+
+def _process_inbound_messages(messages):
+    u"""
+    Marks a batch of inbound messages as processed and emits ``message_received`` signal for every
+    message and ``messages_received`` signal for the whole batch, so the receivers may process the
+    batch with a few queries. If processing the batch fails, the messages are processed one by one,
+    so a single broken message does not block the others.
+    """
+    try:
+        _process_inbound_group(messages)
+        return
+    except Exception:
+        for message in messages:
+            message.processed = None
+        if len(messages) == 1:
+            cron_logger.error(u'Processing received email failed: %s\n%s' % (repr(messages[0]), traceback.format_exc()))
+            return
+        cron_logger.warning(u'Processing received email batch failed, processing emails one by one:\n%s' % traceback.format_exc())
+
     for message in messages:
         try:
-            with transaction.atomic():
-                message.processed = utc_now()
-                message.save(update_fields=[u'processed'])
-                message_received.send(sender=None, message=message)
-                nop() # To let tests raise testing exception here.
-            cron_logger.info(u'Processed received email: %s' % repr(message))
+            _process_inbound_group([message])
         except Exception:
+            message.processed = None
             cron_logger.error(u'Processing received email failed: %s\n%s' % (repr(message), traceback.format_exc()))
 
-    # Send outbound mail; At most 10 messages in one batch
-    path = getattr(settings, u'EMAIL_OUTBOUND_TRANSPORT', None)
-    if path:
-        messages = (Message.objects
-                .outbound()
+def _process_inbound_backlog(batch, budget, limit):
+    u"""
+    Processes batches of inbound messages until there are no more messages to process, the
+    ``budget`` time is exhausted or ``limit`` messages were processed. Messages that failed are
+    not retried in the same run.
+    """
+    deadline = time.time() + budget.total_seconds()
+    done = []
+    failed = set()
+    while len(done) < limit and time.time() < deadline:
+        messages = list(Message.objects
+                .inbound()
                 .not_processed()
+                .exclude(pk__in=failed)
                 .order_by_pk()
                 .prefetch_related(Message.prefetch_recipients())
-                .prefetch_related(Message.prefetch_attachments())
-                )[:10]
-        if messages:
-            klass = import_by_path(path)
-            with klass() as transport:
-                for message in messages:
-                    try:
-                        with transaction.atomic():
-                            transport.send_message(message)
-                            message.processed = utc_now()
-                            message.save(update_fields=[u'processed'])
-                            message_sent.send(sender=None, message=message)
-                            nop() # To let tests raise testing exception here.
-                        cron_logger.info(u'Sent email: %s' % repr(message))
-                    except Exception:
-                        cron_logger.error(u'Seding email failed: %s\n%s' % (repr(message), traceback.format_exc()))
+                [:min(batch, limit - len(done))])
+        if not messages:
+            break
+        _process_inbound_messages(messages)
+        done.extend(messages)
+        failed.update(m.pk for m in messages if m.processed is None)
+    if done:
+        _log_backlog(u'Processed', done, Message.objects.inbound().not_processed().count())
+
+def _claim_outbound_messages(batch, lease, exclude=()):
+    u"""
+    Claims at most ``batch`` queued outbound messages for ``lease`` and returns them. Every message
+    is claimed by a conditional update, so if two jobs overlap, every message is claimed by at most
+    one of them. Messages whose claim expired, e.g. because the job claiming them crashed, may be
+    claimed again.
+    """
+    now = utc_now()
+    pks = (Message.objects
+            .outbound()
+            .not_processed()
+            .not_claimed(now)
+            .exclude(pk__in=exclude)
+            .order_by_pk()
+            .values_list(u'pk', flat=True)
+            )[:batch]
+    claimed = []
+    for pk in pks:
+        if Message.objects.filter(pk=pk).not_processed().not_claimed(now).update(claimed_until=now+lease):
+            claimed.append(pk)
+    if not claimed:
+        return []
+    return list(Message.objects
+            .filter(pk__in=claimed)
+            .order_by_pk()
+            .prefetch_related(Message.prefetch_recipients())
+            .prefetch_related(Message.prefetch_attachments())
+            )
+
+def _send_outbound_group(transport, messages):
+    try:
+        with transaction.atomic():
+            if len(messages) == 1:
+                transport.send_message(messages[0])
+            else:
+                transport.send_messages(messages)
+            for message in messages:
+                message.processed = utc_now()
+                message.claimed_until = None
+                message.save(update_fields=[u'processed', u'claimed_until'])
+                message_sent.send(sender=None, message=message)
+            nop() # To let tests raise testing exception here.
+        for message in messages:
+            cron_logger.info(u'Sent email: %s' % repr(message))
+        return len(messages)
+    except Exception:
+        trace = traceback.format_exc()
+        for message in messages:
+            message.processed = None
+            cron_logger.error(u'Seding email failed: %s\n%s' % (repr(message), trace))
+        # Release the claims so the messages are retried by the next job.
+        Message.objects.filter(pk__in=[m.pk for m in messages]).update(claimed_until=None)
+        return 0
+
+def _send_outbound_worker(klass, queue, results):
+    try:
+        with klass() as transport:
+            while True:
+                try:
+                    group = queue.get_nowait()
+                except Queue.Empty:
+                    break
+                results.append(_send_outbound_group(transport, group))
+    except Exception:
+        cron_logger.error(u'Sending worker failed:\n%s' % traceback.format_exc())
+    finally:
+        # Every thread has its own database connection.
+        connection.close()
+
+def _send_outbound_backlog(klass, batch, workers, lease, budget, limit):
+    u"""
+    Sends batches of outbound messages until there are no more messages to send, the ``budget``
+    time is exhausted or ``limit`` messages were sent. Messages that failed are not retried in the
+    same run.
+    """
+    deadline = time.time() + budget.total_seconds()
+    done = []
+    failed = set()
+    while len(done) < limit and time.time() < deadline:
+        messages = _send_outbound_messages(klass, min(batch, limit - len(done)), workers, lease, failed)
+        if not messages:
+            break
+        done.extend(messages)
+        failed.update(m.pk for m in messages if m.processed is None)
+    if done:
+        _log_backlog(u'Sent', done, Message.objects.outbound().not_processed().count())
+
+def _send_outbound_messages(klass, batch, workers, lease, exclude=()):
+    u"""
+    Claims a batch of queued outbound messages and sends them with a pool of ``workers`` threads.
+    Every worker uses its own transport instance, so it has its own connection. With a single
+    worker the messages are sent in the calling thread. Messages left claimed by a failed worker
+    are claimed again when their lease expires. The transport may group the messages to send
+    several messages together. Returns the claimed messages.
+    """
+    start = time.time()
+    messages = _claim_outbound_messages(batch, lease, exclude)
+    if not messages:
+        return []
+
+    results = []
+    groups = klass().group_messages(messages)
+    workers = max(1, min(workers, len(groups)))
+    if workers == 1:
+        with klass() as transport:
+            for group in groups:
+                results.append(_send_outbound_group(transport, group))
+    else:
+        queue = Queue.Queue()
+        for group in groups:
+            queue.put(group)
+        threads = [threading.Thread(target=_send_outbound_worker, args=(klass, queue, results)) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    sent = sum(results)
+    elapsed = time.time() - start
+    cron_logger.info(u'Sent %d of %d claimed emails with %d workers in %.2f seconds (%.2f emails per second).' %
+            (sent, len(messages), workers, elapsed, sent / elapsed if elapsed else 0.0))
+    return messages
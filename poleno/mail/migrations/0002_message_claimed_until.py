@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mail', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='claimed_until',
+            field=models.DateTimeField(help_text='Date and time until the message is claimed by a running mail cron job that is sending it. Other cron jobs skip claimed messages. Leave blank if not sure.', null=True, blank=True),
+            preserve_default=True,
+        ),
+    ]
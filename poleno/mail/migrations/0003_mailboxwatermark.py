@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mail', '0002_message_claimed_until'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailboxWatermark',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('mailbox', models.CharField(help_text='Remote mailbox identification, e.g. "user@imap.example.com:993".', unique=True, max_length=255)),
+                ('uidvalidity', models.BigIntegerField(help_text='UIDVALIDITY of the remote mailbox the last UID is valid for. If the mailbox UIDVALIDITY changes, all its messages are fetched again.')),
+                ('last_uid', models.BigIntegerField(help_text='The highest UID of all messages fetched from the remote mailbox. Messages with lower UIDs are never fetched again.')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mail', '0003_mailboxwatermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='created',
+            field=models.DateTimeField(help_text='Date and time the message was queued. Used to measure latency of the mail cron job.', auto_now_add=True, null=True),
+            preserve_default=True,
+        ),
+    ]
@@ -2,8 +2,8 @@
 # -*- coding: utf-8 -*-
 from email.utils import formataddr, parseaddr
 
-from django.db import models
-from django.db.models import Prefetch
+from django.db import models, transaction
+from django.db.models import Q, Prefetch
 from django.utils.translation import ugettext_lazy as _
 from django.utils.html import escape
 from django.utils.functional import cached_property
@@ -15,6 +15,8 @@ from poleno.attachments.models import Attachment
 from poleno.utils.models import FieldChoices, QuerySet, join_lookup
 from poleno.utils.misc import squeeze
 
+from .signals import messages_changed
+
 class MessageQuerySet(QuerySet):
     def inbound(self):
         return self.filter(type=Message.TYPES.INBOUND)
@@ -24,6 +26,10 @@ class MessageQuerySet(QuerySet):
         return self.filter(processed__isnull=False)
     def not_processed(self):
         return self.filter(processed__isnull=True)
+    def claimed(self, at):
+        return self.filter(claimed_until__gte=at)
+    def not_claimed(self, at):
+        return self.filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=at))
     def order_by_pk(self):
         return self.order_by(u'pk')
     def order_by_processed(self):
@@ -44,6 +50,20 @@ class Message(models.Model):
                 want the application to process it.
                 """))
 
+    # May be NULL; NULL for messages queued before the field was introduced
+    created = models.DateTimeField(auto_now_add=True, null=True,
+            help_text=squeeze(u"""
+                Date and time the message was queued. Used to measure latency of the mail cron
+                job.
+                """))
+
+    # May be NULL; Used by ``cron.mail`` to claim outbound messages it is sending
+    claimed_until = models.DateTimeField(blank=True, null=True,
+            help_text=squeeze(u"""
+                Date and time until the message is claimed by a running mail cron job that is
+                sending it. Other cron jobs skip claimed messages. Leave blank if not sure.
+                """))
+
     # May be empty
     from_name = models.CharField(blank=True, max_length=255,
             help_text=escape(squeeze(u"""
@@ -191,6 +211,23 @@ class Message(models.Model):
     def bcc_formatted(self):
         return u', '.join(r.formatted for r in self.recipients_bcc)
 
+    def save_with_recipients_and_attachments(self, recipients, attachments):
+        u"""
+        Saves a new message together with its recipients and attachments. Recipients and
+        attachments are inserted with a single query each. Note that ``pk`` of the created
+        recipients and attachments remains undefined.
+        """
+        assert self.pk is None
+        with transaction.atomic():
+            self.save()
+            for recipient in recipients:
+                recipient.message = self
+            Recipient.objects.bulk_create(recipients)
+            for attachment in attachments:
+                attachment.generic_object = self
+            Attachment.objects.bulk_create_with_files(attachments)
+            messages_changed.send(sender=None, message_pks=[self.pk])
+
     def __unicode__(self):
         return u'%s' % self.pk
 
@@ -295,3 +332,27 @@ class Recipient(models.Model):
 
     def __unicode__(self):
         return u'%s' % self.pk
+
+class MailboxWatermark(models.Model):
+    # May NOT be empty; Unique
+    mailbox = models.CharField(max_length=255, unique=True,
+            help_text=squeeze(u"""
+                Remote mailbox identification, e.g. "user@imap.example.com:993".
+                """))
+
+    # May NOT be NULL
+    uidvalidity = models.BigIntegerField(
+            help_text=squeeze(u"""
+                UIDVALIDITY of the remote mailbox the last UID is valid for. If the mailbox
+                UIDVALIDITY changes, all its messages are fetched again.
+                """))
+
+    # May NOT be NULL
+    last_uid = models.BigIntegerField(
+            help_text=squeeze(u"""
+                The highest UID of all messages fetched from the remote mailbox. Messages with
+                lower UIDs are never fetched again.
+                """))
+
+    def __unicode__(self):
+        return u'%s' % self.pk
@@ -4,3 +4,8 @@ from django.dispatch.dispatcher import Signal
 
 message_sent = Signal(providing_args=['message'])
 message_received = Signal(providing_args=['message'])
+messages_received = Signal(providing_args=['messages'])
+
+# Sent whenever messages, their recipients or attachments are changed by bulk queries that do not
+# send ``post_save`` signals.
+messages_changed = Signal(providing_args=['message_pks'])
@@ -174,6 +174,15 @@ class EmailBackendTest(MailTestCaseMixin, TestCase):
             (u'attachment.txt', u'text attachment', u'text/plain'),
             ])
 
+    def test_message_with_attachment_as_attachment_instance(self):
+        msg = self._create_message()
+        attachment = self._create_attachment(generic_object=msg, content=u'(pdf content)', name=u'filename.pdf', content_type=u'application/pdf')
+        mail = self._send_email(attachments=[attachment])
+        attachments = [(a.name, a.content, a.content_type, a.file.name) for a in mail.instance.attachment_set.all()]
+        self.assertEqual(attachments, [
+            (u'filename.pdf', u'(pdf content)', u'application/pdf', attachment.file.name),
+            ])
+
     def test_message_with_attachments_and_multiple_alternatives(self):
         mail = self._send_email(body=u'Text content', alternatives=[
             (u'<p>HTML alternative 1</p>', u'text/html'),
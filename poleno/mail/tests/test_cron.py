@@ -14,7 +14,7 @@ from poleno.utils.test import override_signals, created_instances
 from . import MailTestCaseMixin
 from ..models import Message
 from ..cron import mail as mail_cron_job
-from ..signals import message_sent, message_received
+from ..signals import message_sent, message_received, messages_received
 
 class MailCronjobTest(MailTestCaseMixin, TestCase):
     u"""
@@ -29,21 +29,25 @@ class MailCronjobTest(MailTestCaseMixin, TestCase):
 
     def _run_mail_cron_job(self, outbound=False, inbound=False,
             send_message_method=mock.DEFAULT, message_sent_receiver=None,
-            get_messages_method=mock.DEFAULT, message_received_receiver=None):
+            get_messages_method=mock.DEFAULT, message_received_receiver=None,
+            messages_received_receiver=None):
         u"""
-        Mocks mail transport, overrides ``message_sent`` and ``message_received`` signals, calls
-        ``mail`` cron job and eats any stdout prited by the called job.
+        Mocks mail transport, overrides ``message_sent``, ``message_received`` and
+        ``messages_received`` signals, calls ``mail`` cron job and eats any stdout prited by the
+        called job.
         """
         transport = u'poleno.mail.transports.base.BaseTransport'
         outbound_transport = transport if outbound else None
         inbound_transport = transport if inbound else None
         with self.settings(EMAIL_OUTBOUND_TRANSPORT=outbound_transport, EMAIL_INBOUND_TRANSPORT=inbound_transport):
             with mock.patch.multiple(transport, send_message=send_message_method, get_messages=get_messages_method):
-                with override_signals(message_sent, message_received):
+                with override_signals(message_sent, message_received, messages_received):
                     if message_sent_receiver is not None:
                         message_sent.connect(message_sent_receiver)
                     if message_received_receiver is not None:
                         message_received.connect(message_received_receiver)
+                    if messages_received_receiver is not None:
+                        messages_received.connect(messages_received_receiver)
                     mail_cron_job().do()
 
 
@@ -96,14 +100,24 @@ class MailCronjobTest(MailTestCaseMixin, TestCase):
         self.assertItemsEqual(method.mock_calls, [])
         self.assertItemsEqual(receiver.mock_calls, [])
 
-    def test_outbound_transport_sends_at_most_10_messages_in_one_batch(self):
+    def test_outbound_transport_sends_batches_until_limit_is_reached(self):
         msgs = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(20)]
         method, receiver = mock.Mock(), mock.Mock()
-        self._run_mail_cron_job(outbound=True, send_message_method=method, message_sent_receiver=receiver)
+        with self.settings(EMAIL_OUTBOUND_LIMIT=15):
+            with mock.patch(u'poleno.mail.cron.cron_logger') as logger:
+                self._run_mail_cron_job(outbound=True, send_message_method=method, message_sent_receiver=receiver)
 
-        # We expect first 10 messages (sorted by their ``pk``) to be sent.
-        msgs = Message.objects.filter(pk__in=sorted(m.pk for m in msgs)[:10])
-        self.assertEqual(len(msgs), 10)
+        # We expect first 15 messages (sorted by their ``pk``) to be sent in two batches.
+        remaining = Message.objects.filter(pk__in=sorted(m.pk for m in msgs)[15:])
+        msgs = Message.objects.filter(pk__in=sorted(m.pk for m in msgs)[:15])
+        self.assertEqual(len(msgs), 15)
+        for msg in remaining:
+            self.assertIsNone(msg.processed)
+        summaries = [c[1][0] for c in logger.info.mock_calls if u'claimed emails' in c[1][0]]
+        self.assertEqual(len(summaries), 2)
+        self.assertRegexpMatches(summaries[0], u'Sent 10 of 10 claimed emails with 1 workers in')
+        self.assertRegexpMatches(summaries[1], u'Sent 5 of 5 claimed emails with 1 workers in')
+        self.assertRegexpMatches(logger.info.mock_calls[-1][1][0], u'Sent 15 of 15 emails; 5 emails remaining in backlog; latency avg')
         for msg in msgs:
             self.assertAlmostEqual(msg.processed, utc_now(), delta=datetime.timedelta(seconds=10))
         self.assertItemsEqual(method.mock_calls, [mock.call(m) for m in msgs])
@@ -116,10 +130,88 @@ class MailCronjobTest(MailTestCaseMixin, TestCase):
             with mock.patch(u'poleno.mail.cron.cron_logger') as logger:
                 self._run_mail_cron_job(outbound=True)
         self.assertItemsEqual(Message.objects.filter(pk__in=(m.pk for m in msgs)).processed(), [msgs[0], msgs[2]])
-        self.assertEqual(len(logger.mock_calls), 3)
+        self.assertEqual(len(logger.mock_calls), 5)
         self.assertRegexpMatches(logger.mock_calls[0][1][0], u'Sent email: <Message: %s>' % msgs[0].pk)
         self.assertRegexpMatches(logger.mock_calls[1][1][0], u'Seding email failed: <Message: %s>' % msgs[1].pk)
         self.assertRegexpMatches(logger.mock_calls[2][1][0], u'Sent email: <Message: %s>' % msgs[2].pk)
+        self.assertRegexpMatches(logger.mock_calls[3][1][0], u'Sent 2 of 3 claimed emails with 1 workers in')
+        self.assertRegexpMatches(logger.mock_calls[4][1][0], u'Sent 2 of 3 emails; 1 emails remaining in backlog;')
+
+    def test_outbound_transport_releases_claim_if_exception_raised_while_pocessing_message(self):
+        msg = self._create_message(type=Message.TYPES.OUTBOUND, processed=None)
+
+        with mock.patch(u'poleno.mail.cron.nop', side_effect=Exception):
+            self._run_mail_cron_job(outbound=True)
+        msg = Message.objects.get(pk=msg.pk)
+        self.assertIsNone(msg.processed)
+        self.assertIsNone(msg.claimed_until)
+
+    def test_outbound_transport_skips_messages_claimed_by_another_job(self):
+        msg1 = self._create_message(type=Message.TYPES.OUTBOUND, processed=None)
+        msg2 = self._create_message(type=Message.TYPES.OUTBOUND, processed=None, claimed_until=utc_now() + datetime.timedelta(minutes=5))
+        method = mock.Mock()
+        self._run_mail_cron_job(outbound=True, send_message_method=method)
+        self.assertItemsEqual(method.mock_calls, [mock.call(msg1)])
+        self.assertIsNone(Message.objects.get(pk=msg2.pk).processed)
+
+    def test_outbound_transport_sends_messages_with_expired_claim(self):
+        msg = self._create_message(type=Message.TYPES.OUTBOUND, processed=None, claimed_until=utc_now() - datetime.timedelta(minutes=5))
+        method = mock.Mock()
+        self._run_mail_cron_job(outbound=True, send_message_method=method)
+        self.assertItemsEqual(method.mock_calls, [mock.call(msg)])
+        msg = Message.objects.get(pk=msg.pk)
+        self.assertIsNotNone(msg.processed)
+        self.assertIsNone(msg.claimed_until)
+
+    def test_outbound_transport_with_custom_batch_size(self):
+        msgs = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(5)]
+        method = mock.Mock()
+        with self.settings(EMAIL_OUTBOUND_BATCH=3):
+            with mock.patch(u'poleno.mail.cron.cron_logger') as logger:
+                self._run_mail_cron_job(outbound=True, send_message_method=method)
+        self.assertItemsEqual(method.mock_calls, [mock.call(m) for m in msgs])
+        summaries = [c[1][0] for c in logger.info.mock_calls if u'claimed emails' in c[1][0]]
+        self.assertEqual(len(summaries), 2)
+        self.assertRegexpMatches(summaries[0], u'Sent 3 of 3 claimed emails with 1 workers in')
+        self.assertRegexpMatches(summaries[1], u'Sent 2 of 2 claimed emails with 1 workers in')
+
+    def test_outbound_transport_stops_when_budget_is_exhausted(self):
+        msgs = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(5)]
+        # Sending every message takes 3 seconds.
+        clock = [0]
+        def send(message):
+            clock[0] += 3
+        method = mock.Mock(side_effect=send)
+        with self.settings(EMAIL_OUTBOUND_BATCH=2, EMAIL_OUTBOUND_BUDGET=datetime.timedelta(seconds=10)):
+            with mock.patch(u'poleno.mail.cron.time.time', side_effect=lambda: clock[0]):
+                self._run_mail_cron_job(outbound=True, send_message_method=method)
+        msgs = Message.objects.filter(pk__in=sorted(m.pk for m in msgs)[:4])
+        self.assertItemsEqual(method.mock_calls, [mock.call(m) for m in msgs])
+
+    def test_outbound_transport_does_not_retry_failed_message_in_the_same_run(self):
+        msg = self._create_message(type=Message.TYPES.OUTBOUND, processed=None)
+        method = mock.Mock(side_effect=Exception)
+        with mock.patch(u'poleno.mail.cron.cron_logger'):
+            self._run_mail_cron_job(outbound=True, send_message_method=method)
+        self.assertItemsEqual(method.mock_calls, [mock.call(msg)])
+        self.assertIsNone(Message.objects.get(pk=msg.pk).processed)
+
+    def test_outbound_transport_with_multiple_workers(self):
+        msgs = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(6)]
+        # Worker threads have their own database connections, so we don't let them touch the
+        # database in tests.
+        sent = []
+        def send(transport, messages):
+            sent.extend(messages)
+            return len(messages)
+        with self.settings(EMAIL_OUTBOUND_WORKERS=3):
+            with mock.patch(u'poleno.mail.cron._send_outbound_group', side_effect=send):
+                with mock.patch(u'poleno.mail.cron.connection'):
+                    with mock.patch(u'poleno.mail.cron.cron_logger') as logger:
+                        self._run_mail_cron_job(outbound=True)
+        self.assertItemsEqual(sent, msgs)
+        self.assertEqual(len(logger.mock_calls), 2)
+        self.assertRegexpMatches(logger.mock_calls[0][1][0], u'Sent 6 of 6 claimed emails with 3 workers in')
 
     def test_inbound_transport(self):
         u"""
@@ -145,7 +237,7 @@ class MailCronjobTest(MailTestCaseMixin, TestCase):
         self._run_mail_cron_job(inbound=True, get_messages_method=method, message_received_receiver=receiver)
         self.assertItemsEqual(receiver.mock_calls, [])
 
-    def test_inbound_transport_processes_at_most_10_messages_in_one_batch(self):
+    def test_inbound_transport_processes_batches_until_limit_is_reached(self):
         msgs = []
         def method(transport):
             for i in range(20):
@@ -154,13 +246,17 @@ class MailCronjobTest(MailTestCaseMixin, TestCase):
                 yield msg
 
         receiver = mock.Mock()
-        self._run_mail_cron_job(inbound=True, get_messages_method=method, message_received_receiver=receiver)
+        with self.settings(EMAIL_INBOUND_LIMIT=15):
+            with mock.patch(u'poleno.mail.cron.cron_logger') as logger:
+                self._run_mail_cron_job(inbound=True, get_messages_method=method, messages_received_receiver=receiver)
 
-        # We expect only first 10 messages (sorted by their ``pk``) to be processed.
-        processed = Message.objects.filter(pk__in=sorted(m.pk for m in msgs)[:10])
-        remaining = Message.objects.filter(pk__in=sorted(m.pk for m in msgs)[10:])
-        self.assertEqual(len(processed), 10)
-        self.assertEqual(len(remaining), 10)
+        # We expect only first 15 messages (sorted by their ``pk``) to be processed in two batches.
+        processed = Message.objects.filter(pk__in=sorted(m.pk for m in msgs)[:15])
+        remaining = Message.objects.filter(pk__in=sorted(m.pk for m in msgs)[15:])
+        self.assertEqual(len(processed), 15)
+        self.assertEqual(len(remaining), 5)
+        self.assertEqual([len(c[2][u'messages']) for c in receiver.mock_calls], [10, 5])
+        self.assertRegexpMatches(logger.info.mock_calls[-1][1][0], u'Processed 15 of 15 emails; 5 emails remaining in backlog; latency avg')
         for msg in processed:
             self.assertAlmostEqual(msg.processed, utc_now(), delta=datetime.timedelta(seconds=10))
         for msg in remaining:
@@ -188,10 +284,11 @@ class MailCronjobTest(MailTestCaseMixin, TestCase):
                 with created_instances(Message.objects) as message_set:
                     self._run_mail_cron_job(inbound=True, get_messages_method=method)
         self.assertEqual(message_set.count(), 1)
-        self.assertEqual(len(logger.mock_calls), 3)
+        self.assertEqual(len(logger.mock_calls), 4)
         self.assertRegexpMatches(logger.mock_calls[0][1][0], u'Received email: <Message: %s>' % msgs[0].pk)
         self.assertRegexpMatches(logger.mock_calls[1][1][0], u'Receiving emails failed:')
         self.assertRegexpMatches(logger.mock_calls[2][1][0], u'Processed received email: <Message: %s>' % msgs[0].pk)
+        self.assertRegexpMatches(logger.mock_calls[3][1][0], u'Processed 1 of 1 emails; 0 emails remaining in backlog;')
 
     def test_inbound_transport_lefts_message_unprocessed_if_exception_raised_while_pocessing_it(self):
         msgs = []
@@ -201,16 +298,29 @@ class MailCronjobTest(MailTestCaseMixin, TestCase):
                 msgs.append(msg)
                 yield msg
 
-        with mock.patch(u'poleno.mail.cron.nop', side_effect=[None, None, None, None, Exception, None]):
+        # The batch fails as a whole, then the messages are processed one by one.
+        with mock.patch(u'poleno.mail.cron.nop', side_effect=[None, None, None, Exception, None, Exception, None]):
             with mock.patch(u'poleno.mail.cron.cron_logger') as logger:
                 with created_instances(Message.objects) as message_set:
                     self._run_mail_cron_job(inbound=True, get_messages_method=method)
         self.assertEqual(message_set.count(), 3)
         self.assertItemsEqual(message_set.processed(), [msgs[0], msgs[2]])
-        self.assertEqual(len(logger.mock_calls), 6)
+        self.assertEqual(len(logger.mock_calls), 8)
         self.assertRegexpMatches(logger.mock_calls[0][1][0], u'Received email: <Message: %s>' % msgs[0].pk)
         self.assertRegexpMatches(logger.mock_calls[1][1][0], u'Received email: <Message: %s>' % msgs[1].pk)
         self.assertRegexpMatches(logger.mock_calls[2][1][0], u'Received email: <Message: %s>' % msgs[2].pk)
-        self.assertRegexpMatches(logger.mock_calls[3][1][0], u'Processed received email: <Message: %s>' % msgs[0].pk)
-        self.assertRegexpMatches(logger.mock_calls[4][1][0], u'Processing received email failed: <Message: %s>' % msgs[1].pk)
-        self.assertRegexpMatches(logger.mock_calls[5][1][0], u'Processed received email: <Message: %s>' % msgs[2].pk)
+        self.assertRegexpMatches(logger.mock_calls[3][1][0], u'Processing received email batch failed, processing emails one by one:')
+        self.assertRegexpMatches(logger.mock_calls[4][1][0], u'Processed received email: <Message: %s>' % msgs[0].pk)
+        self.assertRegexpMatches(logger.mock_calls[5][1][0], u'Processing received email failed: <Message: %s>' % msgs[1].pk)
+        self.assertRegexpMatches(logger.mock_calls[6][1][0], u'Processed received email: <Message: %s>' % msgs[2].pk)
+        self.assertRegexpMatches(logger.mock_calls[7][1][0], u'Processed 2 of 3 emails; 1 emails remaining in backlog;')
+
+    def test_inbound_transport_emits_messages_received_signal_for_whole_batch(self):
+        msgs = [self._create_message(type=Message.TYPES.INBOUND, processed=None) for i in range(3)]
+        def method(transport):
+            return []
+
+        receiver = mock.Mock()
+        self._run_mail_cron_job(inbound=True, get_messages_method=method, messages_received_receiver=receiver)
+        self.assertEqual(len(receiver.mock_calls), 1)
+        self.assertEqual(receiver.mock_calls[0][2][u'messages'], msgs)
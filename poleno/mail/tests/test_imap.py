@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 import mock
 import datetime
+import tempfile
 from textwrap import dedent
 
 from django.conf import settings
@@ -11,7 +12,7 @@ from poleno.utils.date import utc_now
 from poleno.utils.test import override_signals
 
 from . import MailTestCaseMixin
-from ..models import Message, Recipient
+from ..models import Message, Recipient, MailboxWatermark
 from ..cron import mail as mail_cron_job
 from ..signals import message_sent, message_received
 
@@ -47,7 +48,7 @@ class ImapTransportTest(MailTestCaseMixin, TestCase):
                     --===============1111111111==--""")
         return u'%s\n\n%s' % (headers, body)
 
-    def _run_mail_cron_job(self, transport=None, ssl_transport=None, mails=[], delete_settings=(), **override_settings):
+    def _run_mail_cron_job(self, transport=None, ssl_transport=None, mails=[], first_uid=1, uidvalidity=1, delete_settings=(), size_before_uid=False, **override_settings):
         overrides = {
                 u'EMAIL_OUTBOUND_TRANSPORT': None,
                 u'EMAIL_INBOUND_TRANSPORT': u'poleno.mail.transports.imap.ImapTransport',
@@ -59,9 +60,29 @@ class ImapTransportTest(MailTestCaseMixin, TestCase):
                 }
         overrides.update(override_settings)
 
+        # Fake IMAP server with mails with UIDs starting with ``first_uid``.
+        def uid(command, *args):
+            uids = range(first_uid, first_uid + len(mails))
+            if command == u'SEARCH':
+                lower = int(args[1].split()[1].split(u':')[0])
+                found = [u for u in uids if u >= lower] or uids[-1:]
+                return [u'OK', [u' '.join(str(u) for u in found)]]
+            if command == u'FETCH':
+                requested = [int(u) for u in args[0].split(u',')]
+                if args[1] == u'(RFC822.SIZE)':
+                    if size_before_uid:
+                        return [u'OK', [u'%d (RFC822.SIZE %d UID %d)' % (u, len(mails[u-first_uid]), u) for u in requested]]
+                    return [u'OK', [u'%d (UID %d RFC822.SIZE %d)' % (u, u, len(mails[u-first_uid])) for u in requested]]
+                data = []
+                for u in requested:
+                    data.append((u'%d (UID %d RFC822 {%d}' % (u, u, len(mails[u-first_uid])), mails[u-first_uid]))
+                    data.append(u')')
+                return [u'OK', data]
+            return [u'OK', [None]]
+
         transport = mock.Mock()
-        transport.return_value.search.return_value = [None, [u' '.join(str(k) for k in range(len(mails)))]]
-        transport.return_value.fetch.side_effect = lambda k, _: [None, [[None, mails[int(k)]]]]
+        transport.return_value.response.return_value = (u'UIDVALIDITY', [str(uidvalidity)])
+        transport.return_value.uid.side_effect = uid
         imap4 = transport if not overrides[u'IMAP_SSL'] else None
         imap4ssl = transport if overrides[u'IMAP_SSL'] else None
 
@@ -104,7 +125,8 @@ class ImapTransportTest(MailTestCaseMixin, TestCase):
             mock.call(u'testhost.com', 2000),
             mock.call().login(u'TestUser', u'big_secret'),
             mock.call().select(),
-            mock.call().search(None, u'ALL'),
+            mock.call().response(u'UIDVALIDITY'),
+            mock.call().uid(u'SEARCH', None, u'UID 1:*'),
             mock.call().close(),
             mock.call().logout(),
             ])
@@ -116,11 +138,12 @@ class ImapTransportTest(MailTestCaseMixin, TestCase):
             mock.call(u'testhost.com', 2000),
             mock.call().login(u'TestUser', u'big_secret'),
             mock.call().select(),
-            mock.call().search(None, u'ALL'),
-            mock.call().fetch(u'0', '(RFC822)'),
-            mock.call().store(u'0', u'+FLAGS', u'\\Deleted'),
-            mock.call().fetch(u'1', '(RFC822)'),
-            mock.call().store(u'1', u'+FLAGS', u'\\Deleted'),
+            mock.call().response(u'UIDVALIDITY'),
+            mock.call().uid(u'SEARCH', None, u'UID 1:*'),
+            mock.call().uid(u'FETCH', u'1,2', u'(RFC822.SIZE)'),
+            mock.call().uid(u'FETCH', u'1,2', u'(UID RFC822)'),
+            mock.call().uid(u'STORE', u'1', u'+FLAGS', u'\\Deleted'),
+            mock.call().uid(u'STORE', u'2', u'+FLAGS', u'\\Deleted'),
             mock.call().expunge(),
             mock.call().close(),
             mock.call().logout(),
@@ -129,16 +152,117 @@ class ImapTransportTest(MailTestCaseMixin, TestCase):
     def test_mail_stored_to_database_and_deleted_from_imap(self):
         mail = self._create_mail()
         transport = self._run_mail_cron_job(mails=[mail])
-        transport.return_value.store.assert_called_once_with(u'0', u'+FLAGS', u'\\Deleted')
+        transport.return_value.uid.assert_any_call(u'STORE', u'1', u'+FLAGS', u'\\Deleted')
         self.assertEqual(Message.objects.count(), 1)
 
     def test_mail_stored_to_database_and_deleted_from_imap_with_multiple_mails_in_inbox(self):
         mails = [self._create_mail() for k in range(10)]
         transport = self._run_mail_cron_job(mails=mails)
-        expected_calls = [mock.call(str(k), u'+FLAGS', u'\\Deleted') for k in range(10)]
-        self.assertEqual(transport.return_value.store.mock_calls, expected_calls)
+        expected_calls = [mock.call(u'STORE', str(k), u'+FLAGS', u'\\Deleted') for k in range(1, 11)]
+        store_calls = [c for c in transport.return_value.uid.mock_calls if c[1][0] == u'STORE']
+        self.assertEqual(store_calls, expected_calls)
         self.assertEqual(Message.objects.count(), 10)
 
+    def test_mails_fetched_in_batches(self):
+        mails = [self._create_mail() for k in range(5)]
+        transport = self._run_mail_cron_job(mails=mails, IMAP_FETCH_BATCH_SIZE=2)
+        fetch_calls = [c for c in transport.return_value.uid.mock_calls if c[1][:1] == (u'FETCH',) and c[1][2] == u'(UID RFC822)']
+        self.assertEqual([c[1][1] for c in fetch_calls], [u'1,2', u'3,4', u'5'])
+        self.assertEqual(transport.return_value.expunge.call_count, 3)
+        self.assertEqual(Message.objects.count(), 5)
+
+    def test_mails_fetched_in_batches_limited_by_size(self):
+        mails = [self._create_mail() for k in range(3)]
+        transport = self._run_mail_cron_job(mails=mails, IMAP_FETCH_BATCH_BYTES=len(mails[0]) * 2)
+        fetch_calls = [c for c in transport.return_value.uid.mock_calls if c[1][:1] == (u'FETCH',) and c[1][2] == u'(UID RFC822)']
+        self.assertEqual([c[1][1] for c in fetch_calls], [u'1,2', u'3'])
+
+    def test_mails_fetched_in_batches_limited_by_size_returned_before_uid(self):
+        mails = [self._create_mail() for k in range(3)]
+        transport = self._run_mail_cron_job(mails=mails, size_before_uid=True, IMAP_FETCH_BATCH_BYTES=len(mails[0]) * 2)
+        fetch_calls = [c for c in transport.return_value.uid.mock_calls if c[1][:1] == (u'FETCH',) and c[1][2] == u'(UID RFC822)']
+        self.assertEqual([c[1][1] for c in fetch_calls], [u'1,2', u'3'])
+
+    def test_watermark_saved_with_last_fetched_uid(self):
+        mails = [self._create_mail() for k in range(3)]
+        transport = self._run_mail_cron_job(mails=mails, first_uid=7, uidvalidity=42)
+        watermark = MailboxWatermark.objects.get()
+        self.assertEqual(watermark.mailbox, u'defaulttestingusername@defaulttestinghost:1234')
+        self.assertEqual(watermark.uidvalidity, 42)
+        self.assertEqual(watermark.last_uid, 9)
+
+    def test_mails_below_watermark_are_not_fetched_again(self):
+        mails = [self._create_mail() for k in range(3)]
+        MailboxWatermark.objects.create(mailbox=u'defaulttestingusername@defaulttestinghost:1234', uidvalidity=1, last_uid=2)
+        transport = self._run_mail_cron_job(mails=mails)
+        transport.return_value.uid.assert_any_call(u'SEARCH', None, u'UID 3:*')
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_highest_uid_returned_for_search_below_watermark_is_ignored(self):
+        mails = [self._create_mail() for k in range(3)]
+        MailboxWatermark.objects.create(mailbox=u'defaulttestingusername@defaulttestinghost:1234', uidvalidity=1, last_uid=3)
+        transport = self._run_mail_cron_job(mails=mails)
+        self.assertEqual(Message.objects.count(), 0)
+
+    def test_watermark_reset_if_uidvalidity_changes(self):
+        mails = [self._create_mail() for k in range(3)]
+        MailboxWatermark.objects.create(mailbox=u'defaulttestingusername@defaulttestinghost:1234', uidvalidity=1, last_uid=3)
+        transport = self._run_mail_cron_job(mails=mails, uidvalidity=2)
+        self.assertEqual(Message.objects.count(), 3)
+        self.assertEqual(MailboxWatermark.objects.get().uidvalidity, 2)
+
+    def test_watermark_moved_over_unparsable_mail_which_is_not_deleted(self):
+        mails = [self._create_mail(headers={u'Subject': u'=?invalid?q?Subject?='}), self._create_mail()]
+        transport = self._run_mail_cron_job(mails=mails)
+        store_calls = [c for c in transport.return_value.uid.mock_calls if c[1][0] == u'STORE']
+        self.assertEqual(store_calls, [mock.call(u'STORE', u'2', u'+FLAGS', u'\\Deleted')])
+        self.assertEqual(MailboxWatermark.objects.get().last_uid, 2)
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_unparsable_mail_is_logged(self):
+        mails = [self._create_mail(headers={u'Subject': u'=?invalid?q?Subject?='})]
+        with mock.patch(u'poleno.mail.transports.imap.logging') as logging:
+            transport = self._run_mail_cron_job(mails=mails)
+        logger = logging.getLogger.return_value
+        self.assertEqual(logging.getLogger.call_args[0][0], u'poleno.mail')
+        self.assertEqual(logger.error.call_count, 1)
+        self.assertEqual(logger.error.call_args[0][1], 1)
+        self.assertIn(u'MessageParseError', logger.error.call_args[0][-1])
+
+    def test_unparsable_mail_is_moved_to_error_mailbox(self):
+        mails = [self._create_mail(headers={u'Subject': u'=?invalid?q?Subject?='}), self._create_mail()]
+        with mock.patch(u'poleno.mail.transports.imap.logging'):
+            transport = self._run_mail_cron_job(mails=mails, IMAP_ERROR_MAILBOX=u'INBOX.Errors')
+        calls = [c for c in transport.return_value.uid.mock_calls if c[1][0] in [u'COPY', u'STORE']]
+        self.assertEqual(calls, [
+                mock.call(u'COPY', u'1', u'INBOX.Errors'),
+                mock.call(u'STORE', u'1', u'+FLAGS', u'\\Deleted'),
+                mock.call(u'STORE', u'2', u'+FLAGS', u'\\Deleted'),
+                ])
+        self.assertEqual(MailboxWatermark.objects.get().last_uid, 2)
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_attachment_temporary_files_are_closed(self):
+        mail = self._create_mail(body=dedent(u"""\
+                --===============1111111111==
+                MIME-Version: 1.0
+                Content-Type: application/pdf
+                Content-Transfer-Encoding: 7bit
+                Content-Disposition: attachment; filename="filename.pdf"
+
+                (content)
+                --===============1111111111==--"""))
+        spooled = []
+        def named_temporary_file(*args, **kwargs):
+            spooled.append(original(*args, **kwargs))
+            return spooled[-1]
+        original = tempfile.NamedTemporaryFile
+        with mock.patch(u'poleno.mail.transports.imap.tempfile.NamedTemporaryFile', named_temporary_file):
+            self._run_mail_cron_job(mails=[mail])
+        self.assertEqual(len(spooled), 1)
+        self.assertTrue(spooled[0].closed)
+        self.assertEqual(Message.objects.get().attachment_set.get().content, u'(content)')
+
     def test_mail_marked_as_inbound(self):
         mail = self._create_mail()
         transport = self._run_mail_cron_job(mails=[mail])
@@ -18,8 +18,9 @@ from poleno.utils.test import override_signals, created_instances, patch_with_ex
 from . import MailTestCaseMixin
 from ..models import Message, Recipient
 from ..cron import mail as mail_cron_job
-from ..signals import message_sent, message_received
-from ..transports.mandrill.signals import webhook_event, message_status_webhook_event, inbound_email_webhook_event
+from ..signals import message_sent, message_received, messages_changed
+from ..transports.mandrill import MandrillTransport
+from ..transports.mandrill.signals import webhook_event, webhook_events, message_status_webhook_event, message_status_webhook_events, inbound_email_webhook_event
 
 class MandrillTransportTest(MailTestCaseMixin, TestCase):
     u"""
@@ -45,7 +46,7 @@ class MandrillTransportTest(MailTestCaseMixin, TestCase):
         defaults.update(kwargs)
         return defaults
 
-    def _run_mail_cron_job(self, status_code=200, response={}, delete_settings=(), **override_settings):
+    def _run_mail_cron_job(self, status_code=200, response={}, delete_settings=(), requests=None, **override_settings):
         overrides = {
                 u'EMAIL_OUTBOUND_TRANSPORT': u'poleno.mail.transports.mandrill.MandrillTransport',
                 u'EMAIL_INBOUND_TRANSPORT': None,
@@ -54,10 +55,12 @@ class MandrillTransportTest(MailTestCaseMixin, TestCase):
                 }
         overrides.update(override_settings)
 
-        requests = mock.Mock()
-        requests.post.return_value.status_code = status_code
-        requests.post.return_value.text = u'Response text'
-        requests.post.return_value.json.return_value = response
+        if requests is None:
+            requests = mock.Mock()
+        session = requests.Session.return_value
+        session.post.return_value.status_code = status_code
+        session.post.return_value.text = u'Response text'
+        session.post.return_value.json.return_value = response
 
         with self.settings(**overrides):
             for name in delete_settings:
@@ -66,7 +69,7 @@ class MandrillTransportTest(MailTestCaseMixin, TestCase):
                 with override_signals(message_sent, message_received):
                     mail_cron_job().do()
 
-        posts = [Bunch(url=call[0][0], data=json.loads(call[1][u'data'])) for call in requests.post.call_args_list]
+        posts = [Bunch(url=call[0][0], data=json.loads(call[1][u'data'])) for call in session.post.call_args_list]
         return posts
 
 
@@ -76,6 +79,56 @@ class MandrillTransportTest(MailTestCaseMixin, TestCase):
         requests = self._run_mail_cron_job()
         self.assertEqual(len(requests), 10)
 
+    def test_one_session_used_for_all_messages(self):
+        msgs = [self._create_message() for i in range(10)]
+        rcpts = [self._create_recipient(message=m) for m in msgs]
+        requests = mock.Mock()
+        self._run_mail_cron_job(requests=requests)
+        self.assertEqual(requests.Session.call_count, 1)
+        self.assertEqual(requests.Session.return_value.post.call_count, 10)
+        self.assertEqual(requests.Session.return_value.close.call_count, 1)
+        self.assertEqual(requests.post.call_count, 0)
+
+    def test_session_retries_failed_requests(self):
+        msg = self._create_message()
+        rcpt = self._create_recipient(message=msg)
+        requests = mock.Mock()
+        self._run_mail_cron_job(requests=requests, MANDRILL_API_RETRIES=5)
+        mounts = requests.Session.return_value.mount.call_args_list
+        self.assertItemsEqual([c[0][0] for c in mounts], [u'https://', u'http://'])
+        retry = mounts[0][0][1].max_retries
+        self.assertEqual(retry.total, 5)
+        self.assertEqual(retry.connect, 5)
+        self.assertEqual(retry.read, 0)
+        self.assertItemsEqual(retry.status_forcelist, [429])
+
+    def test_send_without_connect_creates_session(self):
+        msg = self._create_message()
+        rcpt = self._create_recipient(message=msg)
+        msg = Message.objects.prefetch_related(Message.prefetch_recipients(), Message.prefetch_attachments()).get(pk=msg.pk)
+        requests = mock.Mock()
+        session = requests.Session.return_value
+        session.post.return_value.status_code = 200
+        session.post.return_value.json.return_value = [self._create_response(rcpt)]
+        with self.settings(MANDRILL_API_KEY=u'default_testing_api_key'):
+            with mock.patch(u'poleno.mail.transports.mandrill.transport.requests', requests):
+                transport = MandrillTransport()
+                transport.send_message(msg)
+                transport.disconnect()
+        self.assertEqual(requests.Session.call_count, 1)
+        self.assertEqual(session.post.call_count, 1)
+        self.assertEqual(session.close.call_count, 1)
+
+    def test_post_request_timing_is_logged(self):
+        msg = self._create_message()
+        rcpt = self._create_recipient(message=msg)
+        with mock.patch(u'poleno.mail.transports.mandrill.transport.logging') as logging:
+            self._run_mail_cron_job()
+        logger = logging.getLogger.return_value
+        self.assertEqual(logging.getLogger.call_args[0][0], u'poleno.mail')
+        self.assertEqual(logger.info.call_count, 1)
+        self.assertEqual(logger.info.call_args[0][1:3], (u'https://defaulttestinghost/api/messages/send.json', 200))
+
     def test_failed_post_request_logs_error(self):
         msg = self._create_message()
         rcpt = self._create_recipient(message=msg)
@@ -294,6 +347,77 @@ class MandrillTransportTest(MailTestCaseMixin, TestCase):
             self.assertEqual(rcpt.remote_id, u'remote-%s' % rcpt.pk)
             self.assertEqual(rcpt.status, statuses[i%len(statuses)][1])
 
+    def test_batch_send_disabled_by_default(self):
+        msgs = [self._create_message() for i in range(5)]
+        rcpts = [self._create_recipient(message=m, mail=u'rcpt-%d@a.com' % i) for i, m in enumerate(msgs)]
+        requests = self._run_mail_cron_job()
+        self.assertEqual(len(requests), 5)
+
+    def test_batch_send_sends_compatible_messages_with_one_post_request(self):
+        msgs = [self._create_message(subject=u'Subject %d' % i, text=u'Text %d' % i, html=u'<p>Html %d</p>' % i) for i in range(5)]
+        rcpts = [self._create_recipient(message=m, mail=u'rcpt-%d@a.com' % i) for i, m in enumerate(msgs)]
+        response = [self._create_response(r, status=u'sent') for r in rcpts]
+        requests = self._run_mail_cron_job(response=response, MANDRILL_BATCH_SEND=True)
+        self.assertEqual(len(requests), 1)
+        data = requests[0].data[u'message']
+        self.assertEqual(data[u'subject'], u'*|SUBJECT|*')
+        self.assertEqual(data[u'preserve_recipients'], False)
+        self.assertEqual([r[u'email'] for r in data[u'to']], [r.mail for r in rcpts])
+        self.assertEqual(data[u'merge_vars'][2], {
+                u'rcpt': u'rcpt-2@a.com',
+                u'vars': [
+                    {u'name': u'SUBJECT', u'content': u'Subject 2'},
+                    {u'name': u'HTML', u'content': u'<p>Html 2</p>'},
+                    {u'name': u'TEXT', u'content': u'Text 2'},
+                    ],
+                })
+        for rcpt in rcpts:
+            rcpt = Recipient.objects.get(pk=rcpt.pk)
+            self.assertEqual(rcpt.remote_id, u'remote-%s' % rcpt.pk)
+            self.assertEqual(rcpt.status, Recipient.STATUSES.SENT)
+        self.assertEqual(Message.objects.filter(pk__in=(m.pk for m in msgs)).processed().count(), 5)
+
+    def test_batch_send_sends_incompatible_messages_alone(self):
+        msg1 = self._create_message()
+        rcpt1 = self._create_recipient(message=msg1, mail=u'rcpt-1@a.com')
+        msg2 = self._create_message(from_mail=u'other@example.com')
+        rcpt2 = self._create_recipient(message=msg2, mail=u'rcpt-2@a.com')
+        msg3 = self._create_message()
+        rcpt3 = self._create_recipient(message=msg3, mail=u'rcpt-3@a.com')
+        rcpt3b = self._create_recipient(message=msg3, mail=u'rcpt-3b@a.com')
+        msg4 = self._create_message()
+        rcpt4 = self._create_recipient(message=msg4, mail=u'rcpt-4@a.com')
+        attch4 = self._create_attachment(generic_object=msg4)
+        msg5 = self._create_message(text=u'Hello *|FNAME|*')
+        rcpt5 = self._create_recipient(message=msg5, mail=u'rcpt-5@a.com')
+        msg6 = self._create_message()
+        rcpt6 = self._create_recipient(message=msg6, mail=u'rcpt-6@a.com', type=Recipient.TYPES.CC)
+        requests = self._run_mail_cron_job(MANDRILL_BATCH_SEND=True)
+        self.assertEqual(len(requests), 6)
+        self.assertTrue(all(u'merge_vars' not in r.data[u'message'] for r in requests))
+
+    def test_batch_send_does_not_send_same_recipient_twice_in_one_batch(self):
+        msgs = [self._create_message() for i in range(3)]
+        rcpts = [self._create_recipient(message=m, mail=u'rcpt@a.com') for m in msgs]
+        requests = self._run_mail_cron_job(MANDRILL_BATCH_SEND=True)
+        self.assertEqual(len(requests), 3)
+
+    def test_batch_send_with_batch_size_setting(self):
+        msgs = [self._create_message() for i in range(10)]
+        rcpts = [self._create_recipient(message=m, mail=u'rcpt-%d@a.com' % i) for i, m in enumerate(msgs)]
+        requests = self._run_mail_cron_job(MANDRILL_BATCH_SEND=True, MANDRILL_BATCH_SIZE=4)
+        self.assertEqual([len(r.data[u'message'][u'to']) for r in requests], [4, 4, 2])
+
+    def test_batch_send_failed_post_request_logs_error_for_every_message(self):
+        msgs = [self._create_message() for i in range(2)]
+        rcpts = [self._create_recipient(message=m, mail=u'rcpt-%d@a.com' % i) for i, m in enumerate(msgs)]
+        logger = mock.Mock()
+        with mock.patch(u'poleno.mail.cron.cron_logger', logger):
+            self._run_mail_cron_job(status_code=500, MANDRILL_BATCH_SEND=True)
+        self.assertEqual(logger.error.call_count, 2)
+        self.assertIn(u'Seding email failed: <Message: %s>' % msgs[1].pk, logger.error.call_args[0][0])
+        self.assertEqual(Message.objects.filter(pk__in=(m.pk for m in msgs)).processed().count(), 0)
+
 class WebhookViewTest(MailTestCaseMixin, ViewTestCaseMixin, TestCase):
     u"""
     Tests ``webhook()`` view.
@@ -314,7 +438,7 @@ class WebhookViewTest(MailTestCaseMixin, ViewTestCaseMixin, TestCase):
         with self.settings(**overrides):
             for name in delete_settings:
                 delattr(settings, name)
-            with override_signals(webhook_event):
+            with override_signals(webhook_event, webhook_events):
                 yield
 
     def _webhook_url(self, secret_name=u'default_testing_secret_name', secret=u'default_testing_secret'):
@@ -434,6 +558,26 @@ class WebhookViewTest(MailTestCaseMixin, ViewTestCaseMixin, TestCase):
             mock.call(signal=webhook_event, data={u'_id': u'remote-3', u'event': u'click'}, event_type=u'click', sender=None),
             ])
 
+    def test_post_request_with_valid_data_emits_batched_webhook_events(self):
+        with self._overrides(MANDRILL_WEBHOOK_URL=u'https://testhost/', MANDRILL_WEBHOOK_KEYS=[u'testkey']):
+            receiver = mock.Mock()
+            webhook_events.connect(receiver)
+            response = self.client.post(self._webhook_url(), secure=True,
+                    data={u'mandrill_events': json.dumps([
+                        {u'event': u'deferral', u'_id': u'remote-1'},
+                        {u'event': u'soft_bounce', u'_id': u'remote-2'},
+                        {u'event': u'click', u'_id': u'remote-3'},
+                        ])},
+                    HTTP_X_MANDRILL_SIGNATURE=u'e/e0y1qBZghx4pyHFFoRrtgqmWg=')
+        self._check_response(response)
+        self.assertItemsEqual(receiver.mock_calls, [
+            mock.call(signal=webhook_events, sender=None, events=[
+                {u'_id': u'remote-1', u'event': u'deferral'},
+                {u'_id': u'remote-2', u'event': u'soft_bounce'},
+                {u'_id': u'remote-3', u'event': u'click'},
+                ]),
+            ])
+
     def test_post_request_with_valid_data_rolls_back_if_exception_raised(self):
         def receiver(*args, **kwargs):
             self._create_message()
@@ -475,7 +619,8 @@ class MessageStatusWebhookEventTest(MailTestCaseMixin, TestCase):
 
 
     def test_event_receiver_is_registered(self):
-        self.assertIn(message_status_webhook_event, webhook_event._live_receivers(sender=None))
+        self.assertIn(message_status_webhook_events, webhook_events._live_receivers(sender=None))
+        self.assertNotIn(message_status_webhook_event, webhook_event._live_receivers(sender=None))
 
     def _test_event_type_changing_recipient_status(self, event_type, status):
         msg = self._create_message()
@@ -545,6 +690,40 @@ class MessageStatusWebhookEventTest(MailTestCaseMixin, TestCase):
         self.assertEqual(rcpt.status, Recipient.STATUSES.UNDEFINED)
         self.assertEqual(rcpt.status_details, u'details')
 
+    def test_batch_of_events_updates_recipients_with_constant_number_of_queries(self):
+        msg = self._create_message()
+        rcpts = [self._create_recipient(message=msg, remote_id=u'remote-%d' % i) for i in range(20)]
+        events = [{u'event': [u'send', u'open'][i%2], u'_id': u'remote-%d' % i} for i in range(20)]
+        receiver = mock.Mock()
+        with override_signals(messages_changed):
+            messages_changed.connect(receiver)
+            with self.assertNumQueries(3): # Select, update sent, update opened
+                message_status_webhook_events(sender=None, events=events)
+        self.assertEqual(receiver.call_args[1][u'message_pks'], {msg.pk})
+        for i, rcpt in enumerate(rcpts):
+            rcpt = Recipient.objects.get(pk=rcpt.pk)
+            self.assertEqual(rcpt.status, [Recipient.STATUSES.SENT, Recipient.STATUSES.OPENED][i%2])
+
+    def test_batch_with_multiple_events_for_recipient_uses_the_most_recent_one(self):
+        msg = self._create_message()
+        rcpt1 = self._create_recipient(message=msg, remote_id=u'remote-1')
+        rcpt2 = self._create_recipient(message=msg, remote_id=u'remote-2')
+        message_status_webhook_events(sender=None, events=[
+                {u'event': u'open', u'_id': u'remote-1', u'ts': 1400000003},
+                {u'event': u'send', u'_id': u'remote-1', u'ts': 1400000001},
+                {u'event': u'send', u'_id': u'remote-2'},
+                {u'event': u'hard_bounce', u'_id': u'remote-2'},
+                ])
+        rcpt1 = Recipient.objects.get(pk=rcpt1.pk)
+        rcpt2 = Recipient.objects.get(pk=rcpt2.pk)
+        self.assertEqual(rcpt1.status, Recipient.STATUSES.OPENED)
+        self.assertEqual(rcpt2.status, Recipient.STATUSES.REJECTED)
+        self.assertEqual(rcpt2.status_details, u'hard_bounce')
+
+    def test_batch_without_status_events_does_no_queries(self):
+        with self.assertNumQueries(0):
+            message_status_webhook_events(sender=None, events=[{u'event': u'inbound', u'msg': {}}])
+
 class InboundEmailWebhookEvent(MailTestCaseMixin, TestCase):
     u"""
     Tests ``inbound_email_webhook_event()`` event receiver.
@@ -1,15 +1,19 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 import random
+import mock
 
+from django.core.files.base import ContentFile
 from django.db import IntegrityError
 from django.test import TestCase
 
 from poleno.attachments.models import Attachment
 from poleno.utils.date import utc_now, utc_datetime_from_local
+from poleno.utils.test import override_signals
 
 from . import MailTestCaseMixin
 from ..models import Message, Recipient
+from ..signals import messages_changed
 
 class MessageModelTest(MailTestCaseMixin, TestCase):
     u"""
@@ -47,6 +51,14 @@ class MessageModelTest(MailTestCaseMixin, TestCase):
         msg = self._create_message(omit=[u'processed'])
         self.assertIsNone(msg.processed)
 
+    def test_claimed_until_field_with_explicit_value(self):
+        msg = self._create_message(claimed_until=utc_datetime_from_local(u'2014-10-04 13:22:12'))
+        self.assertEqual(msg.claimed_until, utc_datetime_from_local(u'2014-10-04 13:22:12'))
+
+    def test_claimed_until_field_with_default_value_if_ommited(self):
+        msg = self._create_message()
+        self.assertIsNone(msg.claimed_until)
+
     def test_from_name_and_from_mail_fields_with_explicit_values(self):
         msg = self._create_message(from_name=u'From Name', from_mail=u'from@example.com')
         self.assertEqual(msg.from_name, u'From Name')
@@ -283,6 +295,21 @@ class MessageModelTest(MailTestCaseMixin, TestCase):
         self.assertEqual(msg.cc_formatted, u'CC First <ccfirst@a.com>, CC Second <ccsecond@a.com>')
         self.assertEqual(msg.bcc_formatted, u'BCC First <bccfirst@a.com>')
 
+    def test_save_with_recipients_and_attachments_method(self):
+        msg = Message(type=Message.TYPES.OUTBOUND, from_mail=u'smith@example.com')
+        rcpts = [Recipient(mail=u'rcpt%d@a.com' % i, type=Recipient.TYPES.TO, status=Recipient.STATUSES.QUEUED) for i in range(5)]
+        attchs = [Attachment(file=ContentFile(u'content'), name=u'file%d.txt' % i, content_type=u'text/plain') for i in range(5)]
+        receiver = mock.Mock()
+        with override_signals(messages_changed):
+            messages_changed.connect(receiver)
+            with self.assertNumQueries(5): # Savepoint, message, recipients, attachments, savepoint release
+                msg.save_with_recipients_and_attachments(rcpts, attchs)
+        self.assertIsNotNone(msg.pk)
+        self.assertEqual(receiver.call_args[1][u'message_pks'], [msg.pk])
+        self.assertEqual([r.mail for r in msg.recipient_set.order_by_pk()], [r.mail for r in rcpts])
+        self.assertEqual([a.name for a in msg.attachment_set.order_by_pk()], [a.name for a in attchs])
+        self.assertEqual([a.size for a in msg.attachment_set.order_by_pk()], [7]*5)
+
     def test_repr(self):
         msg = self._create_message()
         self.assertEqual(repr(msg), u'<Message: %s>' % msg.pk)
@@ -305,6 +332,15 @@ class MessageModelTest(MailTestCaseMixin, TestCase):
         result = Message.objects.not_processed()
         self.assertItemsEqual(result, [obj1, obj2])
 
+    def test_claimed_and_not_claimed_query_methods(self):
+        obj1 = self._create_message()
+        obj2 = self._create_message(claimed_until=utc_datetime_from_local(u'2014-10-04 13:20:00'))
+        obj3 = self._create_message(claimed_until=utc_datetime_from_local(u'2014-10-04 13:30:00'))
+        result = Message.objects.claimed(utc_datetime_from_local(u'2014-10-04 13:22:12'))
+        self.assertItemsEqual(result, [obj3])
+        result = Message.objects.not_claimed(utc_datetime_from_local(u'2014-10-04 13:22:12'))
+        self.assertItemsEqual(result, [obj1, obj2])
+
     def test_order_by_pk_query_method(self):
         msgs = [self._create_message() for i in range(20)]
         sample = random.sample(msgs, 10)
@@ -1,6 +1,7 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 import mock
+import email
 from textwrap import dedent
 from collections import defaultdict
 
@@ -203,21 +204,49 @@ class SmtpTransportTest(MailTestCaseMixin, TestCase):
                 <p>HTML content</p>
                 --===============.*==--
                 --===============.*==
-                MIME-Version: 1.0
                 Content-Type: text/plain; charset="utf-8"
-                Content-Transfer-Encoding: 7bit
+                MIME-Version: 1.0
+                Content-Transfer-Encoding: base64
                 Content-Disposition: attachment; filename="filename.txt"
 
-                content
+                Y29udGVudA==
+
                 --===============.*==
-                MIME-Version: 1.0
                 Content-Type: text/html; charset="utf-8"
-                Content-Transfer-Encoding: 7bit
+                MIME-Version: 1.0
+                Content-Transfer-Encoding: base64
                 Content-Disposition: attachment; filename="filename.html"
 
-                <p>content</p>
+                PHA\+Y29udGVudDwvcD4=
+
                 --===============.*==--"""))
 
+    def test_message_with_binary_attachment(self):
+        msg = self._create_message(text=u'Text content')
+        rcpt = self._create_recipient(message=msg)
+        attch = self._create_attachment(generic_object=msg, content=u'\x00\x01binary', name=u'filename.bin', content_type=u'application/octet-stream')
+        result = self._run_mail_cron_job()
+        self.assertRegexpMatches(result[0].body, dedent(u"""\
+                --===============.*==
+                Content-Type: application/octet-stream
+                MIME-Version: 1.0
+                Content-Transfer-Encoding: base64
+                Content-Disposition: attachment; filename="filename.bin"
+
+                AAFiaW5hcnk=
+                """))
+
+    def test_message_with_non_ascii_text_attachment(self):
+        msg = self._create_message(text=u'Text content')
+        rcpt = self._create_recipient(message=msg)
+        attch = self._create_attachment(generic_object=msg, content=u'Ľubovoľný obsah\n'.encode(u'utf-8'), name=u'filename.txt', content_type=u'text/plain')
+        result = self._run_mail_cron_job()
+        parts = [p for p in email.message_from_string(result[0].as_bytes).walk() if p.get_filename()]
+        self.assertEqual(len(parts), 1)
+        self.assertEqual(parts[0].get_content_type(), u'text/plain')
+        self.assertEqual(parts[0].get_content_charset(), u'utf-8')
+        self.assertEqual(parts[0].get_payload(decode=True).decode(u'utf-8'), u'Ľubovoľný obsah\n')
+
     def test_message_with_to_and_cc_recipients(self):
         msg = self._create_message()
         to1 = self._create_recipient(message=msg, name=u'To Recipient1', mail=u'to1@a.com', type=Recipient.TYPES.TO)
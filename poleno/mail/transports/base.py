@@ -18,8 +18,18 @@ class BaseTransport(object):
     def disconnect(self):
         pass
 
+    def group_messages(self, messages):
+        u"""
+        Splits ``messages`` into groups that may be sent together by ``send_messages()``. By
+        default every message is sent alone by ``send_message()``.
+        """
+        return [[m] for m in messages]
+
     def send_message(self, message):
         raise NotImplementedError
 
+    def send_messages(self, messages):
+        raise NotImplementedError
+
     def get_messages(self):
         raise NotImplementedError
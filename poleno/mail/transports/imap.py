@@ -1,19 +1,23 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import re
 import email
 import email.header
 import email.message
+import logging
+import tempfile
+import traceback
 from email.utils import parseaddr
 from imaplib import IMAP4, IMAP4_SSL, IMAP4_PORT, IMAP4_SSL_PORT
 
-from django.core.files.base import ContentFile
+from django.core.files import File
 from django.conf import settings
 
 from poleno.attachments.models import Attachment
 from poleno.utils.misc import guess_extension
 
 from .base import BaseTransport
-from ..models import Message, Recipient
+from ..models import Message, Recipient, MailboxWatermark
 
 class ImapTransport(BaseTransport):
     def __init__(self, **kwargs):
@@ -23,6 +27,9 @@ class ImapTransport(BaseTransport):
         self.port = getattr(settings, u'IMAP_PORT', IMAP4_SSL_PORT if self.ssl else IMAP4_PORT)
         self.username = getattr(settings, u'IMAP_USERNAME', u'')
         self.password = getattr(settings, u'IMAP_PASSWORD', u'')
+        self.batch_size = getattr(settings, u'IMAP_FETCH_BATCH_SIZE', 10)
+        self.batch_bytes = getattr(settings, u'IMAP_FETCH_BATCH_BYTES', 10*1024*1024)
+        self.error_mailbox = getattr(settings, u'IMAP_ERROR_MAILBOX', None)
         self.transport = IMAP4_SSL if self.ssl else IMAP4
         self.connection = None
 
@@ -54,6 +61,14 @@ class ImapTransport(BaseTransport):
     def _decode_message(self, msg):
         assert isinstance(msg, email.message.Message)
 
+        spooled_files = []
+        try:
+            return self._decode_message_spooled(msg, spooled_files)
+        finally:
+            for spooled in spooled_files:
+                spooled.close()
+
+    def _decode_message_spooled(self, msg, spooled_files):
         headers = {name: self._decode_header(value) for name, value in msg.items()}
         subject = self._decode_header(msg.get(u'subject', u''))
         from_header = self._decode_header(msg.get(u'from', u''))
@@ -77,8 +92,13 @@ class ImapTransport(BaseTransport):
             else:
                 default = u'attachment%s' % guess_extension(content_type, u'.bin')
                 filename = part.get_filename(default)
+                # Spool the content to a temporary file, the storage copies it in chunks.
+                spooled = tempfile.NamedTemporaryFile()
+                spooled_files.append(spooled)
+                spooled.write(content or u'')
+                spooled.seek(0)
                 attachments.append(Attachment(
-                        file=ContentFile(content),
+                        file=File(spooled),
                         name=filename,
                         content_type=content_type,
                         ))
@@ -108,31 +128,98 @@ class ImapTransport(BaseTransport):
                 html=html,
                 headers=headers,
                 )
-        message.save()
-
-        for recipient in recipients:
-            recipient.message = message
-            recipient.save()
-
-        for attachment in attachments:
-            attachment.generic_object = message
-            attachment.save()
-
+        message.save_with_recipients_and_attachments(recipients, attachments)
         return message
 
+    def _fetch_sizes(self, uids):
+        sizes = {}
+        for start in range(0, len(uids), self.batch_size):
+            uidset = u','.join(str(u) for u in uids[start:start+self.batch_size])
+            _, data = self.connection.uid(u'FETCH', uidset, u'(RFC822.SIZE)')
+            for item in data:
+                # The server may return the data items in any order.
+                uid_match = re.search(r'UID (\d+)', item or u'')
+                size_match = re.search(r'RFC822\.SIZE (\d+)', item or u'')
+                if uid_match and size_match:
+                    sizes[int(uid_match.group(1))] = int(size_match.group(1))
+        return sizes
+
+    def _fetch_batches(self, uids):
+        u"""
+        Splits ``uids`` into batches of at most ``IMAP_FETCH_BATCH_SIZE`` messages with total size
+        at most ``IMAP_FETCH_BATCH_BYTES``. Messages bigger than the limit are fetched alone.
+        """
+        sizes = self._fetch_sizes(uids)
+        batch, batch_bytes = [], 0
+        for uid in uids:
+            size = sizes.get(uid, 0)
+            if batch and (len(batch) >= self.batch_size or batch_bytes + size > self.batch_bytes):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(uid)
+            batch_bytes += size
+        if batch:
+            yield batch
+
+    def _handle_unparsable(self, uid, trace):
+        u"""
+        Unparsable messages are skipped by the watermark, so they would never be fetched again. If
+        ``IMAP_ERROR_MAILBOX`` is set, they are moved there. Otherwise they are left in the mailbox
+        for the administrator to inspect.
+        """
+        logger = logging.getLogger(u'poleno.mail')
+        if self.error_mailbox:
+            status, _ = self.connection.uid(u'COPY', str(uid), self.error_mailbox)
+            if status == u'OK':
+                self.connection.uid(u'STORE', str(uid), u'+FLAGS', u'\\Deleted')
+                logger.error(u'Parsing received email UID %s failed, moved it to %s:\n%s', uid, self.error_mailbox, trace)
+                return
+        logger.error(u'Parsing received email UID %s failed, left it in the mailbox:\n%s', uid, trace)
+
     def get_messages(self):
-        # Based on django_mailbox.transports.imap.ImapTransport
-        _, inbox = self.connection.search(None, u'ALL')
-        if inbox[0]:
-            for key in inbox[0].split():
+        # Fetches only messages with UIDs above the watermark of the last fetched message. So the
+        # messages are never received twice, even if we fail to delete them from the mailbox.
+        _, data = self.connection.response(u'UIDVALIDITY')
+        uidvalidity = int(data[0]) if data and data[0] else 0
+        mailbox = u'%s@%s:%s' % (self.username, self.host, self.port)
+        watermark, _ = MailboxWatermark.objects.get_or_create(mailbox=mailbox,
+                defaults=dict(uidvalidity=uidvalidity, last_uid=0))
+        if watermark.uidvalidity != uidvalidity:
+            watermark.uidvalidity = uidvalidity
+            watermark.last_uid = 0
+            watermark.save()
+
+        # Search for "N:*" returns the highest UID even if it is lower than N.
+        _, data = self.connection.uid(u'SEARCH', None, u'UID %d:*' % (watermark.last_uid + 1))
+        uids = sorted(int(u) for u in (data[0] or u'').split() if int(u) > watermark.last_uid)
+
+        for batch in self._fetch_batches(uids):
+            uidset = u','.join(str(u) for u in batch)
+            _, data = self.connection.uid(u'FETCH', uidset, u'(UID RFC822)')
+            contents = {}
+            for item in data:
+                if isinstance(item, tuple):
+                    match = re.search(r'UID (\d+)', item[0])
+                    if match:
+                        contents[int(match.group(1))] = item[1]
+            del data
+
+            for uid in batch:
+                if uid not in contents:
+                    continue
                 try:
-                    _, contents = self.connection.fetch(key, '(RFC822)')
-                    msg = email.message_from_string(contents[0][1])
+                    msg = email.message_from_string(contents.pop(uid))
                     message = self._decode_message(msg)
                 except email.errors.MessageParseError:
-                    continue
+                    message = None
+                    self._handle_unparsable(uid, traceback.format_exc())
+
+                # The watermark is saved in the same transaction as the decoded message.
+                watermark.last_uid = uid
+                watermark.save(update_fields=[u'last_uid'])
 
-                yield message
+                if message is not None:
+                    yield message
+                    self.connection.uid(u'STORE', str(uid), u'+FLAGS', u'\\Deleted')
 
-                self.connection.store(key, u'+FLAGS', u'\\Deleted')
             self.connection.expunge()
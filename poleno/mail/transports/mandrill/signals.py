@@ -1,6 +1,7 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 from base64 import b64decode
+from collections import defaultdict
 
 from django.core.files.base import ContentFile
 from django.dispatch import Signal, receiver
@@ -8,29 +9,84 @@ from django.dispatch import Signal, receiver
 from poleno.attachments.models import Attachment
 
 from ...models import Message, Recipient
+from ...signals import messages_changed
 
 webhook_event = Signal(providing_args=['event_type', 'data'])
+webhook_events = Signal(providing_args=['events'])
 
-@receiver(webhook_event)
-def message_status_webhook_event(sender, event_type, data, **kwargs):
-    if event_type == u'deferral':
-        status = Recipient.STATUSES.QUEUED
-    elif event_type in [u'soft_bounce', u'hard_bounce', u'spam', u'reject']:
-        status = Recipient.STATUSES.REJECTED
-    elif event_type == u'send':
-        status = Recipient.STATUSES.SENT
-    elif event_type in [u'open', u'click']:
-        status = Recipient.STATUSES.OPENED
-    else:
+# Recipient status set by every message status event type. If a batch contains several events for
+# the same recipient with the same timestamp, the event later in the list wins.
+MESSAGE_STATUS_EVENT_TYPES = {
+        u'deferral': Recipient.STATUSES.QUEUED,
+        u'soft_bounce': Recipient.STATUSES.REJECTED,
+        u'hard_bounce': Recipient.STATUSES.REJECTED,
+        u'spam': Recipient.STATUSES.REJECTED,
+        u'reject': Recipient.STATUSES.REJECTED,
+        u'send': Recipient.STATUSES.SENT,
+        u'open': Recipient.STATUSES.OPENED,
+        u'click': Recipient.STATUSES.OPENED,
+        }
+
+# Max number of remote ids looked up, or recipients updated, with a single query.
+REMOTE_ID_CHUNK = 500
+
+@receiver(webhook_events)
+def message_status_webhook_events(sender, events, **kwargs):
+    u"""
+    Updates recipient statuses for all message status events in a webhook payload at once. The
+    recipients are fetched with a single query and updated with a single query per resulting
+    status, in chunks of ``REMOTE_ID_CHUNK``. If there are multiple events for the same recipient, the
+    most recent one wins. Events with remote ids matching no or multiple recipients are ignored.
+    """
+    latest = {}
+    for idx, event in enumerate(events):
+        event_type = event.get(u'event')
+        remote_id = event.get(u'_id')
+        if event_type not in MESSAGE_STATUS_EVENT_TYPES or not remote_id:
+            continue
+        key = (event.get(u'ts') or 0, idx)
+        if remote_id not in latest or latest[remote_id][0] < key:
+            latest[remote_id] = (key, event_type)
+    if not latest:
         return
 
-    try:
-        recipient = Recipient.objects.get(remote_id=data['_id'])
-        recipient.status = status
-        recipient.status_details = event_type
-        recipient.save(update_fields=[u'status', u'status_details'])
-    except (Recipient.DoesNotExist, Recipient.MultipleObjectsReturned):
-        pass
+    remote_ids = list(latest)
+    matched = defaultdict(list)
+    message_pks = {}
+    for start in range(0, len(remote_ids), REMOTE_ID_CHUNK):
+        recipients = (Recipient.objects
+                .filter(remote_id__in=remote_ids[start:start+REMOTE_ID_CHUNK])
+                .values_list(u'pk', u'remote_id', u'message')
+                )
+        for pk, remote_id, message_pk in recipients:
+            matched[remote_id].append(pk)
+            message_pks[pk] = message_pk
+
+    updates = defaultdict(list)
+    for remote_id, pks in matched.items():
+        if len(pks) != 1:
+            continue
+        _, event_type = latest[remote_id]
+        updates[event_type].extend(pks)
+
+    for event_type, pks in updates.items():
+        for start in range(0, len(pks), REMOTE_ID_CHUNK):
+            Recipient.objects.filter(pk__in=pks[start:start+REMOTE_ID_CHUNK]).update(
+                    status=MESSAGE_STATUS_EVENT_TYPES[event_type],
+                    status_details=event_type,
+                    )
+
+    changed = set(message_pks[pk] for pks in updates.values() for pk in pks)
+    if changed:
+        messages_changed.send(sender=None, message_pks=changed)
+
+def message_status_webhook_event(sender, event_type, data, **kwargs):
+    u"""
+    Processes a single message status event. Webhook payloads are processed in batches by
+    ``message_status_webhook_events``.
+    """
+    event = dict(data, event=event_type)
+    message_status_webhook_events(sender=sender, events=[event])
 
 @receiver(webhook_event)
 def inbound_email_webhook_event(sender, event_type, data, **kwargs):
@@ -81,12 +137,4 @@ def inbound_email_webhook_event(sender, event_type, data, **kwargs):
                 html=html,
                 headers=headers,
                 )
-        message.save()
-
-        for recipient in recipients:
-            recipient.message = message
-            recipient.save()
-
-        for attachment in attachments:
-            attachment.generic_object = message
-            attachment.save()
+        message.save_with_recipients_and_attachments(recipients, attachments)
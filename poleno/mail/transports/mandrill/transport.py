@@ -1,10 +1,14 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 import json
-import base64
+import time
+import logging
 import requests
 from collections import defaultdict
 
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
 from django.core.exceptions import ImproperlyConfigured
 from django.conf import settings
 
@@ -16,10 +20,42 @@ class MandrillTransport(BaseTransport):
         self.api_key = getattr(settings, u'MANDRILL_API_KEY', None)
         self.api_url = getattr(settings, u'MANDRILL_API_URL', u'https://mandrillapp.com/api/1.0')
         self.api_send = self.api_url.rstrip(u'/') + u'/messages/send.json'
+        self.api_retries = getattr(settings, u'MANDRILL_API_RETRIES', 3)
+        self.api_timeout = getattr(settings, u'MANDRILL_API_TIMEOUT', 30)
+        self.batch_send = getattr(settings, u'MANDRILL_BATCH_SEND', False)
+        self.batch_size = getattr(settings, u'MANDRILL_BATCH_SIZE', 50)
+        self.session = None
 
         if self.api_key is None:
             raise ImproperlyConfigured(u'Setting MANDRILL_API_KEY is not set.')
 
+    def connect(self):
+        # Keep-alive session reused for all API calls made while the transport is connected. Sending
+        # is not idempotent, so only calls that Mandrill surely did not process are retried with
+        # exponential backoff: calls that failed to connect and calls rejected with 429 status
+        # code. Read errors and 5xx status codes may come after the message was already accepted,
+        # so they are not retried to avoid sending the message twice.
+        retry = Retry(total=self.api_retries, connect=self.api_retries, read=0, backoff_factor=0.5,
+                status_forcelist=[429], method_whitelist=[u'POST'])
+        self.session = requests.Session()
+        self.session.mount(u'https://', HTTPAdapter(max_retries=retry))
+        self.session.mount(u'http://', HTTPAdapter(max_retries=retry))
+
+    def disconnect(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def _post(self, url, data):
+        # The transport may be used without connecting it first.
+        if self.session is None:
+            self.connect()
+        start = time.time()
+        response = self.session.post(url, data=json.dumps(data), timeout=self.api_timeout)
+        logging.getLogger(u'poleno.mail').info(u'Mandrill API call %s returned %s in %.3f seconds.',
+                url, response.status_code, time.time() - start)
+        return response
+
     def send_message(self, message):
         assert message.type == message.TYPES.OUTBOUND
         assert message.processed is None
@@ -60,20 +96,111 @@ class MandrillTransport(BaseTransport):
             attch = {}
             attch[u'type'] = attachment.content_type
             attch[u'name'] = attachment.name
-            attch[u'content'] = base64.b64encode(attachment.content)
+            attch[u'content'] = b''.join(attachment.base64_chunks())
             msg[u'attachments'].append(attch)
 
         data = {}
         data[u'key'] = self.api_key
         data[u'message'] = msg
 
-        response = requests.post(self.api_send, data=json.dumps(data))
+        response = self._post(self.api_send, data)
 
         if response.status_code != 200:
             raise RuntimeError(u'Sending Message(pk=%s) failed with status code %s. Mandrill response: %s' %
                     (message.pk, response.status_code, response.text))
 
-        for rcp in response.json():
+        self._update_recipients(response.json(), recipients)
+
+    def group_messages(self, messages):
+        if not self.batch_send:
+            return super(MandrillTransport, self).group_messages(messages)
+
+        groups = []
+        buckets = {}
+        for message in messages:
+            key = self._batch_key(message)
+            if key is None:
+                groups.append([message])
+                continue
+            group = buckets.get(key)
+            if group is None or len(group) >= self.batch_size or message.recipients[0].mail in (m.recipients[0].mail for m in group):
+                group = buckets[key] = []
+                groups.append(group)
+            group.append(message)
+        return groups
+
+    def send_messages(self, messages):
+        u"""
+        Sends compatible messages grouped by ``group_messages()`` with a single API call. Every
+        message has exactly one recipient and the recipients are distinct, so the message subject
+        and bodies are passed to Mandrill as recipient merge variables.
+        """
+        assert all(m.type == m.TYPES.OUTBOUND for m in messages)
+        assert all(m.processed is None for m in messages)
+        first = messages[0]
+
+        msg = {}
+        msg[u'subject'] = u'*|SUBJECT|*'
+        msg[u'from_email'] = first.from_mail
+        if first.from_name:
+            msg[u'from_name'] = first.from_name
+        if first.html:
+            msg[u'html'] = u'*|HTML|*'
+        if first.text:
+            msg[u'text'] = u'*|TEXT|*'
+        if first.headers:
+            msg[u'headers'] = first.headers
+        msg[u'merge'] = True
+        msg[u'merge_language'] = u'mailchimp'
+        msg[u'preserve_recipients'] = False
+
+        msg[u'to'] = []
+        msg[u'merge_vars'] = []
+        recipients = defaultdict(list)
+        for message in messages:
+            recipient = message.recipients[0]
+            rcp = {}
+            rcp[u'email'] = recipient.mail
+            if recipient.name:
+                rcp[u'name'] = recipient.name
+            rcp[u'type'] = u'to'
+            msg[u'to'].append(rcp)
+            msg[u'merge_vars'].append({
+                    u'rcpt': recipient.mail,
+                    u'vars': [
+                        {u'name': u'SUBJECT', u'content': message.subject},
+                        {u'name': u'HTML', u'content': message.html},
+                        {u'name': u'TEXT', u'content': message.text},
+                        ],
+                    })
+            recipients[recipient.mail].append(recipient)
+
+        data = {}
+        data[u'key'] = self.api_key
+        data[u'message'] = msg
+
+        response = self._post(self.api_send, data)
+
+        if response.status_code != 200:
+            raise RuntimeError(u'Sending Messages(pk__in=%s) failed with status code %s. Mandrill response: %s' %
+                    ([m.pk for m in messages], response.status_code, response.text))
+
+        self._update_recipients(response.json(), recipients)
+
+    def _batch_key(self, message):
+        # Only messages with a single "to" recipient and no attachments may be sent in a batch.
+        # Messages containing merge tags would be mangled by Mandrill.
+        if len(message.recipients) != 1 or message.recipients[0].type != message.recipients[0].TYPES.TO:
+            return None
+        if message.attachments:
+            return None
+        if any(u'*|' in c for c in (message.subject, message.html, message.text)):
+            return None
+        return (message.from_mail, message.from_name, bool(message.html), bool(message.text),
+                json.dumps(message.headers, sort_keys=True))
+
+    def _update_recipients(self, response, recipients):
+        for rcp in response:
             for recipient in recipients[rcp[u'email']]:
                 recipient.remote_id = rcp[u'_id']
 
@@ -14,7 +14,7 @@ from django.conf import settings
 
 from poleno.utils.views import secure_required
 
-from .signals import webhook_event
+from .signals import webhook_event, webhook_events
 
 @require_http_methods([u'HEAD', u'GET', u'POST'])
 @csrf_exempt
@@ -62,5 +62,6 @@ def webhook(request):
             return HttpResponseBadRequest(u'Request syntax error')
         for event in data:
             webhook_event.send(sender=None, event_type=event['event'], data=event)
+        webhook_events.send(sender=None, events=data)
 
     return HttpResponse()
@@ -1,6 +1,10 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+from email.mime.base import MIMEBase
+
+from django.conf import settings
 from django.core.mail import get_connection, EmailMultiAlternatives, EmailMessage
+from django.core.mail.message import DEFAULT_ATTACHMENT_MIME_TYPE
 
 from .base import BaseTransport
 
@@ -28,7 +32,7 @@ class SmtpTransport(BaseTransport):
         kwargs[u'to'] = (r.formatted for r in message.recipients_to)
         kwargs[u'cc'] = (r.formatted for r in message.recipients_cc)
         kwargs[u'bcc'] = (r.formatted for r in message.recipients_bcc)
-        kwargs[u'attachments'] = ((a.name, a.content, a.content_type) for a in message.attachments)
+        kwargs[u'attachments'] = (self._attachment(a) for a in message.attachments)
         kwargs[u'headers'] = message.headers
 
         if message.text and message.html:
@@ -45,3 +49,28 @@ class SmtpTransport(BaseTransport):
         for recipient in message.recipients:
             recipient.status = recipient.STATUSES.SENT
             recipient.save(update_fields=[u'status'])
+
+    def _attachment(self, attachment):
+        u"""
+        Attachments are base64 encoded in chunks, so their raw content is never loaded into memory
+        as a whole. Text attachments are labeled with the default charset just like ``EmailMessage``
+        labels them.
+        """
+        content_type = attachment.content_type or DEFAULT_ATTACHMENT_MIME_TYPE
+        if u'/' not in content_type:
+            content_type = DEFAULT_ATTACHMENT_MIME_TYPE
+        maintype, subtype = content_type.split(u'/', 1)
+
+        if maintype == u'text':
+            part = MIMEBase(maintype, subtype, charset=settings.DEFAULT_CHARSET)
+        else:
+            part = MIMEBase(maintype, subtype)
+        part.set_payload(b''.join(attachment.base64_chunks(mime=True)))
+        part[u'Content-Transfer-Encoding'] = u'base64'
+        if attachment.name:
+            try:
+                filename = attachment.name.encode(u'ascii')
+            except UnicodeEncodeError:
+                filename = (u'utf-8', u'', attachment.name)
+            part.add_header(u'Content-Disposition', u'attachment', filename=filename)
+        return part
@@ -103,6 +103,7 @@ def _check_rec(lang, basedir, rootdir, curdir, autofix):
     # Rootlinks
     if curdir == rootdir:
         filenames.discard(u'@')
+        filenames.discard(pages.PageTree.GENERATION_FILE)
         rootlink = os.path.join(rootdir, u'@')
         if not os.path.islink(rootlink) or os.readlink(rootlink) != u'.':
             yield datacheck.Warning(u'Invalid or missing rootlink /%s/@', lang, autofixable=True)
@@ -132,3 +133,5 @@ def check(superficial, autofix):
         if os.path.isdir(rootdir):
             for issue in _check_rec(lang, basedir, rootdir, rootdir, autofix):
                 yield issue
+            if autofix:
+                pages.PageTree.invalidate(rootdir)
@@ -2,19 +2,23 @@
 # -*- coding: utf-8 -*-
 import os
 import re
+import copy
 import shutil
+import threading
 import functools
 import collections
 import codecs
 import logging
 import mimetypes
 
+from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.core.files.storage import default_storage
 from django.template import Context, Template, Origin
 from django.utils.functional import cached_property
 from django.utils.translation import get_language
 
+from poleno.utils.misc import random_string
 from poleno.utils.translation import translation
 
 path_regex = re.compile(r'^/(?:[a-z0-9]+(?:-[a-z0-9]+)*/)*$')
@@ -130,6 +134,258 @@ def fix_slashes(path):
     return path
 
 
+class PageTree(object):
+    u"""
+    In-memory index of all pages in one language built by a single walk of the root page
+    directory. The index holds resolved paths, configs and sorted subpages of all pages and targets
+    of all redirects, so looking up a page costs just a single stat of the generation stamp file.
+
+    The index is shared by all threads of the process and is rebuilt whenever the generation stamp
+    file "_generation" in the root page directory changes. All mutable ``Page`` methods replace the
+    stamp, so all processes notice the change. If you change the page directories by hand, touch
+    the stamp file to let running processes rebuild their indexes.
+    """
+    GENERATION_FILE = u'_generation'
+
+    _trees = {}
+    _lock = threading.Lock()
+
+    class _Page(object):
+        def __init__(self, pagedir, config, error):
+            self.pagedir = pagedir
+            self.config = config  # None iff error
+            self.error = error    # None iff config
+            self.subpages = []    # Names of subpages and redirects sorted by their order
+            self.broken = []      # (name, error) pairs of broken subpages and redirects
+
+    class _Redirect(object):
+        def __init__(self, pagedir, redirect, target):
+            self.pagedir = pagedir
+            self.redirect = redirect  # Redirect path or InvalidPageError
+            self.target = target      # Resolved target path or InvalidPageError
+
+    @classmethod
+    def get_rootdir(cls, lang):
+        return os.path.realpath(default_storage.path(u'pages/' + lang))
+
+    @classmethod
+    def get_generation(cls, rootdir):
+        try:
+            statobj = os.stat(os.path.join(rootdir, cls.GENERATION_FILE))
+        except OSError:
+            return None
+        return (statobj.st_ino, statobj.st_mtime, statobj.st_size)
+
+    @classmethod
+    def invalidate(cls, rootdir):
+        stampfile = os.path.join(rootdir, cls.GENERATION_FILE)
+        tmp = stampfile + u'.tmp~'
+        with open(tmp, u'wb') as f:
+            f.write(random_string(20))
+        os.rename(tmp, stampfile)
+        with cls._lock:
+            cls._trees.pop(rootdir, None)
+
+    @classmethod
+    def get(cls, lang):
+        u"""
+        Returns the current page tree for ``lang``. Creates an empty root page if the language
+        has no pages yet.
+        """
+        rootdir = cls.get_rootdir(lang)
+        if not os.path.lexists(rootdir):
+            os.makedirs(rootdir)
+            os.symlink(u'.', os.path.join(rootdir, u'@'))
+        generation = cls.get_generation(rootdir)
+        with cls._lock:
+            tree = cls._trees.get(rootdir)
+            if tree is None or tree.generation != generation:
+                tree = cls(lang, rootdir, generation)
+                cls._trees[rootdir] = tree
+            return tree
+
+    def __init__(self, lang, rootdir, generation=None):
+        self.lang = lang
+        self.rootdir = rootdir
+        self.generation = generation
+        self.pages = {}      # Resolved page path -> _Page
+        self.redirects = {}  # Resolved parent path + redirect name -> _Redirect
+        self._build()
+
+    def _read_conf_file(self, pagedir):
+        conffile = os.path.join(pagedir, u'page.conf')
+        try:
+            if os.path.isfile(conffile):
+                return Config(conffile)
+            else:
+                return Config()
+        except (IOError, PageError) as e:
+            raise InvalidPageError(e)
+
+    def _read_symlink(self, pagedir):
+        link = os.readlink(pagedir)
+        if u'/@/' not in link:
+            raise InvalidPageError(u'Invalid redirect: %s' % link)
+
+        redirect = u'/' + link.split(u'/@/', 1)[1]
+        if not path_regex.match(redirect):
+            raise InvalidPageError(u'Invalid redirect: %s' % link)
+
+        return redirect
+
+    def _resolve_symlink(self, pagedir):
+        rootdir = self.rootdir
+        target = os.path.realpath(pagedir)
+
+        if not target.startswith(rootdir + os.sep) and target != rootdir:
+            raise InvalidPageError(u'Redirected outside root dir.')
+        if not os.path.exists(target):
+            raise InvalidPageError(u'Page does not exist: /%s' % os.path.relpath(target, rootdir))
+        if not os.path.isdir(target):
+            raise InvalidPageError(u'Not a directory: /%s' % os.path.relpath(target, rootdir))
+
+        realpath = target[len(rootdir):] + u'/'
+
+        if not path_regex.match(realpath):
+            raise InvalidPageError(u'Redirected to an invalid path: %s' % realpath)
+
+        return realpath
+
+    def _build(self):
+        stack = [u'/']
+        while stack:
+            path = stack.pop()
+            pagedir = self.rootdir + path.rstrip(u'/')
+            try:
+                page = self._Page(pagedir, self._read_conf_file(pagedir), None)
+            except InvalidPageError as e:
+                page = self._Page(pagedir, None, e)
+            self.pages[path] = page
+
+            for name in os.listdir(pagedir):
+                if not slug_regex.match(name):
+                    continue
+                subpagedir = os.path.join(pagedir, name)
+                if os.path.islink(subpagedir):
+                    try:
+                        redirect = self._read_symlink(subpagedir)
+                    except InvalidPageError as e:
+                        redirect = e
+                    try:
+                        target = self._resolve_symlink(subpagedir)
+                    except InvalidPageError as e:
+                        target = e
+                    self.redirects[path + name + u'/'] = self._Redirect(subpagedir, redirect, target)
+                elif os.path.isdir(subpagedir):
+                    stack.append(path + name + u'/')
+                else:
+                    continue
+                page.subpages.append(name)
+
+        # Sort subpages by their order and separate broken ones. We have to wait until all pages
+        # are read, because the order is defined by the subpage configs.
+        for path, page in self.pages.items():
+            keys = []
+            for name in page.subpages:
+                subpath = path + name + u'/'
+                if subpath in self.redirects:
+                    redirect = self.redirects[subpath].redirect
+                    if isinstance(redirect, InvalidPageError):
+                        page.broken.append((name, redirect))
+                    else:
+                        keys.append((u'~' + name, name))
+                else:
+                    subpage = self.pages[subpath]
+                    if subpage.error is not None:
+                        page.broken.append((name, subpage.error))
+                    else:
+                        keys.append((subpage.config.get(u'order') or name, name))
+            keys.sort()
+            page.subpages = [name for key, name in keys]
+
+    def resolve(self, path):
+        u"""
+        Returns the page path ``path`` with all redirects expanded.
+        """
+        realpath = u'/'
+        for name in path.strip(u'/').split(u'/') if path != u'/' else []:
+            subpath = realpath + name + u'/'
+            if subpath in self.pages:
+                realpath = subpath
+            elif subpath in self.redirects:
+                realpath = self.redirects[subpath].target
+                if isinstance(realpath, InvalidPageError):
+                    raise realpath
+            elif os.path.lexists(self.rootdir + subpath.rstrip(u'/')):
+                raise InvalidPageError(u'Not a directory: %s' % subpath.rstrip(u'/'))
+            else:
+                raise InvalidPageError(u'Page does not exist: %s' % subpath.rstrip(u'/'))
+        return realpath
+
+
+class TemplateCache(object):
+    u"""
+    Thread-safe LRU cache of page templates keyed by page language and path. Every entry holds the
+    template source and the compiled template and remembers inode, modification time and size of
+    the template file it was read from. The entry is used only while the file still matches, so
+    serving a cached template costs just a single stat. Templates are compiled lazily on their
+    first render.
+    """
+
+    class _Entry(object):
+        def __init__(self, stamp, source):
+            self.stamp = stamp
+            self.source = source
+            self.compiled = None
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, filepath):
+        u"""
+        Returns the cached template source for ``key`` reading it from ``filepath`` if the file
+        has changed since it was cached. Returns None if the file can not be read.
+        """
+        try:
+            statobj = os.stat(filepath)
+        except OSError:
+            self.invalidate(key)
+            return None
+        stamp = (statobj.st_ino, statobj.st_mtime, statobj.st_size)
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry.stamp == stamp:
+                self._entries[key] = entry
+                return entry
+
+        try:
+            with codecs.open(filepath, u'rb', u'utf-8') as f:
+                entry = self._Entry(stamp, f.read())
+        except IOError:
+            return None
+
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def compile(self, entry, path):
+        if entry.compiled is None:
+            origin = PageOrigin(entry.source, path)
+            entry.compiled = Template(entry.source, origin)
+        return entry.compiled
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+template_cache = TemplateCache(getattr(settings, u'PAGES_TEMPLATE_CACHE_SIZE', 200))
+
+
 @functools.total_ordering
 class File(object):
     u"""
@@ -302,44 +558,6 @@ class Page(object):
     # Private methods
     ##########
 
-    def _resolve_path(self, rootdir, path):
-        pagedir = os.path.realpath(rootdir + path)
-
-        if not pagedir.startswith(rootdir + os.sep) and pagedir != rootdir:
-            raise InvalidPageError(u'Redirected outside root dir.')
-        if not os.path.exists(pagedir):
-            raise InvalidPageError(u'Page does not exist: /%s' % os.path.relpath(pagedir, rootdir))
-        if not os.path.isdir(pagedir):
-            raise InvalidPageError(u'Not a directory: /%s' % os.path.relpath(pagedir, rootdir))
-
-        realpath = pagedir[len(rootdir):] + u'/'
-
-        if not path_regex.match(realpath):
-            raise InvalidPageError(u'Redirected to an invalid path: %s' % realpath)
-
-        return realpath, pagedir
-
-    def _read_conf_file(self, pagedir):
-        conffile = os.path.join(pagedir, u'page.conf')
-        try:
-            if os.path.isfile(conffile):
-                return Config(conffile)
-            else:
-                return Config()
-        except (IOError, PageError) as e:
-            raise InvalidPageError(e)
-
-    def _read_symlink(self, pagedir):
-        link = os.readlink(pagedir)
-        if u'/@/' not in link:
-            raise InvalidPageError(u'Invalid redirect: %s' % link)
-
-        redirect = u'/' + link.split(u'/@/', 1)[1]
-        if not path_regex.match(redirect):
-            raise InvalidPageError(u'Invalid redirect: %s' % link)
-
-        return redirect
-
     def _fix_redirects(self, pagedir):
         stack = [pagedir]
         while stack:
@@ -361,7 +579,7 @@ class Page(object):
     # Magic methods
     ##########
 
-    def __init__(self, path, lang=None, keep_last=False):
+    def __init__(self, path, lang=None, keep_last=False, _tree=None):
         u"""
         Returns the page on ``path`` recursively expanding all redirects. If ``keep_last`` is True,
         the last path component is not expanded and returned as is even if it is a redirect.
@@ -374,29 +592,35 @@ class Page(object):
         if not path_regex.match(path):
             raise InvalidPageError(u'Invalid path: %s' % path)
 
-        rootdir = os.path.realpath(default_storage.path(u'pages/' + lang))
-        if not os.path.lexists(rootdir):
-            os.makedirs(rootdir)
-            os.symlink(u'.', os.path.join(rootdir, u'@'))
+        tree = _tree or PageTree.get(lang)
+        rootdir = tree.rootdir
 
         isroot = (path == u'/')
-        if keep_last and not isroot and os.path.islink(rootdir + path.rstrip(u'/')):
-            name = path.rsplit(u'/', 2)[-2]
-            ppath = path[:-len(name)-1]
-            ppath, ppagedir = self._resolve_path(rootdir, ppath)
+        name = path.rsplit(u'/', 2)[-2]
+        ppath = path[:-len(name)-1]
+        if keep_last and not isroot and tree.resolve(ppath) + name + u'/' in tree.redirects:
+            ppath = tree.resolve(ppath)
             path = ppath + name + u'/'
-            pagedir = os.path.join(ppagedir, name)
+            node = tree.redirects[path]
+            if isinstance(node.redirect, InvalidPageError):
+                raise node.redirect
+            pagedir = node.pagedir
             config = None
-            redirect = self._read_symlink(pagedir)
+            redirect = node.redirect
         else:
-            path, pagedir = self._resolve_path(rootdir, path)
+            path = tree.resolve(path)
             name = path.rsplit(u'/', 2)[-2]
             ppath = path[:-len(name)-1]
             isroot = (path == u'/')
-            config = self._read_conf_file(pagedir)
+            node = tree.pages[path]
+            if node.error is not None:
+                raise node.error
+            pagedir = node.pagedir
+            config = node.config
             redirect = None
 
         # Private properties
+        self._tree = tree
         self._lang = lang
         self._path = path
         self._ppath = ppath
@@ -404,7 +628,7 @@ class Page(object):
         self._isroot = isroot
         self._pagedir = pagedir    # os path to the page dir/symlink
         self._rootdir = rootdir    # os path to the root page dir
-        self._config = config      # None iff redirect
+        self._config = config      # None iff redirect; Shared with the page tree, do not modify
         self._redirect = redirect  # None iff not redirect
 
     def __eq__(self, other):
@@ -434,7 +658,7 @@ class Page(object):
     def parent(self):
         if self._isroot:
             return None
-        return Page(self._ppath, self._lang)
+        return Page(self._ppath, self._lang, _tree=self._tree)
 
     @cached_property
     def ancestors(self):
@@ -448,23 +672,16 @@ class Page(object):
 
     @cached_property
     def subpages(self):
-        if not os.path.isdir(self._pagedir) or os.path.islink(self._pagedir):
+        if self._redirect is not None:
             return []
 
-        res = []
-        for file in os.listdir(self._pagedir):
-            path = os.path.join(self._pagedir, file)
-            if os.path.isdir(path) or os.path.islink(path):
-                if slug_regex.match(file):
-                    try:
-                        res.append(self.subpage(file))
-                    except InvalidPageError as e:
-                        logging.getLogger(u'poleno.pages').error(u'Page /%s%s%s/ is broken: %s', self._lang, self._path, file, e)
-        res.sort()
-        return res
+        node = self._tree.pages[self._path]
+        for name, e in node.broken:
+            logging.getLogger(u'poleno.pages').error(u'Page /%s%s%s/ is broken: %s', self._lang, self._path, name, e)
+        return [self.subpage(name) for name in node.subpages]
 
     def subpage(self, name):
-        return Page(self._path + name + u'/', self._lang, keep_last=True)
+        return Page(self._path + name + u'/', self._lang, keep_last=True, _tree=self._tree)
 
     def walk(self):
         stack = [self]
@@ -559,15 +776,15 @@ class Page(object):
         return self._config.write_to_string()
 
     @cached_property
-    def template(self):
+    def _template_entry(self):
         if self._redirect is not None:
             return None
+        return template_cache.get((self._lang, self._path), os.path.join(self._pagedir, u'page.html'))
 
-        try:
-            with codecs.open(os.path.join(self._pagedir, u'page.html'), u'rb', u'utf-8') as f:
-                return f.read()
-        except IOError:
-            return None
+    @cached_property
+    def template(self):
+        entry = self._template_entry
+        return entry.source if entry is not None else None
 
     ##########
     # Non-mutable public methods
@@ -599,8 +816,8 @@ class Page(object):
 
     def render(self):
         if self.template:
-            origin = PageOrigin(self.template, self._path)
-            return Template(self.template, origin).render(Context({
+            template = template_cache.compile(self._template_entry, self._path)
+            return template.render(Context({
                 u'page': self,
                 }))
         else:
@@ -618,6 +835,7 @@ class Page(object):
             shutil.rmtree(self._pagedir)
         else:
             os.remove(self._pagedir)
+        PageTree.invalidate(self._rootdir)
 
     def create_subpage(self, name, template=None, raw_config=None, **entries):
         if self._redirect is not None:
@@ -646,6 +864,7 @@ class Page(object):
             with codecs.open(os.path.join(pagedir, u'page.html'), u'wb', u'utf-8') as f:
                 f.write(template)
 
+        PageTree.invalidate(self._rootdir)
         return Page(path, self._lang)
 
     def move(self, parent, name):
@@ -672,6 +891,7 @@ class Page(object):
         os.symlink(os.path.relpath(self._rootdir, os.path.dirname(self._pagedir)) + u'/@' + path, self._pagedir)
         self._fix_redirects(pagedir)
 
+        PageTree.invalidate(self._rootdir)
         return Page(path, self._lang)
 
     def save_redirect(self, redirect):
@@ -685,6 +905,7 @@ class Page(object):
 
         os.remove(self._pagedir)
         os.symlink(os.path.relpath(self._rootdir, os.path.dirname(self._pagedir)) + u'/@' + target.path, self._pagedir)
+        PageTree.invalidate(self._rootdir)
 
     def save_config(self, raw_config=None, **entries):
         if self._redirect is not None:
@@ -692,11 +913,14 @@ class Page(object):
         if raw_config is not None and entries:
             raise ParseConfigError(u'Cannot change raw config and individual options at the same time.')
 
+        config = copy.deepcopy(self._config)
         if raw_config is not None:
-            self._config.read_from_string(raw_config)
+            config.read_from_string(raw_config)
         else:
-            self._config.set_multiple(**entries)
-        self._config.write(os.path.join(self._pagedir, u'page.conf'))
+            config.set_multiple(**entries)
+        config.write(os.path.join(self._pagedir, u'page.conf'))
+        self._config = config
+        PageTree.invalidate(self._rootdir)
 
     def save_template(self, template):
         if self._redirect is not None:
@@ -719,6 +943,7 @@ class Page(object):
                     os.remove(tmp)
                 except OSError:
                     pass
+        template_cache.invalidate((self._lang, self._path))
 
     ##########
     # Attached files
@@ -0,0 +1,210 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import os
+from testfixtures import TempDirectory
+
+from django.template import Context
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from .. import pages
+from ..checks import check
+
+class PageTreeTest(TestCase):
+    u"""
+    Tests ``PageTree`` index invalidation by the generation stamp file.
+    """
+
+    def setUp(self):
+        self.tempdir = TempDirectory()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.tempdir.path,
+            )
+        self.settings_override.enable()
+        pages.PageTree._trees.clear()
+
+        self.root = pages.Page(u'/', u'en')
+        self.root.create_subpage(u'first', title=u'First')
+        self.root.create_subpage(u'second', title=u'Second')
+
+    def tearDown(self):
+        pages.PageTree._trees.clear()
+        self.settings_override.disable()
+        self.tempdir.cleanup()
+
+    def _restore_stale_tree(self, tree):
+        # Mutations drop the tree from the index of this process only. Another process still holds
+        # its old tree, so we simulate it by putting the old tree back.
+        pages.PageTree._trees[tree.rootdir] = tree
+
+    def _assert_mutation_seen(self, mutate, check_page, lang=u'en'):
+        tree = pages.PageTree.get(lang)
+        mutate()
+        self.assertNotEqual(pages.PageTree.get_generation(tree.rootdir), tree.generation)
+
+        # Another process still holding the stale tree sees the changed stamp and rebuilds it.
+        self._restore_stale_tree(tree)
+        new_tree = pages.PageTree.get(lang)
+        self.assertIsNot(new_tree, tree)
+        self.assertEqual(new_tree.generation, pages.PageTree.get_generation(tree.rootdir))
+        check_page()
+
+
+    def test_tree_is_reused_while_generation_is_unchanged(self):
+        tree = pages.PageTree.get(u'en')
+        self.assertIs(pages.PageTree.get(u'en'), tree)
+        self.assertIs(pages.Page(u'/first/', u'en')._tree, tree)
+
+    def test_create_subpage_bumps_generation(self):
+        self._assert_mutation_seen(
+                lambda: pages.Page(u'/first/', u'en').create_subpage(u'third', title=u'Third'),
+                lambda: self.assertEqual(pages.Page(u'/first/third/', u'en').title, u'Third'),
+                )
+
+    def test_delete_bumps_generation(self):
+        def check_page():
+            with self.assertRaisesMessage(pages.InvalidPageError, u'Page does not exist: /second'):
+                pages.Page(u'/second/', u'en')
+        self._assert_mutation_seen(lambda: pages.Page(u'/second/', u'en').delete(), check_page)
+
+    def test_move_bumps_generation(self):
+        def check_page():
+            self.assertEqual(pages.Page(u'/second/moved/', u'en').title, u'First')
+            self.assertEqual(pages.Page(u'/first/', u'en').path, u'/second/moved/')
+            self.assertTrue(pages.Page(u'/first/', u'en', keep_last=True).is_redirect)
+        self._assert_mutation_seen(
+                lambda: pages.Page(u'/first/', u'en').move(pages.Page(u'/second/', u'en'), u'moved'),
+                check_page,
+                )
+
+    def test_save_redirect_bumps_generation(self):
+        pages.Page(u'/first/', u'en').move(self.root, u'third')
+        self._assert_mutation_seen(
+                lambda: pages.Page(u'/first/', u'en', keep_last=True).save_redirect(u'/second/'),
+                lambda: self.assertEqual(pages.Page(u'/first/', u'en').path, u'/second/'),
+                )
+
+    def test_save_config_bumps_generation(self):
+        self._assert_mutation_seen(
+                lambda: pages.Page(u'/first/', u'en').save_config(title=u'Changed', order=u'third'),
+                lambda: self.assertEqual(
+                    [(p.name, p.title) for p in pages.Page(u'/', u'en').subpages],
+                    [(u'second', u'Second'), (u'first', u'Changed')]),
+                )
+
+    def test_datacheck_autofix_bumps_generation(self):
+        pages.Page(u'/first/', u'en').move(self.root, u'renamed')
+        sk_root = pages.Page(u'/', u'sk')
+        sk_root.create_subpage(u'prvy', lang_en=u'/first/')
+        def check_page():
+            self.assertEqual(pages.Page(u'/prvy/', u'sk').translation_path(u'en'), u'/renamed/')
+        def autofix():
+            issues = list(check(superficial=False, autofix=True))
+            self.assertIn(u'Page /sk/prvy/page.conf EN translation is /first/ but its canonical form is /renamed/', [i.msg for i in issues])
+        self._assert_mutation_seen(autofix, check_page, lang=u'sk')
+
+    def test_datacheck_without_autofix_does_not_bump_generation(self):
+        tree = pages.PageTree.get(u'en')
+        list(check(superficial=False, autofix=False))
+        self.assertEqual(pages.PageTree.get_generation(tree.rootdir), tree.generation)
+        self.assertIs(pages.PageTree.get(u'en'), tree)
+
+    def test_touching_generation_file_rebuilds_tree(self):
+        tree = pages.PageTree.get(u'en')
+        os.mkdir(os.path.join(tree.rootdir, u'manual'))
+        self.assertIs(pages.PageTree.get(u'en'), tree)
+        self.assertEqual([p.name for p in pages.Page(u'/', u'en').subpages], [u'first', u'second'])
+
+        pages.PageTree.invalidate(tree.rootdir)
+        self._restore_stale_tree(tree)
+        self.assertEqual([p.name for p in pages.Page(u'/', u'en').subpages], [u'first', u'manual', u'second'])
+
+class TemplateCacheTest(TestCase):
+    u"""
+    Tests ``TemplateCache`` invalidation by template file stamps and its LRU bound.
+    """
+
+    def setUp(self):
+        self.tempdir = TempDirectory()
+        self.cache = pages.TemplateCache(3)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _write(self, name, content, mtime=None):
+        path = self.tempdir.write(name, content.encode(u'utf-8'))
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def _render(self, key, path):
+        entry = self.cache.get(key, path)
+        return self.cache.compile(entry, u'/%s/' % key).render(Context())
+
+
+    def test_unchanged_file_is_compiled_once(self):
+        path = self._write(u'a.html', u'Hello', mtime=1000)
+        entry = self.cache.get(u'a', path)
+        compiled = self.cache.compile(entry, u'/a/')
+        self.assertIs(self.cache.get(u'a', path), entry)
+        self.assertIs(self.cache.compile(self.cache.get(u'a', path), u'/a/'), compiled)
+
+    def test_edited_file_is_recompiled(self):
+        path = self._write(u'a.html', u'Hello', mtime=1000)
+        self.assertEqual(self._render(u'a', path), u'Hello')
+
+        # The same file edited in place keeps its inode, but changes its size and mtime.
+        with open(path, u'r+b') as f:
+            f.write(b'Howdy')
+        os.utime(path, (2000, 2000))
+        self.assertEqual(self._render(u'a', path), u'Howdy')
+
+    def test_replaced_file_is_recompiled(self):
+        path = self._write(u'a.html', u'Hello', mtime=1000)
+        self.assertEqual(self._render(u'a', path), u'Hello')
+
+        # A file of the same size and mtime renamed over the template differs just by its inode.
+        tmp = self._write(u'a.html.tmp', u'Howdy', mtime=1000)
+        os.rename(tmp, path)
+        self.assertEqual(self._render(u'a', path), u'Howdy')
+
+    def test_deleted_file_is_forgotten(self):
+        path = self._write(u'a.html', u'Hello')
+        self.cache.get(u'a', path)
+        os.remove(path)
+        self.assertIsNone(self.cache.get(u'a', path))
+        self.assertNotIn(u'a', self.cache._entries)
+
+    def test_invalidate(self):
+        path = self._write(u'a.html', u'Hello')
+        entry = self.cache.get(u'a', path)
+        self.cache.invalidate(u'a')
+        self.assertIsNot(self.cache.get(u'a', path), entry)
+
+    def test_lru_bound(self):
+        paths = {k: self._write(u'%s.html' % k, k) for k in [u'a', u'b', u'c', u'd', u'e']}
+        for key in [u'a', u'b', u'c']:
+            self.cache.get(key, paths[key])
+        self.assertEqual(list(self.cache._entries), [u'a', u'b', u'c'])
+
+        # Using "a" makes "b" the least recently used entry.
+        self.cache.get(u'a', paths[u'a'])
+        self.cache.get(u'd', paths[u'd'])
+        self.assertEqual(list(self.cache._entries), [u'c', u'a', u'd'])
+
+        self.cache.get(u'e', paths[u'e'])
+        self.assertEqual(list(self.cache._entries), [u'a', u'd', u'e'])
+        self.assertEqual(len(self.cache._entries), self.cache.size)
+
+    def test_page_template_is_reread_after_save_template(self):
+        with TempDirectory() as tempdir:
+            with override_settings(MEDIA_ROOT=tempdir.path):
+                pages.PageTree._trees.clear()
+                try:
+                    root = pages.Page(u'/', u'en')
+                    page = root.create_subpage(u'first', template=u'Hello')
+                    self.assertEqual(pages.Page(u'/first/', u'en').template, u'Hello')
+                    page.save_template(u'Howdy')
+                    self.assertEqual(pages.Page(u'/first/', u'en').template, u'Howdy')
+                finally:
+                    pages.PageTree._trees.clear()
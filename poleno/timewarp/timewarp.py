@@ -164,10 +164,13 @@ class Timewarp(object):
             return
         if self._lastupdate and self._lastupdate + 1 > time_orig.time():
             return
+        # The cache backend may ask for the current time while we are reading it, so we update all
+        # the values at once to keep them consistent.
         self._recursive = True
-        self._warped_from = cache.get(u'timewarp.warped_from')
-        self._warped_to = cache.get(u'timewarp.warped_to')
-        self._speedup = cache.get(u'timewarp.speedup', 1)
+        values = cache.get_many([u'timewarp.warped_from', u'timewarp.warped_to', u'timewarp.speedup'])
+        self._warped_from = values.get(u'timewarp.warped_from')
+        self._warped_to = values.get(u'timewarp.warped_to')
+        self._speedup = values.get(u'timewarp.speedup', 1)
         self._recursive = False
         self._lastupdate = time_orig.time()
 
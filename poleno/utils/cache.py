@@ -0,0 +1,208 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import os
+import time
+import sqlite3
+import cPickle as pickle
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+class SqliteCache(BaseCache):
+    u"""
+    Cache backend storing all entries in a single SQLite database file in WAL mode. Suitable for
+    single host deployments with multiple processes, as all processes on the host share the same
+    cache. Unlike ``FileBasedCache`` it does not open a file for every access and it does not list
+    any directories when culling. Entries are looked up by their primary key and expired or least
+    recently used entries are evicted.
+
+    ``LOCATION`` is the path to the database file. The file and its directory are created when
+    needed. Besides the common ``MAX_ENTRIES`` and ``CULL_FREQUENCY`` options the backend supports
+    the following options:
+     -- ``CULL_EVERY``: How many writes a process makes between checking whether the cache has
+        grown over ``MAX_ENTRIES``. Defaults to 50.
+     -- ``ACCESS_RESOLUTION``: Reading an entry writes its access time only if the recorded access
+        time is older than the given number of seconds, so frequently read entries do not cause a
+        write on every read. Defaults to 10.
+     -- ``BUSY_TIMEOUT``: How many seconds a write waits for another process writing to the cache.
+        Defaults to 10. Reads never wait to write access times, they skip them if the cache is
+        locked.
+
+    Example:
+        CACHES = {
+            u'default': {
+                u'BACKEND': u'poleno.utils.cache.SqliteCache',
+                u'LOCATION': u'/var/cache/project/cache.sqlite',
+                u'OPTIONS': {u'MAX_ENTRIES': 10000},
+                },
+            }
+    """
+
+    def __init__(self, location, params):
+        super(SqliteCache, self).__init__(params)
+        options = params.get(u'OPTIONS', {})
+        self._location = location
+        self._cull_every = int(options.get(u'CULL_EVERY', 50))
+        self._access_resolution = float(options.get(u'ACCESS_RESOLUTION', 10))
+        self._busy_timeout = float(options.get(u'BUSY_TIMEOUT', 10))
+        self._connection = None
+        self._pid = None
+        self._writes = 0
+
+    def _get_connection(self):
+        # Connections may not be shared with forked processes.
+        if self._connection is None or self._pid != os.getpid():
+            dirname = os.path.dirname(self._location)
+            if dirname and not os.path.isdir(dirname):
+                try:
+                    os.makedirs(dirname)
+                except OSError:
+                    if not os.path.isdir(dirname):
+                        raise
+            connection = sqlite3.connect(self._location, timeout=self._busy_timeout, isolation_level=None)
+            connection.execute(u'PRAGMA journal_mode=WAL')
+            connection.execute(u'PRAGMA synchronous=NORMAL')
+            connection.execute(u'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL, accessed REAL NOT NULL)')
+            connection.execute(u'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def _make_key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _insert(self, connection, key, value, timeout, replace):
+        now = time.time()
+        pickled = sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        expires = self.get_backend_timeout(timeout)
+        if not replace:
+            connection.execute(u'DELETE FROM cache WHERE key = ? AND expires <= ?', (key, now))
+        cursor = connection.execute(u'INSERT OR %s INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)' % (
+                u'REPLACE' if replace else u'IGNORE'), (key, pickled, expires, now))
+        self._writes += 1
+        return cursor.rowcount == 1
+
+    def _maybe_cull(self, connection):
+        if self._writes < self._cull_every:
+            return
+        self._writes = 0
+        now = time.time()
+        connection.execute(u'DELETE FROM cache WHERE expires <= ?', (now,))
+        count = connection.execute(u'SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count <= self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            connection.execute(u'DELETE FROM cache')
+        else:
+            # Evict the least recently used entries until the cache is under its limit again, and
+            # then a fraction of the remaining entries as with the other backends.
+            doomed = count - self._max_entries + self._max_entries // self._cull_frequency
+            connection.execute(u'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)', (doomed,))
+
+    def _write(self, func):
+        connection = self._get_connection()
+        connection.execute(u'BEGIN IMMEDIATE')
+        try:
+            res = func(connection)
+            self._maybe_cull(connection)
+        except:
+            connection.execute(u'ROLLBACK')
+            raise
+        connection.execute(u'COMMIT')
+        return res
+
+    def _touch(self, connection, keys, now):
+        # Access times are just a hint. If another process is writing to the cache, we skip them
+        # rather than waiting for it.
+        connection.execute(u'PRAGMA busy_timeout = 0')
+        try:
+            connection.executemany(u'UPDATE cache SET accessed = ? WHERE key = ?', [(now, k) for k in keys])
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            connection.execute(u'PRAGMA busy_timeout = %d' % (self._busy_timeout * 1000))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._make_key(key, version)
+        return self._write(lambda c: self._insert(c, key, value, timeout, replace=False))
+
+    def get(self, key, default=None, version=None):
+        key = self._make_key(key, version)
+        connection = self._get_connection()
+        now = time.time()
+        row = connection.execute(u'SELECT value, expires, accessed FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= now):
+            return default
+        if row[2] < now - self._access_resolution:
+            self._touch(connection, [key], now)
+        try:
+            return pickle.loads(str(row[0]))
+        except pickle.PickleError:
+            return default
+
+    def get_many(self, keys, version=None):
+        keys = dict((self._make_key(k, version), k) for k in keys)
+        if not keys:
+            return {}
+        connection = self._get_connection()
+        now = time.time()
+        res = {}
+        stale = []
+        made_keys = list(keys)
+        # SQLite limits the number of query parameters.
+        for i in range(0, len(made_keys), 500):
+            batch = made_keys[i:i+500]
+            rows = connection.execute(u'SELECT key, value, expires, accessed FROM cache WHERE key IN (%s)' % (
+                    u', '.join(u'?' * len(batch))), batch).fetchall()
+            for made_key, value, expires, accessed in rows:
+                if expires is not None and expires <= now:
+                    continue
+                try:
+                    res[keys[made_key]] = pickle.loads(str(value))
+                except pickle.PickleError:
+                    continue
+                if accessed < now - self._access_resolution:
+                    stale.append(made_key)
+        if stale:
+            self._touch(connection, stale, now)
+        return res
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._make_key(key, version)
+        self._write(lambda c: self._insert(c, key, value, timeout, replace=True))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        data = [(self._make_key(k, version), v) for k, v in data.items()]
+        def func(connection):
+            for key, value in data:
+                self._insert(connection, key, value, timeout, replace=True)
+        self._write(func)
+
+    def delete(self, key, version=None):
+        key = self._make_key(key, version)
+        self._get_connection().execute(u'DELETE FROM cache WHERE key = ?', (key,))
+
+    def delete_many(self, keys, version=None):
+        keys = [(self._make_key(k, version),) for k in keys]
+        self._write(lambda c: c.executemany(u'DELETE FROM cache WHERE key = ?', keys))
+
+    def incr(self, key, delta=1, version=None):
+        made_key = self._make_key(key, version)
+        def func(connection):
+            row = connection.execute(u'SELECT value, expires FROM cache WHERE key = ?', (made_key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] <= time.time()):
+                raise ValueError(u"Key '%s' not found" % key)
+            value = pickle.loads(str(row[0])) + delta
+            pickled = sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+            connection.execute(u'UPDATE cache SET value = ? WHERE key = ?', (pickled, made_key))
+            return value
+        return self._write(func)
+
+    def has_key(self, key, version=None):
+        key = self._make_key(key, version)
+        row = self._get_connection().execute(u'SELECT expires FROM cache WHERE key = ?', (key,)).fetchone()
+        return row is not None and (row[0] is None or row[0] > time.time())
+
+    def clear(self):
+        self._get_connection().execute(u'DELETE FROM cache')
@@ -1,18 +1,158 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 import os
+import re
 import stat
 
-from django.http import HttpResponseNotModified, FileResponse, JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, FileResponse, StreamingHttpResponse, JsonResponse
 from django.views.static import was_modified_since
-from django.utils.http import http_date, urlquote
+from django.utils.http import http_date, urlquote, parse_etags, quote_etag, parse_http_date_safe
 
-def send_file_response(request, path, name, content_type, attachment=True):
-    # Based on: django.views.static.serve
+from poleno.utils.misc import random_string
+
+# Requests with more ranges are served with the whole file.
+MAX_RANGES = 20
+RANGE_CHUNK_SIZE = 64*1024
+
+def _offload_header(path):
+    u"""
+    Returns header name and value to let the web server send the file at ``path``, or None if
+    the file should be sent by Django. Configured with ``SEND_FILE_OFFLOAD`` setting:
+     -- None: Files are sent by Django (default);
+     -- "x-sendfile": Files are sent by Apache mod_xsendfile or Lighttpd using "X-Sendfile"
+        header;
+     -- "x-accel-redirect": Files are sent by Nginx using "X-Accel-Redirect" header. Nginx needs
+        an internal location for every directory the files are sent from. Directories are mapped
+        to the locations by ``SEND_FILE_ACCEL_LOCATIONS`` setting, e.g. ``{MEDIA_ROOT:
+        u'/protected/media/'}``. Files outside mapped directories are sent by Django.
+    """
+    mode = getattr(settings, u'SEND_FILE_OFFLOAD', None)
+    path = os.path.abspath(path)
+    if mode == u'x-sendfile':
+        return u'X-Sendfile', path
+    if mode == u'x-accel-redirect':
+        locations = getattr(settings, u'SEND_FILE_ACCEL_LOCATIONS', {})
+        for root, location in locations.items():
+            root = os.path.join(os.path.abspath(root), u'')
+            if path.startswith(root):
+                return u'X-Accel-Redirect', location.rstrip(u'/') + u'/' + urlquote(path[len(root):])
+        return None
+    if mode is not None:
+        raise ValueError(u'Invalid SEND_FILE_OFFLOAD setting: %r' % mode)
+    return None
+
+def _parse_range(header, size):
+    u"""
+    Parses "Range" request header and returns a list of ``(first, last)`` byte positions of the
+    requested ranges within a file with ``size`` bytes. Overlapping and adjacent ranges are merged.
+    Returns None if the header is malformed or the ranges should be ignored and the whole file
+    sent, and an empty list if none of the ranges is satisfiable.
+    """
+    match = re.match(r'^\s*bytes\s*=\s*(.*)$', header or u'')
+    if not match:
+        return None
+    specs = [spec.strip() for spec in match.group(1).split(u',') if spec.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        match = re.match(r'^(\d*)\s*-\s*(\d*)$', spec)
+        if not match or not (match.group(1) or match.group(2)):
+            return None
+        if match.group(1):
+            first = int(match.group(1))
+            last = int(match.group(2)) if match.group(2) else size - 1
+            if last < first:
+                return None
+        else:
+            first = size - int(match.group(2))
+            last = size - 1
+            if last < first:
+                continue
+        if first >= size:
+            continue
+        ranges.append((max(first, 0), min(last, size - 1)))
+    ranges.sort()
+    merged = []
+    for first, last in ranges:
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
 
-    # FIXME: If running on real Apache server, we should use "X-SENDFILE" header to let Apache
-    # serve the file. It's much faster. Possibly will be fixed in Django 1.8.
-    # See: http://django.readthedocs.org/en/latest/ref/request-response.html#django.http.FileResponse
+def _if_range_matches(header, etag, mtime):
+    u"""
+    Checks whether "If-Range" request header ``header`` matches the current file. Only strong
+    validators match: an exact ETag or the exact "Last-Modified" date.
+    """
+    if header is None:
+        return True
+    header = header.strip()
+    if header.startswith(u'W/'):
+        return False
+    if header.startswith(u'"'):
+        return etag in parse_etags(header)
+    return parse_http_date_safe(header) == int(mtime)
+
+def _read_ranges(path, ranges, chunk_size=RANGE_CHUNK_SIZE):
+    u"""
+    Generator yielding content of the given byte ranges of the file at ``path``. Strings are
+    yielded as they are, so multipart boundaries may be interleaved with the ranges.
+    """
+    with open(path, u'rb') as f:
+        for item in ranges:
+            if not isinstance(item, tuple):
+                yield item
+                continue
+            first, last = item
+            f.seek(first)
+            remaining = last - first + 1
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+def _range_response(path, ranges, size, content_type):
+    u"""
+    Returns "206 Partial Content" response with the given byte ranges of the file at ``path``. A
+    single range is sent as it is, multiple ranges are sent as "multipart/byteranges".
+    """
+    if len(ranges) == 1:
+        first, last = ranges[0]
+        response = StreamingHttpResponse(_read_ranges(path, ranges), status=206, content_type=content_type)
+        response[u'Content-Range'] = u'bytes %d-%d/%d' % (first, last, size)
+        response[u'Content-Length'] = last - first + 1
+        return response
+
+    boundary = random_string(32)
+    parts = []
+    length = 0
+    for first, last in ranges:
+        head = (u'--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' % (
+                boundary, content_type, first, last, size)).encode(u'utf-8')
+        parts.extend([head, (first, last), b'\r\n'])
+        length += len(head) + last - first + 1 + 2
+    tail = (u'--%s--\r\n' % boundary).encode(u'utf-8')
+    parts.append(tail)
+    length += len(tail)
+    response = StreamingHttpResponse(_read_ranges(path, parts), status=206,
+            content_type=u'multipart/byteranges; boundary=%s' % boundary)
+    response[u'Content-Length'] = length
+    return response
+
+def send_file_response(request, path, name, content_type, attachment=True, etag=None):
+    u"""
+    Sends the file at ``path`` supporting conditional and range requests. ``etag`` is a strong
+    validator of the file content. If omitted, it is derived from the file modification time and
+    size. Clients may revalidate the file with "If-None-Match" or "If-Modified-Since" headers and
+    resume interrupted downloads with "Range" and "If-Range" headers. If the file is offloaded to
+    the web server, ranges are left for the web server to handle.
+    """
+    # Based on: django.views.static.serve
 
     # FIXME: "Content-Disposition" filename is very fragile if contains non-ASCII characters.
     # Current implementation works on Firefox, but probably fails on other browsers. We should test
@@ -20,11 +160,43 @@ def send_file_response(request, path, name, content_type, attachment=True):
     statobj = os.stat(path)
     if not stat.S_ISREG(statobj.st_mode):
         raise OSError(u'Not a regular file: %s' % path)
-    if not was_modified_since(request.META.get(u'HTTP_IF_MODIFIED_SINCE'), statobj.st_mtime, statobj.st_size):
-        return HttpResponseNotModified()
-    response = FileResponse(open(path, u'rb'), content_type=content_type)
+    if etag is None:
+        etag = u'%x-%x' % (int(statobj.st_mtime), statobj.st_size)
+
+    # "If-None-Match" takes precedence over "If-Modified-Since", see RFC 7232, section 6.
+    if_none_match = request.META.get(u'HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        etags = parse_etags(if_none_match)
+        not_modified = u'*' in etags or etag in etags
+    else:
+        not_modified = not was_modified_since(request.META.get(u'HTTP_IF_MODIFIED_SINCE'), statobj.st_mtime, statobj.st_size)
+    if not_modified:
+        response = HttpResponseNotModified()
+        response[u'ETag'] = quote_etag(etag)
+        return response
+
+    offload = _offload_header(path)
+    ranges = None
+    if offload is None and request.method in [u'GET', u'HEAD']:
+        if _if_range_matches(request.META.get(u'HTTP_IF_RANGE'), etag, statobj.st_mtime):
+            ranges = _parse_range(request.META.get(u'HTTP_RANGE'), statobj.st_size)
+
+    if offload is not None:
+        # The web server sends the file content and sets "Content-Length" header.
+        response = HttpResponse(content_type=content_type)
+        response[offload[0]] = offload[1]
+    elif ranges is None:
+        response = FileResponse(open(path, u'rb'), content_type=content_type)
+        response[u'Content-Length'] = statobj.st_size
+    elif not ranges:
+        response = HttpResponse(status=416)
+        response[u'Content-Range'] = u'bytes */%d' % statobj.st_size
+        return response
+    else:
+        response = _range_response(path, ranges, statobj.st_size, content_type)
+    response[u'Accept-Ranges'] = u'bytes'
+    response[u'ETag'] = quote_etag(etag)
     response[u'Last-Modified'] = http_date(statobj.st_mtime)
-    response[u'Content-Length'] = statobj.st_size
     if attachment:
         response[u'Content-Disposition'] = "attachment; filename*=UTF-8''%s" % urlquote(name)
     return response
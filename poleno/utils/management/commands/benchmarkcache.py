@@ -0,0 +1,54 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import os
+import time
+import random
+import shutil
+import tempfile
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.core.cache.backends.filebased import FileBasedCache
+
+from poleno.utils.cache import SqliteCache
+from poleno.utils.misc import random_string
+
+class Command(NoArgsCommand):
+    help = u'Compares speed of SqliteCache and FileBasedCache cache backends on temporary locations.'
+    option_list = NoArgsCommand.option_list + (
+        make_option(u'--operations', action=u'store', type=u'int', dest=u'operations', default=5000,
+            help=u'Number of operations of every kind to run.'),
+        make_option(u'--keys', action=u'store', type=u'int', dest=u'keys', default=500,
+            help=u'Number of distinct keys to use.'),
+        make_option(u'--value-size', action=u'store', type=u'int', dest=u'value_size', default=200,
+            help=u'Size of cached values in characters.'),
+        )
+
+    def _measure(self, func, operations):
+        start = time.time()
+        for i in xrange(operations):
+            func(i)
+        return operations / max(time.time() - start, 1e-9)
+
+    def handle_noargs(self, **options):
+        operations = options[u'operations']
+        keys = [u'key-%d' % i for i in xrange(options[u'keys'])]
+        value = random_string(options[u'value_size'])
+        params = {u'TIMEOUT': 300, u'OPTIONS': {u'MAX_ENTRIES': len(keys) * 2}}
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            backends = [
+                    (u'FileBasedCache', FileBasedCache(os.path.join(tempdir, u'filebased'), params)),
+                    (u'SqliteCache', SqliteCache(os.path.join(tempdir, u'cache.sqlite'), params)),
+                    ]
+            self.stdout.write(u'%-16s %12s %12s %12s %12s' % (u'Backend', u'set/s', u'get/s', u'miss/s', u'get_many/s'))
+            for name, cache in backends:
+                rnd = random.Random(0)
+                set_rate = self._measure(lambda i: cache.set(rnd.choice(keys), value), operations)
+                get_rate = self._measure(lambda i: cache.get(rnd.choice(keys)), operations)
+                miss_rate = self._measure(lambda i: cache.get(u'missing-%d' % i), operations)
+                many_rate = self._measure(lambda i: cache.get_many(rnd.sample(keys, 10)), operations // 10)
+                self.stdout.write(u'%-16s %12.0f %12.0f %12.0f %12.0f' % (name, set_rate, get_rate, miss_rate, many_rate))
+        finally:
+            shutil.rmtree(tempdir)
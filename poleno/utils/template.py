@@ -5,11 +5,14 @@ from inspect import getargspec
 from functools import partial
 
 from django import template
+from django.conf import settings
+from django.dispatch import receiver
 from django.template import TemplateSyntaxError, TemplateDoesNotExist
 from django.template.base import parse_bits
 from django.template.loader import BaseLoader, find_template_loader, render_to_string
 from django.utils.translation import get_language
 from django.utils.functional import lazy
+from django.test.signals import setting_changed
 
 from .misc import squeeze
 
@@ -39,13 +42,25 @@ class TranslationLoader(BaseLoader):
             ('poleno.utils.template.TranslationLoader', 'django.template.loaders.filesystem.Loader'),
             ('poleno.utils.template.TranslationLoader', 'django.template.loaders.app_directories.Loader'),
         )
+
+    Compiled templates are cached, as well as the fact that a template does not exist, so most
+    templates, having no translated version, do not make the wrapped loader search for the
+    translated template again and again. The cache is not used if DEBUG is set, so the templates
+    may be edited without restarting the server. The autoreloader restarts it only if python
+    files change.
     """
     is_usable = True
 
+    # Incremented whenever settings affecting template loading change, so all loaders reset their
+    # caches.
+    generation = 0
+
     def __init__(self, loader):
         super(TranslationLoader, self).__init__()
         self._loader = loader
         self._cached_loader = None
+        self._cache = {}
+        self._cache_generation = TranslationLoader.generation
 
     @property
     def loader(self):
@@ -54,13 +69,45 @@ class TranslationLoader(BaseLoader):
             self._cached_loader = find_template_loader(self._loader)
         return self._cached_loader
 
+    def reset(self):
+        self._cache.clear()
+        self._cache_generation = TranslationLoader.generation
+
+    def _load(self, template_name, template_dirs):
+        if settings.DEBUG:
+            return self.loader(template_name, template_dirs)
+        if self._cache_generation != TranslationLoader.generation:
+            self.reset()
+
+        key = (template_name, tuple(template_dirs) if template_dirs else None)
+        try:
+            result = self._cache[key]
+        except KeyError:
+            try:
+                result = self.loader(template_name, template_dirs)
+            except TemplateDoesNotExist:
+                result = None
+            # If the template could not be compiled, the loader returns its source instead. We
+            # do not cache such templates, just as ``django.template.loaders.cached.Loader``.
+            if result is None or hasattr(result[0], u'render'):
+                self._cache[key] = result
+
+        if result is None:
+            raise TemplateDoesNotExist(template_name)
+        return result
+
     def load_template(self, template_name, template_dirs=None):
         language = get_language()
         template_base, template_ext = splitext(template_name)
         try:
-            return self.loader(u'%s.%s%s' % (template_base, language, template_ext), template_dirs)
+            return self._load(u'%s.%s%s' % (template_base, language, template_ext), template_dirs)
         except TemplateDoesNotExist:
-            return self.loader(template_name, template_dirs)
+            return self._load(template_name, template_dirs)
+
+@receiver(setting_changed)
+def reset_translation_loaders_on_setting_changed(sender, setting, **kwargs):
+    if setting in [u'TEMPLATE_DIRS', u'TEMPLATE_LOADERS', u'INSTALLED_APPS', u'LANGUAGES', u'DEBUG']:
+        TranslationLoader.generation += 1
 
 
 class Library(template.Library):
@@ -0,0 +1,181 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import os
+import mock
+from testfixtures import TempDirectory
+
+from django.test import TestCase
+
+from poleno.utils.cache import SqliteCache
+
+class SqliteCacheTest(TestCase):
+    u"""
+    Tests ``SqliteCache`` cache backend. Checks that entries are stored, expired and evicted
+    correctly and that all cache instances using the same database file share the entries.
+    """
+
+    def setUp(self):
+        self.tempdir = TempDirectory()
+        self.location = os.path.join(self.tempdir.path, u'subdir', u'cache.sqlite')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+
+    def _create_cache(self, **options):
+        params = {u'TIMEOUT': options.pop(u'timeout', 300), u'OPTIONS': options}
+        return SqliteCache(self.location, params)
+
+
+    def test_set_and_get(self):
+        cache = self._create_cache()
+        cache.set(u'key', {u'value': [1, 2, 3]})
+        self.assertEqual(cache.get(u'key'), {u'value': [1, 2, 3]})
+        self.assertIsNone(cache.get(u'missing'))
+        self.assertEqual(cache.get(u'missing', u'default'), u'default')
+
+    def test_set_overwrites_value(self):
+        cache = self._create_cache()
+        cache.set(u'key', 1)
+        cache.set(u'key', 2)
+        self.assertEqual(cache.get(u'key'), 2)
+
+    def test_add(self):
+        cache = self._create_cache()
+        self.assertTrue(cache.add(u'key', 1))
+        self.assertFalse(cache.add(u'key', 2))
+        self.assertEqual(cache.get(u'key'), 1)
+
+    def test_add_replaces_expired_value(self):
+        cache = self._create_cache()
+        with mock.patch(u'time.time', return_value=1000.0):
+            cache.set(u'key', 1, 10)
+        with mock.patch(u'time.time', return_value=1020.0):
+            self.assertTrue(cache.add(u'key', 2))
+            self.assertEqual(cache.get(u'key'), 2)
+
+    def test_expired_value(self):
+        cache = self._create_cache()
+        with mock.patch(u'time.time', return_value=1000.0):
+            cache.set(u'key', 1, 10)
+            cache.set(u'forever', 2, None)
+        with mock.patch(u'time.time', return_value=1005.0):
+            self.assertEqual(cache.get(u'key'), 1)
+            self.assertTrue(cache.has_key(u'key'))
+        with mock.patch(u'time.time', return_value=1010.0):
+            self.assertIsNone(cache.get(u'key'))
+            self.assertFalse(cache.has_key(u'key'))
+            self.assertEqual(cache.get_many([u'key', u'forever']), {u'forever': 2})
+
+    def test_zero_timeout_does_not_store_value(self):
+        cache = self._create_cache()
+        cache.set(u'key', 1, 0)
+        self.assertIsNone(cache.get(u'key'))
+
+    def test_get_many_and_set_many(self):
+        cache = self._create_cache()
+        cache.set_many({u'a': 1, u'b': 2, u'c': 3})
+        self.assertEqual(cache.get_many([u'a', u'c', u'd']), {u'a': 1, u'c': 3})
+        self.assertEqual(cache.get_many([]), {})
+
+    def test_delete_and_delete_many(self):
+        cache = self._create_cache()
+        cache.set_many({u'a': 1, u'b': 2, u'c': 3})
+        cache.delete(u'a')
+        cache.delete_many([u'b', u'd'])
+        self.assertEqual(cache.get_many([u'a', u'b', u'c']), {u'c': 3})
+
+    def test_clear(self):
+        cache = self._create_cache()
+        cache.set_many({u'a': 1, u'b': 2})
+        cache.clear()
+        self.assertEqual(cache.get_many([u'a', u'b']), {})
+
+    def test_incr_and_decr(self):
+        cache = self._create_cache()
+        cache.set(u'key', 10)
+        self.assertEqual(cache.incr(u'key'), 11)
+        self.assertEqual(cache.decr(u'key', 5), 6)
+        self.assertEqual(cache.get(u'key'), 6)
+        with self.assertRaisesMessage(ValueError, u"Key 'missing' not found"):
+            cache.incr(u'missing')
+
+    def test_versions_are_separate(self):
+        cache = self._create_cache()
+        cache.set(u'key', 1, version=1)
+        cache.set(u'key', 2, version=2)
+        self.assertEqual(cache.get(u'key', version=1), 1)
+        self.assertEqual(cache.get(u'key', version=2), 2)
+
+    def test_instances_share_entries(self):
+        cache1 = self._create_cache()
+        cache2 = self._create_cache()
+        cache1.set(u'key', 1)
+        self.assertEqual(cache2.get(u'key'), 1)
+        cache2.delete(u'key')
+        self.assertIsNone(cache1.get(u'key'))
+
+    def test_get_does_not_wait_for_locked_cache(self):
+        cache = self._create_cache(ACCESS_RESOLUTION=0, BUSY_TIMEOUT=5)
+        with mock.patch(u'time.time', return_value=1000.0):
+            cache.set_many({u'a': 1, u'b': 2})
+
+        # Another process holds the write lock.
+        locker = self._create_cache()._get_connection()
+        locker.execute(u'BEGIN IMMEDIATE')
+        try:
+            # ``time.time()`` is mocked, so we measure the elapsed time with ``os.times()``.
+            start = os.times()[4]
+            with mock.patch(u'time.time', return_value=1010.0):
+                with mock.patch.object(cache, u'_touch', wraps=cache._touch) as mock_touch:
+                    self.assertEqual(cache.get(u'a'), 1)
+                    self.assertEqual(cache.get_many([u'a', u'b']), {u'a': 1, u'b': 2})
+            self.assertEqual(mock_touch.call_count, 2)
+            self.assertLess(os.times()[4] - start, 2)
+        finally:
+            locker.execute(u'ROLLBACK')
+
+        # Access times were skipped and the busy timeout for writes is restored.
+        connection = cache._get_connection()
+        self.assertEqual(connection.execute(u'SELECT accessed FROM cache').fetchall(), [(1000.0,), (1000.0,)])
+        self.assertEqual(connection.execute(u'PRAGMA busy_timeout').fetchone()[0], 5000)
+
+    def test_get_writes_access_time(self):
+        cache = self._create_cache(ACCESS_RESOLUTION=5)
+        with mock.patch(u'time.time', return_value=1000.0):
+            cache.set(u'a', 1)
+        with mock.patch(u'time.time', return_value=1004.0):
+            cache.get(u'a')
+        connection = cache._get_connection()
+        self.assertEqual(connection.execute(u'SELECT accessed FROM cache').fetchone()[0], 1000.0)
+        with mock.patch(u'time.time', return_value=1006.0):
+            cache.get(u'a')
+        self.assertEqual(connection.execute(u'SELECT accessed FROM cache').fetchone()[0], 1006.0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = self._create_cache(timeout=None, MAX_ENTRIES=4, CULL_FREQUENCY=4, CULL_EVERY=1, ACCESS_RESOLUTION=0)
+        for i, key in enumerate([u'a', u'b', u'c', u'd']):
+            with mock.patch(u'time.time', return_value=1000.0 + i):
+                cache.set(key, i)
+        with mock.patch(u'time.time', return_value=1010.0):
+            cache.get(u'a')
+        with mock.patch(u'time.time', return_value=1020.0):
+            cache.set(u'e', 4)
+        self.assertEqual(cache.get_many([u'a', u'b', u'c', u'd', u'e']), {u'a': 0, u'd': 3, u'e': 4})
+
+    def test_expired_entries_are_evicted_first(self):
+        cache = self._create_cache(MAX_ENTRIES=2, CULL_EVERY=1, ACCESS_RESOLUTION=0)
+        with mock.patch(u'time.time', return_value=1000.0):
+            cache.set(u'a', 1, None)
+            cache.set(u'b', 2, 10)
+        with mock.patch(u'time.time', return_value=1020.0):
+            cache.set(u'c', 3, None)
+        self.assertEqual(cache.get_many([u'a', u'b', u'c']), {u'a': 1, u'c': 3})
+
+    def test_cache_is_checked_for_culling_periodically(self):
+        cache = self._create_cache(MAX_ENTRIES=2, CULL_FREQUENCY=2, CULL_EVERY=5)
+        keys = [u'a', u'b', u'c', u'd', u'e']
+        cache.set_many({u'a': 1, u'b': 2, u'c': 3, u'd': 4})
+        self.assertEqual(len(cache.get_many(keys)), 4)
+        cache.set(u'e', 5)
+        self.assertEqual(len(cache.get_many(keys)), 1)
@@ -6,7 +6,7 @@ import json
 from testfixtures import TempDirectory
 
 from django.conf.urls import patterns, url
-from django.http import HttpResponseNotModified, FileResponse
+from django.http import HttpResponse, HttpResponseNotModified, FileResponse, StreamingHttpResponse
 from django.utils.http import urlquote, urlencode, http_date
 from django.test import TestCase
 
@@ -17,9 +17,10 @@ class SendFileResponseTest(TestCase):
     u"""
     Tests ``send_file_response()`` function. Checks that regular files are sent correctly, but
     sending non-regular or non-existent files raises an exception. Also checks that if the request
-    has ``HTTP_IF_MODIFIED_SINCE`` header, the file is sent only if it was changes since then.
-    Finally checks if ``Last-Modified``, ``Content-Disposition`` and ``Content-Length`` headers are
-    set correctly.
+    has ``HTTP_IF_MODIFIED_SINCE`` or ``HTTP_IF_NONE_MATCH`` header, the file is sent only if it was
+    changes since then, and that ``HTTP_RANGE`` and ``HTTP_IF_RANGE`` headers are respected. Finally
+    checks if ``Last-Modified``, ``ETag``, ``Content-Disposition`` and ``Content-Length`` headers
+    are set correctly and files are offloaded to the web server if configured.
     """
 
     def file_view(request):
@@ -28,8 +29,12 @@ class SendFileResponseTest(TestCase):
         content_type = request.GET[u'content-type']
         return send_file_response(request, path, name, content_type)
 
+    def etag_view(request):
+        return send_file_response(request, request.GET[u'path'], u'name', u'text/plain', etag=u'explicit')
+
     urls = patterns(u'',
         url(r'^file/$', file_view),
+        url(r'^etag/$', etag_view),
         )
 
     def setUp(self):
@@ -144,3 +149,150 @@ class SendFileResponseTest(TestCase):
         name = random_string(20, chars=u'BａｃòԉíρｓûϻᏧｏｌｒѕìｔãｍｅéӽѵ߀ɭｐèлｕｉｎ.Iüà,ɦëǥｈƅɢïêｇԁSùúâɑｆäｂƃｄｋϳɰյƙｙáFХ-åɋｗ')
         response = self._request_file(path, name)
         self.assertEqual(response[u'Content-Disposition'], u"attachment; filename*=UTF-8''%s" % urlquote(name))
+
+    def test_x_sendfile_offload(self):
+        path = self._create_file()
+        with self.settings(SEND_FILE_OFFLOAD=u'x-sendfile'):
+            response = self._request_file(path, u'thefile.txt')
+        self._check_response(response, HttpResponse, 200)
+        self.assertEqual(response.content, u'')
+        self.assertEqual(response[u'X-Sendfile'], path)
+        self.assertEqual(response[u'Content-Type'], u'text/plain')
+        self.assertEqual(response[u'Content-Disposition'], u"attachment; filename*=UTF-8''thefile.txt")
+        self.assertIn(u'Last-Modified', response)
+
+    def test_x_sendfile_offload_respects_if_modified_since(self):
+        modified_timestamp = 1413500000
+        path = self._create_file()
+        os.utime(path, (modified_timestamp, modified_timestamp))
+        with self.settings(SEND_FILE_OFFLOAD=u'x-sendfile'):
+            response = self._request_file(path, HTTP_IF_MODIFIED_SINCE=http_date(modified_timestamp + 1000))
+        self._check_response(response, HttpResponseNotModified, 304)
+
+    def test_x_accel_redirect_offload(self):
+        path = self._create_file(u'my file.tmp')
+        with self.settings(SEND_FILE_OFFLOAD=u'x-accel-redirect', SEND_FILE_ACCEL_LOCATIONS={self.tempdir.path: u'/protected/'}):
+            response = self._request_file(path)
+        self._check_response(response, HttpResponse, 200)
+        self.assertEqual(response.content, u'')
+        self.assertEqual(response[u'X-Accel-Redirect'], u'/protected/my%20file.tmp')
+
+    def test_x_accel_redirect_offload_with_unmapped_directory_sends_file(self):
+        path = self._create_file()
+        with self.settings(SEND_FILE_OFFLOAD=u'x-accel-redirect', SEND_FILE_ACCEL_LOCATIONS={u'/nonexistent/': u'/protected/'}):
+            response = self._request_file(path)
+        self._check_response(response, FileResponse, 200)
+        self._check_content(response, path)
+        self.assertNotIn(u'X-Accel-Redirect', response)
+
+    def test_etag_header(self):
+        path = self._create_file(content=u'1234567890')
+        os.utime(path, (1413500000, 1413500000))
+        response = self._request_file(path)
+        self.assertEqual(response[u'ETag'], u'"54404c60-a"')
+        self.assertEqual(response[u'Accept-Ranges'], u'bytes')
+
+    def test_etag_header_with_explicit_etag(self):
+        path = self._create_file()
+        response = self.client.get(u'/etag/', {u'path': path})
+        self.assertEqual(response[u'ETag'], u'"explicit"')
+
+    def test_if_none_match_with_matching_etag(self):
+        path = self._create_file()
+        response = self.client.get(u'/etag/', {u'path': path}, HTTP_IF_NONE_MATCH=u'"other", "explicit"')
+        self._check_response(response, HttpResponseNotModified, 304)
+        self.assertEqual(response[u'ETag'], u'"explicit"')
+
+    def test_if_none_match_with_star(self):
+        path = self._create_file()
+        response = self.client.get(u'/etag/', {u'path': path}, HTTP_IF_NONE_MATCH=u'*')
+        self._check_response(response, HttpResponseNotModified, 304)
+
+    def test_if_none_match_with_different_etag_takes_precedence_over_if_modified_since(self):
+        path = self._create_file()
+        response = self.client.get(u'/etag/', {u'path': path}, HTTP_IF_NONE_MATCH=u'"other"',
+                HTTP_IF_MODIFIED_SINCE=http_date(os.stat(path).st_mtime + 1000))
+        self._check_response(response, FileResponse, 200)
+        self._check_content(response, path)
+
+    def test_single_range(self):
+        path = self._create_file(content=u'0123456789')
+        response = self._request_file(path, HTTP_RANGE=u'bytes=2-4')
+        self._check_response(response, StreamingHttpResponse, 206)
+        self.assertEqual(u''.join(response.streaming_content), u'234')
+        self.assertEqual(response[u'Content-Range'], u'bytes 2-4/10')
+        self.assertEqual(response[u'Content-Length'], u'3')
+        self.assertEqual(response[u'Content-Type'], u'text/plain')
+        self.assertEqual(response[u'Content-Disposition'], u"attachment; filename*=UTF-8''filename.bin")
+
+    def test_open_and_suffix_ranges(self):
+        path = self._create_file(content=u'0123456789')
+        response = self._request_file(path, HTTP_RANGE=u'bytes=7-')
+        self.assertEqual(u''.join(response.streaming_content), u'789')
+        response = self._request_file(path, HTTP_RANGE=u'bytes=-4')
+        self.assertEqual(u''.join(response.streaming_content), u'6789')
+        response = self._request_file(path, HTTP_RANGE=u'bytes=5-100')
+        self.assertEqual(response[u'Content-Range'], u'bytes 5-9/10')
+        self.assertEqual(u''.join(response.streaming_content), u'56789')
+
+    def test_large_range_is_read_in_chunks(self):
+        content = random_string(200*1024)
+        path = self._create_file(content=content)
+        response = self._request_file(path, HTTP_RANGE=u'bytes=1000-150999')
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(u''.join(chunks), content[1000:151000])
+
+    def test_multiple_ranges(self):
+        path = self._create_file(content=u'0123456789')
+        response = self._request_file(path, HTTP_RANGE=u'bytes=0-1, 6-7')
+        self._check_response(response, StreamingHttpResponse, 206)
+        content_type, boundary = response[u'Content-Type'].split(u'; boundary=')
+        self.assertEqual(content_type, u'multipart/byteranges')
+        content = u''.join(response.streaming_content)
+        self.assertEqual(content,
+                u'--%(b)s\r\nContent-Type: text/plain\r\nContent-Range: bytes 0-1/10\r\n\r\n01\r\n'
+                u'--%(b)s\r\nContent-Type: text/plain\r\nContent-Range: bytes 6-7/10\r\n\r\n67\r\n'
+                u'--%(b)s--\r\n' % {u'b': boundary})
+        self.assertEqual(response[u'Content-Length'], str(len(content)))
+
+    def test_overlapping_ranges_are_merged(self):
+        path = self._create_file(content=u'0123456789')
+        response = self._request_file(path, HTTP_RANGE=u'bytes=4-6,0-2,3-3')
+        self.assertEqual(response[u'Content-Range'], u'bytes 0-6/10')
+        self.assertEqual(u''.join(response.streaming_content), u'0123456')
+
+    def test_unsatisfiable_range(self):
+        path = self._create_file(content=u'0123456789')
+        response = self._request_file(path, HTTP_RANGE=u'bytes=10-20')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response[u'Content-Range'], u'bytes */10')
+
+    def test_malformed_range_sends_whole_file(self):
+        path = self._create_file(content=u'0123456789')
+        for header in [u'bytes=5-2', u'bytes=a-b', u'bytes=-', u'items=1-2', u'bytes=' + u','.join([u'1-2'] * 21)]:
+            response = self._request_file(path, HTTP_RANGE=header)
+            self._check_response(response, FileResponse, 200)
+            self._check_content(response, path)
+
+    def test_if_range_with_matching_validator(self):
+        path = self._create_file(content=u'0123456789')
+        response = self.client.get(u'/etag/', {u'path': path}, HTTP_RANGE=u'bytes=2-4', HTTP_IF_RANGE=u'"explicit"')
+        self._check_response(response, StreamingHttpResponse, 206)
+        last_modified = http_date(os.stat(path).st_mtime)
+        response = self._request_file(path, HTTP_RANGE=u'bytes=2-4', HTTP_IF_RANGE=last_modified)
+        self._check_response(response, StreamingHttpResponse, 206)
+
+    def test_if_range_with_different_validator_sends_whole_file(self):
+        path = self._create_file(content=u'0123456789')
+        for if_range in [u'"other"', u'W/"explicit"', http_date(os.stat(path).st_mtime - 1000)]:
+            response = self.client.get(u'/etag/', {u'path': path}, HTTP_RANGE=u'bytes=2-4', HTTP_IF_RANGE=if_range)
+            self._check_response(response, FileResponse, 200)
+            self._check_content(response, path)
+
+    def test_offloaded_file_ignores_range(self):
+        path = self._create_file()
+        with self.settings(SEND_FILE_OFFLOAD=u'x-sendfile'):
+            response = self._request_file(path, HTTP_RANGE=u'bytes=2-4')
+        self._check_response(response, HttpResponse, 200)
+        self.assertEqual(response[u'X-Sendfile'], path)
@@ -17,7 +17,8 @@ class TranslationLoaderTest(TestCase):
     Tests ``TranslationLoader`` template loader. Checks that the loader loads original template
     only if there is no translated template for the active language. If there is a translated
     template for the active languate, the loader loads this translated template. Also tests that an
-    exception is raised if there is no original nor translated template.
+    exception is raised if there is no original nor translated template. Checks that loaded and
+    missing templates are cached unless in debug mode.
     """
 
     def setUp(self):
@@ -63,3 +64,33 @@ class TranslationLoaderTest(TestCase):
         # Missing: second.html, second.en.html
         with self.assertRaises(TemplateDoesNotExist):
             render_to_string(u'second.html')
+
+    def test_loaded_templates_are_cached(self):
+        with translation(u'en'):
+            render_to_string(u'first.html')
+            os.remove(os.path.join(self.tempdir.path, u'first.en.html'))
+            rendered = squeeze(render_to_string(u'first.html'))
+            self.assertEqual(rendered, u'(first.en.html)')
+
+    def test_missing_translated_templates_are_cached(self):
+        with translation(u'de'):
+            render_to_string(u'first.html')
+            self.tempdir.write(u'first.de.html', u'(first.de.html)\n')
+            rendered = squeeze(render_to_string(u'first.html'))
+            self.assertEqual(rendered, u'(first.html)')
+
+    def test_templates_are_not_cached_in_debug_mode(self):
+        with self.settings(DEBUG=True):
+            with translation(u'de'):
+                render_to_string(u'first.html')
+                self.tempdir.write(u'first.de.html', u'(first.de.html)\n')
+                rendered = squeeze(render_to_string(u'first.html'))
+                self.assertEqual(rendered, u'(first.de.html)')
+
+    def test_cache_is_reset_if_template_dirs_change(self):
+        with translation(u'de'):
+            render_to_string(u'first.html')
+            self.tempdir.write(u'first.de.html', u'(first.de.html)\n')
+            with self.settings(TEMPLATE_DIRS=(self.tempdir.path,)):
+                rendered = squeeze(render_to_string(u'first.html'))
+                self.assertEqual(rendered, u'(first.de.html)')
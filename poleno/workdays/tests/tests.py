@@ -1,12 +1,12 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 import mock
-from datetime import date
+from datetime import date, timedelta
 
 from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
 
-from poleno.workdays.workdays import between, HolidaySet, FixedHoliday, EasterHoliday, SPECIFY_HOLIDAY_SET_ERROR
+from poleno.workdays.workdays import between, advance, between_many, advance_many, HolidaySet, FixedHoliday, EasterHoliday, SPECIFY_HOLIDAY_SET_ERROR
 
 class WorkdaysTest(TestCase):
     u"""
@@ -185,3 +185,86 @@ class WorkdaysTest(TestCase):
         # 2019-04-22 MON: fixed day holiday
         # 2019-04-23 TUE: easter based holiday
         self.assertEqual(between(date(2019, 4, 20), date(2019, 4, 23), holidays), 0) # SAT -- TUE
+
+class WorkdayIndexTest(TestCase):
+    u"""
+    Tests ``advance()`` function and ``HolidaySet.index`` computations against direct computations
+    with holiday sets with no usable index.
+    """
+
+    def _holidays(self, **kwargs):
+        return HolidaySet(
+                FixedHoliday(month=10, day=8, first_year=2008),
+                FixedHoliday(month=10, day=9, first_year=2012, last_year=2024),
+                FixedHoliday(month=12, day=31),
+                FixedHoliday(month=1, day=1),
+                EasterHoliday(days=1),
+                **kwargs)
+
+    def _dates(self):
+        # Dates inside, outside and around the edges of the 2012--2014 window.
+        res = []
+        for start in [date(2010, 12, 20), date(2011, 12, 24), date(2013, 3, 28), date(2014, 12, 24)]:
+            for i in range(12):
+                res.append(start + timedelta(days=i))
+        return res
+
+    def test_index_is_built_only_once(self):
+        holidays = self._holidays()
+        self.assertIs(holidays.index, holidays.index)
+
+    def test_index_window(self):
+        holidays = self._holidays(index_first_year=2012, index_last_year=2014)
+        self.assertEqual(holidays.index.between(date(2012, 1, 1), date(2014, 12, 31)), 3*261-8-3-3)
+        self.assertIsNone(holidays.index.between(date(2011, 12, 31), date(2012, 1, 2)))
+        self.assertIsNone(holidays.index.between(date(2014, 12, 31), date(2015, 1, 2)))
+        self.assertEqual(holidays.index.advance(date(2014, 12, 30), -1), date(2014, 12, 29))
+        self.assertIsNone(holidays.index.advance(date(2014, 12, 30), 1))
+        self.assertIsNone(holidays.index.advance(date(2012, 1, 3), -3))
+
+    def test_between_with_index_equals_between_without_index(self):
+        indexed = self._holidays(index_first_year=2012, index_last_year=2014)
+        direct = self._holidays(index_first_year=1900, index_last_year=1900)
+        for a in self._dates():
+            for b in self._dates():
+                self.assertEqual(between(a, b, indexed), between(a, b, direct), u'%s -- %s' % (a, b))
+
+    def test_advance_with_index_equals_advance_without_index(self):
+        indexed = self._holidays(index_first_year=2012, index_last_year=2014)
+        direct = self._holidays(index_first_year=1900, index_last_year=1900)
+        for a in self._dates():
+            for d in range(-12, 13):
+                self.assertEqual(advance(a, d, indexed), advance(a, d, direct), u'%s + %s' % (a, d))
+
+    def test_advance(self):
+        holidays = self._holidays()
+
+        self.assertEqual(advance(date(2014, 10, 6), 0, holidays), date(2014, 10, 6)) # MON + 0
+        self.assertEqual(advance(date(2014, 10, 6), 1, holidays), date(2014, 10, 7)) # MON + 1
+        self.assertEqual(advance(date(2014, 10, 7), 1, holidays), date(2014, 10, 10)) # TUE + 1 over 2 holidays
+        self.assertEqual(advance(date(2014, 10, 10), 1, holidays), date(2014, 10, 13)) # FRI + 1 over weekend
+        self.assertEqual(advance(date(2014, 10, 13), -1, holidays), date(2014, 10, 12)) # MON - 1
+        self.assertEqual(advance(date(2014, 10, 12), -2, holidays), date(2014, 10, 6)) # SUN - 2 over holidays
+        self.assertEqual(advance(date(2014, 10, 6), 10, holidays), date(2014, 10, 22)) # MON + 10
+        self.assertEqual(advance(date(1998, 10, 6), 10, holidays), date(1998, 10, 20)) # Outside the window
+
+        for a in self._dates():
+            for d in range(-12, 13):
+                self.assertEqual(between(a, advance(a, d, holidays), holidays), d)
+
+    def test_between_many_and_advance_many(self):
+        holidays = self._holidays(index_first_year=2012, index_last_year=2014)
+        pairs = [(a, b) for a in self._dates() for b in self._dates()]
+        self.assertEqual(between_many(pairs, holidays), [between(a, b, holidays) for a, b in pairs])
+        pairs = [(a, d) for a in self._dates() for d in range(-12, 13)]
+        self.assertEqual(advance_many(pairs, holidays), [advance(a, d, holidays) for a, d in pairs])
+        self.assertEqual(between_many([], holidays), [])
+        self.assertEqual(advance_many([], holidays), [])
+
+    def test_between_many_and_advance_many_with_undefined_holiday_set(self):
+        with mock.patch(u'poleno.workdays.workdays.settings') as settings:
+            del settings.HOLIDAYS_MODULE_PATH
+            with self.assertRaisesMessage(ImproperlyConfigured, SPECIFY_HOLIDAY_SET_ERROR):
+                between_many([])
+            with self.assertRaisesMessage(ImproperlyConfigured, SPECIFY_HOLIDAY_SET_ERROR):
+                advance_many([])
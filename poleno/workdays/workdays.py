@@ -1,15 +1,22 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import array
+import bisect
 import datetime
 from dateutil.easter import easter
 
 from django.core.exceptions import ImproperlyConfigured
 from django.conf import settings
+from django.utils.functional import cached_property
 from django.utils.importlib import import_module
 
 
 WEEKEND = [5, 6]
 
+# Default window of years covered by ``HolidaySet.index``
+INDEX_FIRST_YEAR = 2000
+INDEX_LAST_YEAR = 2050
+
 SPECIFY_HOLIDAY_SET_ERROR = u'Specify holiday_set or set global setting HOLIDAYS_MODULE_PATH.'
 
 def _holidays():
@@ -65,12 +72,81 @@ class EasterHoliday(Holiday):
     def __repr__(self):
         return u'%s(days=%s)' % (self.__class__.__name__, repr(self.days))
 
+class WorkdayIndex(object):
+    u"""
+    Cumulative counts of working days for every date in the window from ``first_year`` to
+    ``last_year`` (inclusive). With the index ``between()`` is computed with two array lookups
+    and ``advance()`` with a binary search. Both methods return None if the dates do not fit in the
+    window, so the caller may fall back to computing the result from the holiday set directly.
+    """
+    def __init__(self, holiday_set, first_year, last_year):
+        self.first = datetime.date(first_year, 1, 1)
+        self.last = datetime.date(last_year, 12, 31)
+
+        # ``counts[i]`` is the number of working days in interval (first, first+i]
+        self.counts = array.array('l', [0])
+        holidays = holiday_set.between(self.first, self.last)
+        count = 0
+        for i in range(1, (self.last - self.first).days + 1):
+            day = self.first + datetime.timedelta(days=i)
+            if day.weekday() not in WEEKEND and day not in holidays:
+                count += 1
+            self.counts.append(count)
+
+    def _offset(self, day):
+        offset = (day - self.first).days
+        return offset if 0 <= offset < len(self.counts) else None
+
+    def between(self, after, before):
+        u"""
+        Number of working days in interval (after, before] or None if any of the dates is outside
+        the window.
+        """
+        a = self._offset(after)
+        b = self._offset(before)
+        if a is None or b is None:
+            return None
+        return self.counts[b] - self.counts[a]
+
+    def advance(self, day, delta):
+        u"""
+        Advances ``day`` by ``delta`` working days or returns None if the day or the result is
+        outside the window. The result is the first matching date for positive ``delta`` and the
+        last matching date for negative ``delta``, the same as ``advance()`` function does.
+        """
+        if delta == 0:
+            return day
+        offset = self._offset(day)
+        if offset is None:
+            return None
+        target = self.counts[offset] + delta
+        if delta > 0:
+            res = bisect.bisect_left(self.counts, target)
+            if res == len(self.counts):
+                return None
+        else:
+            res = bisect.bisect_right(self.counts, target) - 1
+            if res < 0:
+                return None
+        return self.first + datetime.timedelta(days=res)
+
 class HolidaySet(object):
-    def __init__(self, *args):
+    def __init__(self, *args, **kwargs):
         u"""
-        Accepts Holiday objects
+        Accepts Holiday objects. Optional ``index_first_year`` and ``index_last_year`` keyword
+        arguments set the window of years covered by the precomputed workday index.
         """
         self.holidays = args
+        self.index_first_year = kwargs.pop(u'index_first_year', INDEX_FIRST_YEAR)
+        self.index_last_year = kwargs.pop(u'index_last_year', INDEX_LAST_YEAR)
+
+    @cached_property
+    def index(self):
+        u"""
+        Workday index for the configured window of years. It's built on the first use and reused
+        by all subsequent ``between()`` and ``advance()`` calls with this holiday set.
+        """
+        return WorkdayIndex(self, self.index_first_year, self.index_last_year)
 
     def between(self, after, before):
         u"""
@@ -106,7 +182,11 @@ def between(after, before, holiday_set=None):
     if not holiday_set:
         raise ImproperlyConfigured(SPECIFY_HOLIDAY_SET_ERROR)
 
-    # Having: after < before
+    res = holiday_set.index.between(after, before)
+    if res is not None:
+        return res
+
+    # Having: after < before and at least one of them outside the index window
     days = (before - after).days
     res = (days/7)*(7-len(WEEKEND)) # Full weeks
     res += len([1 for d in range(days%7) # At most 6 iterations for the remaining partial week
@@ -117,9 +197,11 @@ def between(after, before, holiday_set=None):
 
 def advance(day, delta, holiday_set=None):
     u"""
-    Advances the given ``date`` by ``delta`` working days. The function time complexity is
-    O(d log d), where d is ``delta``. It may be fixed to be O(d), but I'm too lazy to do it now.
-    The complexity may not be better than Ω(d) because there are Ω(d) holidays.
+    Advances the given ``date`` by ``delta`` working days. If both ``date`` and the result are
+    inside the window of the holiday set workday index, the result is found by a binary search in
+    the index in O(log n) time, where n is the number of days in the window. The index is built in
+    O(n) time on the first use. Otherwise the function falls back to computing the result
+    iteratively with ``between()`` in O(d log d) time, where d is ``delta``.
 
     The following invariants hold:
         advance(a, 0) == a
@@ -135,6 +217,46 @@ def advance(day, delta, holiday_set=None):
     if not holiday_set:
         raise ImproperlyConfigured(SPECIFY_HOLIDAY_SET_ERROR)
 
+    res = holiday_set.index.advance(day, delta)
+    if res is not None:
+        return res
+
     res = day + datetime.timedelta(days=delta)
     working = between(day, res, holiday_set)
     return advance(res, delta - working, holiday_set)
+
+def between_many(pairs, holiday_set=None):
+    u"""
+    Returns a list of ``between(after, before)`` for every ``(after, before)`` pair from the given
+    iterable. The holiday set is resolved just once and its index is used directly, so it's much
+    cheaper than calling ``between()`` for every pair separately.
+    """
+    if not holiday_set:
+        holiday_set = _holidays()
+    if not holiday_set:
+        raise ImproperlyConfigured(SPECIFY_HOLIDAY_SET_ERROR)
+
+    index = holiday_set.index
+    res = []
+    for after, before in pairs:
+        days = index.between(after, before)
+        res.append(days if days is not None else between(after, before, holiday_set))
+    return res
+
+def advance_many(pairs, holiday_set=None):
+    u"""
+    Returns a list of ``advance(day, delta)`` for every ``(day, delta)`` pair from the given
+    iterable. The holiday set is resolved just once and its index is used directly, so it's much
+    cheaper than calling ``advance()`` for every pair separately.
+    """
+    if not holiday_set:
+        holiday_set = _holidays()
+    if not holiday_set:
+        raise ImproperlyConfigured(SPECIFY_HOLIDAY_SET_ERROR)
+
+    index = holiday_set.index
+    res = []
+    for day, delta in pairs:
+        date = index.advance(day, delta)
+        res.append(date if date is not None else advance(day, delta, holiday_set))
+    return res